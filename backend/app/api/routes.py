@@ -1,11 +1,17 @@
 from __future__ import annotations
 
-from typing import List
+import asyncio
+import json
+from typing import AsyncIterator, List, Optional
 from uuid import UUID
 
-from fastapi import APIRouter, File, HTTPException, UploadFile
+from fastapi import APIRouter, File, Form, HTTPException, Query, Response, UploadFile
+from fastapi.responses import StreamingResponse
 
+from app.core.config import get_settings
+from app.core.metrics import timed
 from app.models.schemas import (
+    ChatBatchRequest,
     ChatRequest,
     ChatResponse,
     FileRecord,
@@ -13,45 +19,79 @@ from app.models.schemas import (
     ProcessRequest,
     ProcessStatus,
 )
+from app.services.openai_client import openai_client
 from app.services.processing import processing_manager
-from app.services.rag import run_rag
+from app.services.rag import arun_rag, arun_rag_batch, astream_rag, batch_result
 from app.services.storage import storage_service
 from app.utils.document_loader import guess_mime_type
 
 router = APIRouter(prefix="/api", tags=["rag"])
 
 
-@router.post("/files/upload", response_model=List[FileUploadResponse])
-async def upload_files(files: List[UploadFile] = File(...)) -> List[FileUploadResponse]:
-    responses: List[FileUploadResponse] = []
-    for file in files:
-        contents = await file.read()
-        stored = storage_service.upload_file(
-            contents,
+async def _read_upload(file: UploadFile, block_size: int) -> AsyncIterator[bytes]:
+    while True:
+        block = await file.read(block_size)
+        if not block:
+            return
+        yield block
+
+
+async def _store_upload(file: UploadFile, content_hash: Optional[str]) -> FileUploadResponse:
+    try:
+        stored = await storage_service.upload_stream(
+            _read_upload(file, get_settings().upload_block_size),
             blob_name=file.filename,
             content_type=guess_mime_type(file.filename),
+            content_hash=content_hash,
         )
-        responses.append(
-            FileUploadResponse(
-                blob_name=stored.name,
-                original_name=file.filename,
-                size_bytes=stored.size_bytes,
-                container=stored.container,
-            )
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    return FileUploadResponse(
+        blob_name=stored.name,
+        original_name=file.filename,
+        size_bytes=stored.size_bytes,
+        container=stored.container,
+        content_hash=stored.content_hash,
+        duplicate_of=stored.duplicate_of,
+    )
+
+
+@router.post("/files/upload", response_model=List[FileUploadResponse])
+async def upload_files(
+    files: List[UploadFile] = File(...),
+    # Optional SHA-256 hex digest per file, in the same order as files.
+    content_sha256: List[str] = Form(default=[]),
+) -> List[FileUploadResponse]:
+    if content_sha256 and len(content_sha256) != len(files):
+        raise HTTPException(status_code=400, detail="Send one content_sha256 per file")
+    hashes = [h.lower() or None for h in content_sha256] or [None] * len(files)
+    return list(
+        await asyncio.gather(
+            *(_store_upload(file, content_hash) for file, content_hash in zip(files, hashes))
         )
-    return responses
+    )
 
 
 @router.get("/files/recent", response_model=List[FileRecord])
-def list_recent_files(limit: int = 10) -> List[FileRecord]:
-    records = storage_service.list_recent(limit)
+def list_recent_files(
+    response: Response,
+    limit: int = Query(default=10, ge=1, le=1000),
+    cursor: Optional[str] = None,
+    state: Optional[str] = Query(default=None, pattern="^(pending|processing|processed)$"),
+) -> List[FileRecord]:
+    try:
+        records, next_cursor = storage_service.list_recent(limit, cursor=cursor, state=state)
+    except ValueError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
     return [
         FileRecord(
             name=r.name,
             size_bytes=r.size_bytes,
             uploaded_at=r.uploaded_at,
             container=r.container,
-            status="pending",
+            status=r.state,
         )
         for r in records
     ]
@@ -75,5 +115,60 @@ def get_processing_status(job_id: UUID) -> ProcessStatus:
 
 
 @router.post("/chat/completions", response_model=ChatResponse)
-def chat_completion(payload: ChatRequest) -> ChatResponse:
-    return run_rag(payload.question, payload.history, payload.top_k)
+async def chat_completion(payload: ChatRequest) -> ChatResponse:
+    try:
+        with timed("chat_request"):
+            return await arun_rag(
+                payload.question, payload.history, payload.top_k, payload.conversation_id
+            )
+    except TimeoutError as exc:
+        raise HTTPException(status_code=504, detail="Chat request timed out") from exc
+
+
+async def _sse_events(payload: ChatRequest) -> AsyncIterator[str]:
+    try:
+        async for event, data in astream_rag(
+            payload.question, payload.history, payload.top_k, payload.conversation_id
+        ):
+            yield f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    except TimeoutError:
+        yield f"event: error\ndata: {json.dumps({'detail': 'Chat request timed out'})}\n\n"
+    except Exception as exc:  # noqa: BLE001
+        yield f"event: error\ndata: {json.dumps({'detail': str(exc)})}\n\n"
+
+
+@router.post("/chat/stream")
+async def chat_stream(payload: ChatRequest) -> StreamingResponse:
+    return StreamingResponse(
+        _sse_events(payload),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _ndjson_results(payload: ChatBatchRequest, concurrency: int) -> AsyncIterator[str]:
+    async for index, result in arun_rag_batch(payload.requests, concurrency):
+        yield json.dumps(batch_result(index, result)) + "\n"
+
+
+@router.post("/chat/batch")
+async def chat_batch(payload: ChatBatchRequest) -> StreamingResponse:
+    settings = get_settings()
+    if len(payload.requests) > settings.chat_batch_max_requests:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {settings.chat_batch_max_requests} requests per batch",
+        )
+    concurrency = min(
+        payload.concurrency or settings.chat_batch_concurrency, settings.chat_batch_concurrency
+    )
+    return StreamingResponse(
+        _ndjson_results(payload, concurrency), media_type="application/x-ndjson"
+    )
+
+
+@router.get("/diagnostics/query-embedding-batches")
+def query_embedding_batches() -> dict:
+    if openai_client.query_batcher is None:
+        return {"enabled": False}
+    return {"enabled": True, **openai_client.query_batcher.stats()}
@@ -1,6 +1,13 @@
 from functools import lru_cache
 from pydantic_settings import BaseSettings
 
+# What each embedding model returns when no `dimensions` is requested.
+NATIVE_EMBEDDING_DIMENSIONS = {
+    "text-embedding-3-large": 3072,
+    "text-embedding-3-small": 1536,
+    "text-embedding-ada-002": 1536,
+}
+
 
 class Settings(BaseSettings):
     app_name: str = "Azure RAG MVP"
@@ -10,20 +17,109 @@ class Settings(BaseSettings):
     azure_storage_connection_string: str | None = None
     azure_storage_raw_container: str = "raw-documents"
     azure_storage_processed_container: str = "processed-documents"
+    upload_block_size: int = 4 * 1024 * 1024
+    upload_max_concurrency: int = 4
+    blob_catalog_reconcile_seconds: int = 300
+    blob_processed_mode: str = "move"
+    blob_state_concurrency: int = 16
 
-    azure_search_endpoint: str
-    azure_search_index: str
+    search_backend: str = "azure"
+    azure_search_endpoint: str | None = None
+    azure_search_index: str = "rag-index"
     azure_search_api_key: str | None = None
+    # Azure AI Search takes at most 1000 documents and 16 MB per indexing
+    # request; the byte limit applies to an estimate, so it keeps headroom.
+    search_batch_max_documents: int = 1000
+    search_batch_max_bytes: int = 15 * 1024 * 1024
+    search_index_concurrency: int = 4
+    search_index_max_attempts: int = 4
+    local_index_path: str | None = None
+    local_index_nprobe: int = 16
+    local_index_compact_threshold: int = 20000
 
     azure_openai_endpoint: str
     azure_openai_api_key: str
     azure_openai_gpt4o_deployment: str
     azure_openai_embedding_deployment: str
+    # The model behind the embedding deployment. embedding_dimensions defaults
+    # to its native size and is only sent to the API when it differs, since
+    # ada-002 rejects the parameter.
+    embedding_model: str = "text-embedding-3-large"
+    embedding_dimensions: int | None = None
+    vector_quantization: str = "none"
+    vector_oversampling: float = 4.0
 
     processing_chunk_size: int = 1500
     processing_chunk_overlap: int = 200
-    processing_batch_size: int = 10
+    processing_chunker: str = "native"
+    processing_chunk_tokens: int = 400
+    processing_chunk_overlap_tokens: int = 50
+    processing_batch_size: int = 64
     max_documents_per_run: int = 25
+    processing_incremental: bool = True
+    processing_queue_size: int = 8
+    processing_inline_workers: int = 1
+    processing_worker_lease_seconds: float = 120
+    processing_worker_claim_batch: int = 4
+    processing_worker_poll_seconds: float = 2.0
+    processing_worker_max_attempts: int = 3
+    processing_job_retention_hours: float = 168
+    processing_job_retention_count: int = 500
+    pdf_extract_workers: int = 0
+    pdf_parallel_min_pages: int = 128
+    pdf_pages_per_task: int = 32
+    processing_download_workers: int = 4
+    processing_parse_workers: int = 2
+    processing_split_workers: int = 1
+    processing_embed_workers: int = 4
+    processing_index_workers: int = 2
+    # Indexed together, so small documents share search requests.
+    processing_index_batch_size: int = 16
+    processing_index_batch_wait_ms: float = 100
+    processing_move_workers: int = 1
+    processing_move_batch_size: int = 32
+    processing_move_batch_wait_ms: float = 100
+
+    embedding_batch_max_tokens: int = 64_000
+    embedding_tpm_limit: int = 350_000
+    embedding_rpm_limit: int = 2_100
+    embedding_max_concurrency: int = 4
+    embedding_max_retries: int = 6
+    query_embedding_batch_window_ms: float = 5
+    query_embedding_batch_max: int = 32
+
+    local_state_dir: str = ".state"
+    startup_check_retry_seconds: float = 10
+    metrics_enabled: bool = True
+    embedding_cache_enabled: bool = True
+    embedding_cache_max_entries: int = 200_000
+
+    chat_retrieval_timeout_seconds: float = 10
+    chat_context_max_tokens: int = 6000
+    chat_completion_timeout_seconds: float = 60
+    # History budget per prompt: the rolling summary of older turns (at most
+    # chat_summary_max_tokens) plus as many recent turns as still fit.
+    chat_history_max_tokens: int = 800
+    chat_summary_max_tokens: int = 200
+    chat_condense_questions: bool = True
+    conversation_ttl_seconds: float = 86400
+    chat_batch_max_requests: int = 10_000
+    chat_batch_concurrency: int = 32
+
+    answer_cache_enabled: bool = True
+    answer_cache_max_entries: int = 1024
+    answer_cache_ttl_seconds: float = 3600
+    answer_cache_similarity_threshold: float = 0.95
+
+    @property
+    def vector_dimensions(self) -> int:
+        if self.embedding_dimensions:
+            return self.embedding_dimensions
+        if self.embedding_model not in NATIVE_EMBEDDING_DIMENSIONS:
+            raise ValueError(
+                f"Set EMBEDDING_DIMENSIONS for embedding model {self.embedding_model!r}"
+            )
+        return NATIVE_EMBEDDING_DIMENSIONS[self.embedding_model]
 
     class Config:
         env_file = ".env"
@@ -0,0 +1,239 @@
+from __future__ import annotations
+
+import bisect
+import time
+from threading import Lock
+from typing import Callable, Dict, Iterator, List, Sequence, Tuple
+
+from app.core.config import get_settings
+
+LATENCY_MS_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128, 256)
+
+ENABLED = get_settings().metrics_enabled
+
+
+class Histogram:
+    def __init__(self, buckets: Sequence[float]) -> None:
+        self.buckets = tuple(sorted(buckets))
+        self._counts = [0] * (len(self.buckets) + 1)
+        self._sum = 0.0
+        self._count = 0
+        self._lock = Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            self._counts[index] += 1
+            self._sum += value
+            self._count += 1
+
+    def snapshot(self) -> Dict[str, object]:
+        with self._lock:
+            counts = list(self._counts)
+            total, count = self._sum, self._count
+        cumulative: List[int] = []
+        running = 0
+        for value in counts:
+            running += value
+            cumulative.append(running)
+        return {
+            "buckets": {
+                **{str(bound): cumulative[i] for i, bound in enumerate(self.buckets)},
+                "+Inf": cumulative[-1],
+            },
+            "sum": total,
+            "count": count,
+        }
+
+
+class _Family:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str]) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        self._lock = Lock()
+
+    def _child(self, labels: Dict[str, str], factory: Callable[[], object]) -> object:
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        child = self._children.get(key)
+        if child is None:
+            with self._lock:
+                child = self._children.setdefault(key, factory())
+        return child
+
+    def _label_text(self, key: Tuple[str, ...], extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, key)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.documentation}"
+        yield f"# TYPE {self.name} {self.kind}"
+        for key, child in sorted(self._children.items()):
+            yield from self._render_child(key, child)
+
+    def _render_child(self, key: Tuple[str, ...], child: object) -> Iterator[str]:
+        raise NotImplementedError
+
+
+class _CounterValue:
+    def __init__(self) -> None:
+        self.value = 0.0
+        self.lock = Lock()
+
+
+class CounterFamily(_Family):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels: str) -> None:
+        if not ENABLED:
+            return
+        child = self._child(labels, _CounterValue)
+        with child.lock:
+            child.value += amount
+
+    def value(self, **labels: str) -> float:
+        child = self._children.get(tuple(str(labels[name]) for name in self.labelnames))
+        return child.value if child is not None else 0.0
+
+    def _render_child(self, key: Tuple[str, ...], child: _CounterValue) -> Iterator[str]:
+        yield f"{self.name}{self._label_text(key)} {_number(child.value)}"
+
+
+class HistogramFamily(_Family):
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Sequence[float],
+        labelnames: Sequence[str],
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels: str) -> None:
+        if not ENABLED:
+            return
+        self._child(labels, lambda: Histogram(self.buckets)).observe(value)
+
+    def snapshot(self, **labels: str) -> Dict[str, object]:
+        return self._child(labels, lambda: Histogram(self.buckets)).snapshot()
+
+    def time(self, **labels: str) -> "_Timer":
+        return _Timer(self, labels) if ENABLED else _NULL_TIMER
+
+    def _render_child(self, key: Tuple[str, ...], child: Histogram) -> Iterator[str]:
+        snapshot = child.snapshot()
+        for bound, count in snapshot["buckets"].items():
+            labels = self._label_text(key, 'le="' + bound + '"')
+            yield f"{self.name}_bucket{labels} {count}"
+        yield f"{self.name}_sum{self._label_text(key)} {_number(snapshot['sum'])}"
+        yield f"{self.name}_count{self._label_text(key)} {snapshot['count']}"
+
+
+class _Timer:
+    __slots__ = ("_family", "_labels", "_start")
+
+    def __init__(self, family: HistogramFamily, labels: Dict[str, str]) -> None:
+        self._family = family
+        self._labels = labels
+        self._start = 0.0
+
+    def __enter__(self) -> "_Timer":
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        self._family.observe(time.perf_counter() - self._start, **self._labels)
+
+
+class _NullTimer:
+    def __enter__(self) -> "_NullTimer":
+        return self
+
+    def __exit__(self, *exc_info: object) -> None:
+        return None
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class Registry:
+    def __init__(self) -> None:
+        self._families: Dict[str, _Family] = {}
+
+    def counter(
+        self, name: str, documentation: str, labelnames: Sequence[str] = ()
+    ) -> CounterFamily:
+        return self._register(CounterFamily(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        buckets: Sequence[float] = SECONDS_BUCKETS,
+        labelnames: Sequence[str] = (),
+    ) -> HistogramFamily:
+        return self._register(HistogramFamily(name, documentation, buckets, labelnames))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for family in self._families.values():
+            lines.extend(family.render())
+        return "\n".join(lines) + "\n"
+
+    def _register(self, family):
+        existing = self._families.get(family.name)
+        if existing is not None:
+            return existing
+        self._families[family.name] = family
+        return family
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _number(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "docupilot_stage_seconds",
+    "Wall time spent in each chat and ingestion stage.",
+    labelnames=("stage",),
+)
+TOKENS = REGISTRY.counter(
+    "docupilot_tokens_total",
+    "Tokens sent to or received from Azure OpenAI (estimated with tiktoken).",
+    labelnames=("kind",),
+)
+CACHE_LOOKUPS = REGISTRY.counter(
+    "docupilot_cache_lookups_total",
+    "Cache lookups by cache and result (hit or miss).",
+    labelnames=("cache", "result"),
+)
+QUERY_BATCH_SIZE = REGISTRY.histogram(
+    "docupilot_query_embedding_batch_size",
+    "Distinct questions per coalesced embedding request.",
+    SIZE_BUCKETS,
+)
+QUERY_BATCH_WAIT_MS = REGISTRY.histogram(
+    "docupilot_query_embedding_wait_ms",
+    "Time a question waited for its embedding batch to be sent, in milliseconds.",
+    LATENCY_MS_BUCKETS,
+)
+
+
+def timed(stage: str):
+    return STAGE_SECONDS.time(stage=stage)
@@ -0,0 +1,72 @@
+from __future__ import annotations
+
+import sqlite3
+import threading
+from pathlib import Path
+from typing import Optional
+
+from app.core.config import get_settings
+
+
+def state_path(filename: str) -> Path:
+    directory = Path(get_settings().local_state_dir)
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory / filename
+
+
+def connect(path: Path | str) -> sqlite3.Connection:
+    conn = sqlite3.connect(str(path), check_same_thread=False, isolation_level=None)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    # Worker processes share these files, so wait for a writer rather than
+    # failing with "database is locked".
+    conn.execute("PRAGMA busy_timeout=10000")
+    return conn
+
+
+class SQLiteStore:
+    # A SQLite file under LOCAL_STATE_DIR (or an explicit path) that is opened,
+    # and its schema created by _create_schema(), on first use. Module-level
+    # stores can then be built at import without touching the disk.
+    filename = ""
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        self._configured_path = path
+        self._resolved_path: Optional[str] = None
+        self._writer: Optional[sqlite3.Connection] = None
+        self._open_lock = threading.Lock()
+        self._local = threading.local()
+
+    @property
+    def _path(self) -> str:
+        if self._resolved_path is None:
+            self._resolved_path = self._configured_path or str(state_path(self.filename))
+        return self._resolved_path
+
+    @property
+    def _conn(self) -> sqlite3.Connection:
+        conn = self._writer
+        if conn is None:
+            with self._open_lock:
+                if self._writer is None:
+                    conn = connect(self._path)
+                    self._create_schema(conn)
+                    self._writer = conn
+                conn = self._writer
+        return conn
+
+    def open(self) -> None:
+        self._conn
+
+    def _create_schema(self, conn: sqlite3.Connection) -> None:
+        pass
+
+    def _reader(self) -> sqlite3.Connection:
+        # One connection per thread for reads, so they run alongside the
+        # writer under WAL.
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            self.open()
+            conn = connect(self._path)
+            self._local.conn = conn
+        return conn
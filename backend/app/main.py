@@ -1,14 +1,45 @@
 from __future__ import annotations
 
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
 
 from app.api.routes import router
 from app.core.config import get_settings
+from app.core.metrics import REGISTRY
+from app.services.processing import processing_manager
+from app.services.startup import run_startup_checks, startup_checks
+from app.utils.document_loader import shutdown_pool
 
 settings = get_settings()
 
-app = FastAPI(title=settings.app_name)
+
+async def _start_when_ready() -> None:
+    await run_startup_checks()
+    # Ingestion runs in whichever processes claim queued blobs. Set
+    # PROCESSING_INLINE_WORKERS=0 when dedicated `python -m app.worker`
+    # processes handle the queue and the API should only enqueue.
+    processing_manager.start_workers(settings.processing_inline_workers)
+
+
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    # Checks run in the background so uvicorn accepts requests right away;
+    # /ready reports when they have passed.
+    startup = asyncio.create_task(_start_when_ready())
+    try:
+        yield
+    finally:
+        startup.cancel()
+        await asyncio.to_thread(processing_manager.stop_workers)
+        await asyncio.to_thread(shutdown_pool)
+
+
+app = FastAPI(title=settings.app_name, lifespan=lifespan)
 app.include_router(router)
 
 app.add_middleware(
@@ -23,3 +54,14 @@ app.add_middleware(
 @app.get("/health")
 def health() -> dict:
     return {"status": "ok", "environment": settings.environment}
+
+
+@app.get("/ready")
+def ready() -> JSONResponse:
+    report = startup_checks.report()
+    return JSONResponse(report, status_code=200 if report["ready"] else 503)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def metrics() -> PlainTextResponse:
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
@@ -16,6 +16,8 @@ class FileUploadResponse(BaseModel):
     original_name: str
     size_bytes: int
     container: str
+    content_hash: Optional[str] = None
+    duplicate_of: Optional[str] = None
 
 
 class FileRecord(BaseModel):
@@ -41,6 +43,9 @@ class ProcessStatus(BaseModel):
     state: str = "pending"
     steps: List[ProcessStep] = Field(default_factory=list)
     errors: List[str] = Field(default_factory=list)
+    docs_per_second: Optional[float] = None
+    chunks_per_second: Optional[float] = None
+    eta_seconds: Optional[float] = None
 
 
 class ChatHistoryItem(BaseModel):
@@ -52,6 +57,12 @@ class ChatRequest(BaseModel):
     question: str
     history: List[ChatHistoryItem] = []
     top_k: int = Field(default=5, ge=1, le=20)
+    conversation_id: Optional[str] = Field(default=None, min_length=1, max_length=128)
+
+
+class ChatBatchRequest(BaseModel):
+    requests: List[ChatRequest] = Field(min_length=1)
+    concurrency: Optional[int] = Field(default=None, ge=1)
 
 
 class Citation(BaseModel):
@@ -66,4 +77,7 @@ class ChatResponse(BaseModel):
     citations: List[Citation]
     latency_ms: float
     confidence: float
+    cached: bool = False
+    prompt_tokens_saved: int = 0
+    conversation_id: Optional[str] = None
 
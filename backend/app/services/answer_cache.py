@@ -0,0 +1,190 @@
+from __future__ import annotations
+
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from threading import Lock
+from typing import FrozenSet, Iterable, List, Optional, Sequence
+
+import numpy as np
+
+from app.core.config import get_settings
+from app.models.schemas import ChatResponse
+from app.services.job_store import JobStore, job_store
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = re.compile(r"[\s?!.]+$")
+
+
+@dataclass
+class CachedAnswer:
+    key: str
+    top_k: int
+    response: ChatResponse
+    sources: FrozenSet[str]
+    expires_at: float
+    row: int
+
+
+class AnswerCache:
+    def __init__(
+        self,
+        max_entries: int,
+        ttl_seconds: float,
+        similarity_threshold: float,
+        changes: Optional[JobStore] = None,
+    ) -> None:
+        self._max_entries = max(1, max_entries)
+        self._ttl_seconds = ttl_seconds
+        self._threshold = similarity_threshold
+        self._entries: "OrderedDict[str, CachedAnswer]" = OrderedDict()
+        self._lock = Lock()
+        self._matrix: Optional[np.ndarray] = None
+        self._row_keys: List[str] = []
+        self._row_top_k = np.zeros(self._max_entries, dtype=np.int32)
+        self._changes = changes
+        # Read from the job store on first use rather than at import.
+        self._seen: Optional[int] = None
+
+    @staticmethod
+    def normalize(question: str) -> str:
+        text = _WHITESPACE.sub(" ", question.strip().lower())
+        return _TRAILING_PUNCTUATION.sub("", text)
+
+    def get(self, question: str, top_k: int) -> Optional[ChatResponse]:
+        key = self._key(question, top_k)
+        self._catch_up()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry.expires_at <= time.monotonic():
+                self._remove(entry)
+                return None
+            self._entries.move_to_end(key)
+            return entry.response
+
+    def find_similar(self, embedding: Sequence[float], top_k: int) -> Optional[ChatResponse]:
+        query = self._unit(embedding)
+        self._catch_up()
+        with self._lock:
+            rows = len(self._row_keys)
+            if not rows or self._matrix is None or self._matrix.shape[1] != query.shape[0]:
+                return None
+            scores = self._matrix[:rows] @ query
+            scores[self._row_top_k[:rows] != top_k] = -1.0
+            now = time.monotonic()
+            while True:
+                best = int(np.argmax(scores))
+                if scores[best] < self._threshold:
+                    return None
+                entry = self._entries[self._row_keys[best]]
+                if entry.expires_at > now:
+                    self._entries.move_to_end(entry.key)
+                    return entry.response
+                scores[best] = -1.0
+
+    def put(
+        self,
+        question: str,
+        top_k: int,
+        embedding: Sequence[float],
+        response: ChatResponse,
+    ) -> None:
+        key = self._key(question, top_k)
+        vector = self._unit(embedding)
+        sources = frozenset(c.source_document for c in response.citations)
+        if self._seen is None:
+            # Entries stored before the first lookup still need a baseline
+            # to be invalidated against.
+            self._catch_up()
+        with self._lock:
+            existing = self._entries.get(key)
+            if existing is not None:
+                self._remove(existing)
+            while len(self._entries) >= self._max_entries:
+                self._remove(next(iter(self._entries.values())))
+            if self._matrix is None or self._matrix.shape[1] != vector.shape[0]:
+                self._entries.clear()
+                self._row_keys.clear()
+                self._matrix = np.zeros((self._max_entries, vector.shape[0]), dtype=np.float32)
+            row = len(self._row_keys)
+            self._matrix[row] = vector
+            self._row_top_k[row] = top_k
+            self._row_keys.append(key)
+            self._entries[key] = CachedAnswer(
+                key=key,
+                top_k=top_k,
+                response=response,
+                sources=sources,
+                expires_at=time.monotonic() + self._ttl_seconds,
+                row=row,
+            )
+
+    def invalidate_sources(self, sources: Iterable[str]) -> int:
+        changed = set(sources)
+        if not changed:
+            return 0
+        with self._lock:
+            stale = [e for e in self._entries.values() if e.sources & changed]
+            for entry in stale:
+                self._remove(entry)
+        return len(stale)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._row_keys.clear()
+
+    def _catch_up(self) -> None:
+        # Indexing usually runs in another process; it records changed
+        # sources in the job store rather than touching this cache.
+        if self._changes is None:
+            return
+        if self._seen is None:
+            self._seen = self._changes.latest_index_change()
+            return
+        seq, sources = self._changes.index_changes_since(self._seen)
+        if seq == self._seen:
+            return
+        self._seen = seq
+        if sources is None:
+            self.clear()
+        else:
+            self.invalidate_sources(sources)
+
+    def _key(self, question: str, top_k: int) -> str:
+        return f"{top_k}:{self.normalize(question)}"
+
+    def _remove(self, entry: CachedAnswer) -> None:
+        del self._entries[entry.key]
+        last = len(self._row_keys) - 1
+        if entry.row != last:
+            moved_key = self._row_keys[last]
+            self._matrix[entry.row] = self._matrix[last]
+            self._row_top_k[entry.row] = self._row_top_k[last]
+            self._row_keys[entry.row] = moved_key
+            self._entries[moved_key].row = entry.row
+        self._row_keys.pop()
+
+    @staticmethod
+    def _unit(embedding: Sequence[float]) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(vector))
+        return vector / norm if norm else vector
+
+
+def create_answer_cache() -> AnswerCache | None:
+    settings = get_settings()
+    if not settings.answer_cache_enabled:
+        return None
+    return AnswerCache(
+        settings.answer_cache_max_entries,
+        settings.answer_cache_ttl_seconds,
+        settings.answer_cache_similarity_threshold,
+        changes=job_store,
+    )
+
+
+answer_cache = create_answer_cache()
@@ -0,0 +1,256 @@
+from __future__ import annotations
+
+import base64
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from app.core.sqlite import SQLiteStore
+
+PENDING = "pending"
+PROCESSING = "processing"
+PROCESSED = "processed"
+STATES = (PENDING, PROCESSING, PROCESSED)
+
+
+@dataclass(frozen=True)
+class CatalogEntry:
+    name: str
+    container: str
+    size_bytes: int
+    content_hash: Optional[str]
+    state: str
+    uploaded_at: float
+    updated_at: float
+
+
+@dataclass(frozen=True)
+class ListedBlob:
+    name: str
+    container: str
+    size_bytes: int
+    uploaded_at: float
+    content_hash: Optional[str] = None
+    state: str = PENDING
+
+
+class BlobCatalog(SQLiteStore):
+    filename = "blob_catalog.sqlite3"
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        super().__init__(path)
+        self._lock = threading.Lock()
+
+    def _create_schema(self, conn: sqlite3.Connection) -> None:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS blobs ("
+            "name TEXT PRIMARY KEY, container TEXT NOT NULL, size INTEGER NOT NULL, "
+            "content_hash TEXT, state TEXT NOT NULL, uploaded_at REAL NOT NULL, "
+            "updated_at REAL NOT NULL, seen_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS blobs_recent ON blobs (uploaded_at DESC, name DESC)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS blobs_state ON blobs (state, uploaded_at, name)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS blobs_content ON blobs (content_hash)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS catalog_meta (key TEXT PRIMARY KEY, value REAL NOT NULL)"
+        )
+
+    def record_upload(self, blob: ListedBlob) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO blobs (name, container, size, content_hash, state, uploaded_at, "
+                "updated_at, seen_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (name) DO UPDATE SET container = excluded.container, "
+                "size = excluded.size, content_hash = excluded.content_hash, "
+                "state = excluded.state, uploaded_at = excluded.uploaded_at, "
+                "updated_at = excluded.updated_at, seen_at = excluded.seen_at",
+                (
+                    blob.name,
+                    blob.container,
+                    blob.size_bytes,
+                    blob.content_hash,
+                    PENDING,
+                    blob.uploaded_at,
+                    now,
+                    now,
+                ),
+            )
+
+    def set_state(
+        self,
+        names: Iterable[str],
+        state: str,
+        *,
+        container: Optional[str] = None,
+        only_from: Optional[str] = None,
+    ) -> None:
+        now = time.time()
+        query = "UPDATE blobs SET state = ?, container = COALESCE(?, container), updated_at = ? "
+        query += "WHERE name = ?"
+        if only_from is not None:
+            query += " AND state = ?"
+        rows = [
+            (state, container, now, name, *((only_from,) if only_from is not None else ()))
+            for name in names
+        ]
+        with self._lock:
+            self._conn.executemany(query, rows)
+
+    def claim(self, names: Iterable[str], container: str) -> List[str]:
+        # Flips pending (or not yet catalogued) blobs to processing and returns
+        # only the names this call won, so two concurrent enqueues never share
+        # a blob.
+        now = time.time()
+        claimed: List[str] = []
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for name in names:
+                    changed = self._conn.execute(
+                        "INSERT INTO blobs (name, container, size, state, uploaded_at, "
+                        "updated_at, seen_at) VALUES (?, ?, 0, ?, ?, ?, ?) "
+                        "ON CONFLICT (name) DO UPDATE SET state = excluded.state, "
+                        "updated_at = excluded.updated_at WHERE blobs.state = ?",
+                        (name, container, PROCESSING, now, now, now, PENDING),
+                    ).rowcount
+                    if changed:
+                        claimed.append(name)
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+        return claimed
+
+    def page(
+        self,
+        limit: int,
+        *,
+        state: Optional[str] = None,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[CatalogEntry], Optional[str]]:
+        clauses: List[str] = []
+        params: List[object] = []
+        if state is not None:
+            clauses.append("state = ?")
+            params.append(state)
+        if cursor:
+            uploaded_at, name = _decode_cursor(cursor)
+            clauses.append("(uploaded_at, name) < (?, ?)")
+            params.extend((uploaded_at, name))
+        where = f"WHERE {' AND '.join(clauses)} " if clauses else ""
+        rows = self._reader().execute(
+            "SELECT name, container, size, content_hash, state, uploaded_at, updated_at "
+            f"FROM blobs {where}ORDER BY uploaded_at DESC, name DESC LIMIT ?",
+            (*params, limit + 1),
+        ).fetchall()
+        entries = [CatalogEntry(*row) for row in rows[:limit]]
+        next_cursor = None
+        if len(rows) > limit and entries:
+            next_cursor = _encode_cursor(entries[-1].uploaded_at, entries[-1].name)
+        return entries, next_cursor
+
+    def get(self, name: str) -> Optional[CatalogEntry]:
+        row = self._reader().execute(
+            "SELECT name, container, size, content_hash, state, uploaded_at, updated_at "
+            "FROM blobs WHERE name = ?",
+            (name,),
+        ).fetchone()
+        return CatalogEntry(*row) if row else None
+
+    def find_content(
+        self, content_hash: str, *, prefer: Optional[str] = None
+    ) -> Optional[CatalogEntry]:
+        # The oldest blob holding these bytes, or `prefer` if it is one of them.
+        row = self._reader().execute(
+            "SELECT name, container, size, content_hash, state, uploaded_at, updated_at "
+            "FROM blobs WHERE content_hash = ? ORDER BY name = ? DESC, uploaded_at, name LIMIT 1",
+            (content_hash, prefer),
+        ).fetchone()
+        return CatalogEntry(*row) if row else None
+
+    def pending_names(self, limit: Optional[int] = None) -> List[str]:
+        rows = self._reader().execute(
+            "SELECT name FROM blobs WHERE state = ? ORDER BY uploaded_at, name LIMIT ?",
+            (PENDING, limit if limit else -1),
+        ).fetchall()
+        return [name for (name,) in rows]
+
+    def reconcile(self, listing: Iterable[ListedBlob]) -> None:
+        # The newest copy of a name wins, so a blob re-uploaded after it was
+        # processed goes back to pending while an in-flight move does not.
+        started = time.time()
+        latest: Dict[str, ListedBlob] = {}
+        for blob in listing:
+            current = latest.get(blob.name)
+            if current is None or blob.uploaded_at > current.uploaded_at:
+                latest[blob.name] = blob
+        rows = [
+            (
+                blob.name,
+                blob.container,
+                blob.size_bytes,
+                blob.content_hash,
+                blob.state,
+                blob.uploaded_at,
+                started,
+                started,
+            )
+            for blob in latest.values()
+        ]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT INTO blobs (name, container, size, content_hash, state, "
+                    "uploaded_at, updated_at, seen_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?) "
+                    "ON CONFLICT (name) DO UPDATE SET container = excluded.container, "
+                    "size = excluded.size, "
+                    "content_hash = COALESCE(excluded.content_hash, blobs.content_hash), "
+                    "state = CASE WHEN excluded.state = 'pending' AND blobs.state = 'processing' "
+                    "THEN blobs.state ELSE excluded.state END, "
+                    "updated_at = CASE WHEN blobs.state = excluded.state "
+                    "THEN blobs.updated_at ELSE excluded.updated_at END, "
+                    "uploaded_at = excluded.uploaded_at, seen_at = excluded.seen_at",
+                    rows,
+                )
+                self._conn.execute("DELETE FROM blobs WHERE seen_at < ?", (started,))
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO catalog_meta (key, value) "
+                    "VALUES ('reconciled_at', ?)",
+                    (started,),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def reconciled_at(self) -> Optional[float]:
+        row = self._reader().execute(
+            "SELECT value FROM catalog_meta WHERE key = 'reconciled_at'"
+        ).fetchone()
+        return row[0] if row else None
+
+
+def _encode_cursor(uploaded_at: float, name: str) -> str:
+    return base64.urlsafe_b64encode(f"{uploaded_at!r}|{name}".encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: str) -> Tuple[float, str]:
+    try:
+        decoded = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8")
+        uploaded_at, name = decoded.split("|", 1)
+        return float(uploaded_at), name
+    except (ValueError, UnicodeError) as exc:
+        raise ValueError("Invalid cursor") from exc
+
+
+blob_catalog = BlobCatalog()
@@ -0,0 +1,150 @@
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+from app.models.schemas import Citation
+from app.utils.tokens import count_tokens
+
+SEPARATOR = "\n---\n"
+MIN_OVERLAP_CHARS = 8
+
+Hit = Tuple[float, dict, dict]
+
+
+@dataclass
+class ContextBlock:
+    source_path: str
+    last_order: int
+    text: str
+    score: float
+    hits: List[Hit] = field(default_factory=list)
+
+
+@dataclass
+class PackedContext:
+    text: str
+    citations: List[Citation]
+    tokens_used: int
+    tokens_saved: int
+
+
+def strip_overlap(previous: str, following: str, max_overlap: int) -> str:
+    tail = previous[-max_overlap:] if max_overlap > 0 else ""
+    probe = following[:MIN_OVERLAP_CHARS]
+    if len(probe) < MIN_OVERLAP_CHARS:
+        return following
+    index = tail.find(probe)
+    while index != -1:
+        overlap = len(tail) - index
+        if following.startswith(tail[index:]):
+            return following[overlap:]
+        index = tail.find(probe, index + 1)
+    return following
+
+
+def merge_adjacent(hits: List[Hit], max_overlap: Optional[int]) -> List[ContextBlock]:
+    ordered = sorted(
+        hits,
+        key=lambda hit: (
+            hit[2].get("source_path", "unknown"),
+            _chunk_order(hit[2]),
+        ),
+    )
+    blocks: List[ContextBlock] = []
+    for hit in ordered:
+        score, result, metadata = hit
+        source = metadata.get("source_path", "unknown")
+        order = _chunk_order(metadata)
+        previous = blocks[-1] if blocks else None
+        if (
+            previous is not None
+            and previous.source_path == source
+            and order >= 0
+            and order == previous.last_order + 1
+        ):
+            remainder = _remainder(previous, result["content"], metadata, max_overlap)
+            joiner = "" if len(remainder) < len(result["content"]) else "\n"
+            previous.text = f"{previous.text}{joiner}{remainder}"
+            previous.last_order = order
+            previous.score = max(previous.score, score)
+            previous.hits.append(hit)
+            continue
+        blocks.append(
+            ContextBlock(
+                source_path=source,
+                last_order=order,
+                text=result["content"],
+                score=score,
+                hits=[hit],
+            )
+        )
+    return blocks
+
+
+def pack_context(
+    hits: List[Hit], max_tokens: int, max_overlap: Optional[int]
+) -> PackedContext:
+    if not hits:
+        return PackedContext(text="", citations=[], tokens_used=0, tokens_saved=0)
+    naive_tokens = count_tokens(SEPARATOR.join(result["content"] for _, result, _ in hits))
+    blocks = sorted(merge_adjacent(hits, max_overlap), key=lambda block: block.score, reverse=True)
+
+    separator_tokens = count_tokens(SEPARATOR)
+    packed: List[str] = []
+    kept: Dict[int, None] = {}
+    used = 0
+    for block in blocks:
+        tokens = count_tokens(block.text)
+        cost = tokens + (separator_tokens if packed else 0)
+        if max_tokens > 0 and used + cost > max_tokens:
+            if packed:
+                continue
+            block.text = block.text[: max(1, len(block.text) * max_tokens // max(tokens, 1))]
+            cost = count_tokens(block.text)
+        packed.append(block.text)
+        used += cost
+        for hit in block.hits:
+            kept[id(hit)] = None
+
+    citations = [
+        Citation(
+            chunk_id=metadata.get("chunk_id", "unknown"),
+            source_document=metadata.get("source_path", "unknown"),
+            score=score,
+            snippet=result["content"][:400],
+        )
+        for score, result, metadata in (hit for hit in hits if id(hit) in kept)
+    ]
+    return PackedContext(
+        text=SEPARATOR.join(packed),
+        citations=citations,
+        tokens_used=used,
+        tokens_saved=max(0, naive_tokens - used),
+    )
+
+
+def _remainder(
+    previous: ContextBlock, content: str, metadata: dict, max_overlap: Optional[int]
+) -> str:
+    # Chunks that record their character offsets overlap by exactly
+    # previous end - start; older chunks fall back to matching text.
+    previous_end = previous.hits[-1][2].get("char_end")
+    start = metadata.get("char_start")
+    if isinstance(previous_end, int) and isinstance(start, int):
+        overlap = min(max(previous_end - start, 0), len(content))
+        # Offsets indexed before an edit earlier in the document no longer
+        # line up; trust them only when the overlap text agrees.
+        if previous.text.endswith(content[:overlap]):
+            return content[overlap:]
+    if max_overlap is None:
+        # No fixed bound: the overlap is at most the previous chunk.
+        max_overlap = len(previous.hits[-1][1]["content"])
+    return strip_overlap(previous.text, content, max_overlap)
+
+
+def _chunk_order(metadata: dict) -> int:
+    try:
+        return int(metadata.get("chunk_order", -1))
+    except (TypeError, ValueError):
+        return -1
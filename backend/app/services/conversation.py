@@ -0,0 +1,367 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Iterator, List, Optional, Sequence, Set, Tuple
+
+from app.core.config import get_settings
+from app.core.metrics import timed
+from app.core.sqlite import SQLiteStore
+from app.models.schemas import ChatHistoryItem
+from app.services.openai_client import openai_client
+from app.utils.tokens import count_tokens, truncate_tokens
+
+logger = logging.getLogger(__name__)
+
+ROLES = ("user", "assistant")
+CONDENSE_PROMPT = (
+    "Rewrite the follow-up question as a standalone search query, resolving pronouns "
+    "and references from the conversation. Reply with the query only."
+)
+SUMMARY_PROMPT = (
+    "Update the running summary of a conversation with the new turns. Keep the "
+    "documents, names, figures and open questions it refers to. Reply with the "
+    "summary only, in at most {words} words."
+)
+# Expired conversations are swept at most this often.
+_EXPIRE_INTERVAL_SECONDS = 60
+
+
+@dataclass(frozen=True)
+class Turn:
+    role: str
+    content: str
+    tokens: int
+    # 0 until the turn is stored.
+    seq: int = 0
+
+
+@dataclass
+class Conversation:
+    id: str
+    summary: str = ""
+    summarized_through: int = 0
+    turns: List[Turn] = field(default_factory=list)
+
+
+@dataclass
+class ChatTurn:
+    conversation: Conversation
+    question: str
+    # What retrieval and the answer cache see: the question rewritten to stand
+    # on its own when there is history.
+    query: str
+    # Summary and recent turns for the answer prompt, bounded by
+    # chat_history_max_tokens.
+    history: List[dict]
+
+
+@dataclass
+class _Fold:
+    conversation_id: str
+    summarized_through: int
+    through: int
+    messages: List[dict]
+
+
+class ConversationStore(SQLiteStore):
+    filename = "conversations.sqlite3"
+
+    def __init__(self, ttl_seconds: float, path: Optional[str] = None) -> None:
+        super().__init__(path)
+        self._ttl_seconds = ttl_seconds
+        self._lock = threading.Lock()
+        self._expired_at = 0.0
+
+    def _create_schema(self, conn: sqlite3.Connection) -> None:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversations ("
+            "id TEXT PRIMARY KEY, summary TEXT NOT NULL DEFAULT '', "
+            "summarized_through INTEGER NOT NULL DEFAULT 0, updated_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS conversations_updated ON conversations (updated_at)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS conversation_turns ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, conversation_id TEXT NOT NULL, "
+            "role TEXT NOT NULL, content TEXT NOT NULL, tokens INTEGER NOT NULL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS conversation_turns_id "
+            "ON conversation_turns (conversation_id, seq)"
+        )
+
+    def load(self, conversation_id: str) -> Optional[Conversation]:
+        reader = self._reader()
+        row = reader.execute(
+            "SELECT summary, summarized_through FROM conversations "
+            "WHERE id = ? AND updated_at >= ?",
+            (conversation_id, time.time() - self._ttl_seconds),
+        ).fetchone()
+        if row is None:
+            return None
+        summary, summarized_through = row
+        turns = [
+            Turn(role, content, tokens, seq)
+            for role, content, tokens, seq in reader.execute(
+                "SELECT role, content, tokens, seq FROM conversation_turns "
+                "WHERE conversation_id = ? AND seq > ? ORDER BY seq",
+                (conversation_id, summarized_through),
+            )
+        ]
+        return Conversation(conversation_id, summary, summarized_through, turns)
+
+    def append(self, conversation_id: str, turns: Sequence[Turn]) -> List[Turn]:
+        now = time.time()
+        stored: List[Turn] = []
+        with self._lock, self._transaction():
+            self._conn.execute(
+                "INSERT INTO conversations (id, updated_at) VALUES (?, ?) "
+                "ON CONFLICT (id) DO UPDATE SET updated_at = excluded.updated_at",
+                (conversation_id, now),
+            )
+            for turn in turns:
+                seq = self._conn.execute(
+                    "INSERT INTO conversation_turns (conversation_id, role, content, tokens) "
+                    "VALUES (?, ?, ?, ?)",
+                    (conversation_id, turn.role, turn.content, turn.tokens),
+                ).lastrowid
+                stored.append(Turn(turn.role, turn.content, turn.tokens, seq))
+            if now - self._expired_at >= _EXPIRE_INTERVAL_SECONDS:
+                self._expire(now)
+        return stored
+
+    def fold(
+        self, conversation_id: str, summarized_through: int, through: int, summary: str
+    ) -> bool:
+        # Replaces the summary and drops the turns it now covers, unless another
+        # fold got there first.
+        with self._lock, self._transaction():
+            changed = self._conn.execute(
+                "UPDATE conversations SET summary = ?, summarized_through = ? "
+                "WHERE id = ? AND summarized_through = ?",
+                (summary, through, conversation_id, summarized_through),
+            ).rowcount
+            if changed:
+                self._conn.execute(
+                    "DELETE FROM conversation_turns WHERE conversation_id = ? AND seq <= ?",
+                    (conversation_id, through),
+                )
+        return bool(changed)
+
+    def _expire(self, now: float) -> None:
+        self._expired_at = now
+        cutoff = now - self._ttl_seconds
+        self._conn.execute(
+            "DELETE FROM conversation_turns WHERE conversation_id IN "
+            "(SELECT id FROM conversations WHERE updated_at < ?)",
+            (cutoff,),
+        )
+        self._conn.execute("DELETE FROM conversations WHERE updated_at < ?", (cutoff,))
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+
+conversation_store = ConversationStore(get_settings().conversation_ttl_seconds)
+# Summaries folded after a response has been sent; held so they are not
+# garbage collected mid-flight.
+_background: Set[asyncio.Task] = set()
+
+
+def prepare_turn(
+    question: str, history: Sequence[ChatHistoryItem], conversation_id: Optional[str]
+) -> ChatTurn:
+    conversation, window, condense = _begin(question, history, conversation_id)
+    query = question
+    if condense is not None:
+        try:
+            with timed("chat_condense"):
+                query = openai_client.complete(condense).strip() or question
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Question condensation failed: %s", exc)
+    return ChatTurn(conversation, question, query, _history_messages(conversation, window))
+
+
+async def aprepare_turn(
+    question: str, history: Sequence[ChatHistoryItem], conversation_id: Optional[str]
+) -> ChatTurn:
+    # The store is SQLite, so it is read in a thread rather than on the loop.
+    conversation, window, condense = await asyncio.to_thread(
+        _begin, question, history, conversation_id
+    )
+    query = question
+    if condense is not None:
+        try:
+            with timed("chat_condense"):
+                async with asyncio.timeout(get_settings().chat_retrieval_timeout_seconds):
+                    query = (await openai_client.acomplete(condense)).strip() or question
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Question condensation failed: %s", exc)
+    return ChatTurn(conversation, question, query, _history_messages(conversation, window))
+
+
+def remember_turn(turn: ChatTurn, answer: str) -> None:
+    fold = _record(turn, answer)
+    if fold is None:
+        return
+    try:
+        with timed("chat_summary"):
+            summary = openai_client.complete(fold.messages)
+    except Exception as exc:  # noqa: BLE001
+        logger.warning("Conversation summary failed: %s", exc)
+        return
+    _store_summary(fold, summary)
+
+
+async def aremember_turn(turn: ChatTurn, answer: str) -> None:
+    # Stores the turn before returning, so the conversation's next question
+    # sees it, and folds old turns into the summary in the background, so
+    # summarising never delays a response.
+    fold = await asyncio.to_thread(_record, turn, answer)
+    if fold is None:
+        return
+    task = asyncio.get_running_loop().create_task(_afold(fold))
+    _background.add(task)
+    task.add_done_callback(_background.discard)
+
+
+async def _afold(fold: _Fold) -> None:
+    try:
+        with timed("chat_summary"):
+            summary = await openai_client.acomplete(fold.messages)
+    except Exception as exc:  # noqa: BLE001
+        logger.warning("Conversation summary failed: %s", exc)
+        return
+    await asyncio.to_thread(_store_summary, fold, summary)
+
+
+def _begin(
+    question: str, history: Sequence[ChatHistoryItem], conversation_id: Optional[str]
+) -> Tuple[Conversation, List[Turn], Optional[List[dict]]]:
+    settings = get_settings()
+    conversation = conversation_store.load(conversation_id) if conversation_id else None
+    if conversation is None:
+        # A new or expired conversation starts from whatever history the
+        # client sent; it is stored with the first answer.
+        conversation = Conversation(conversation_id or uuid.uuid4().hex)
+        conversation.turns = [
+            Turn(_role(item.role), item.content, count_tokens(item.content))
+            for item in history
+            if item.content
+        ]
+    window = _window(conversation.turns, _turn_budget(conversation.summary))
+    condense = None
+    if settings.chat_condense_questions and (window or conversation.summary):
+        condense = _condense_messages(conversation, window, question)
+    return conversation, window, condense
+
+
+def _record(turn: ChatTurn, answer: str) -> Optional[_Fold]:
+    settings = get_settings()
+    conversation = turn.conversation
+    unsaved = [t for t in conversation.turns if not t.seq]
+    unsaved.append(Turn("user", turn.question, count_tokens(turn.question)))
+    unsaved.append(Turn("assistant", answer, count_tokens(answer)))
+    stored = conversation_store.append(conversation.id, unsaved)
+    turns = [t for t in conversation.turns if t.seq] + stored
+    # The next summary may grow to its cap, so leave room for all of it.
+    budget = settings.chat_history_max_tokens - settings.chat_summary_max_tokens
+    if sum(t.tokens for t in turns) <= _turn_budget(conversation.summary):
+        return None
+    # Fold a quarter of the window at a time: summaries are written every few
+    # turns rather than on every one, and the prompt stays close to the budget.
+    keep = len(_window(turns, budget * 3 // 4))
+    folded = turns[: len(turns) - keep]
+    return _Fold(
+        conversation.id,
+        conversation.summarized_through,
+        folded[-1].seq,
+        _summary_messages(conversation.summary, folded),
+    )
+
+
+def _store_summary(fold: _Fold, summary: str) -> None:
+    summary = truncate_tokens(summary.strip(), get_settings().chat_summary_max_tokens)
+    if not conversation_store.fold(
+        fold.conversation_id, fold.summarized_through, fold.through, summary
+    ):
+        logger.debug("Conversation %s was summarised concurrently", fold.conversation_id)
+
+
+def _turn_budget(summary: str) -> int:
+    return max(0, get_settings().chat_history_max_tokens - count_tokens(summary))
+
+
+def _window(turns: Sequence[Turn], max_tokens: int) -> List[Turn]:
+    window: List[Turn] = []
+    used = 0
+    for turn in reversed(turns):
+        if used + turn.tokens > max_tokens:
+            break
+        window.append(turn)
+        used += turn.tokens
+    window.reverse()
+    return window
+
+
+def _history_messages(conversation: Conversation, window: Sequence[Turn]) -> List[dict]:
+    messages: List[dict] = []
+    if conversation.summary:
+        messages.append(
+            {"role": "system", "content": f"Conversation so far: {conversation.summary}"}
+        )
+    messages.extend({"role": turn.role, "content": turn.content} for turn in window)
+    return messages
+
+
+def _condense_messages(
+    conversation: Conversation, window: Sequence[Turn], question: str
+) -> List[dict]:
+    lines = [f"summary: {conversation.summary}"] if conversation.summary else []
+    lines.extend(f"{turn.role}: {turn.content}" for turn in window)
+    transcript = "\n".join(lines)
+    return [
+        {"role": "system", "content": CONDENSE_PROMPT},
+        {
+            "role": "user",
+            "content": f"Follow-up question: {question}\n\nConversation:\n{transcript}",
+        },
+    ]
+
+
+def _summary_messages(summary: str, turns: Sequence[Turn]) -> List[dict]:
+    settings = get_settings()
+    transcript = "\n".join(
+        f"{turn.role}: {truncate_tokens(turn.content, settings.chat_history_max_tokens)}"
+        for turn in turns
+    )
+    return [
+        {
+            "role": "system",
+            "content": SUMMARY_PROMPT.format(words=settings.chat_summary_max_tokens * 3 // 4),
+        },
+        {
+            "role": "user",
+            "content": f"Summary so far: {summary or '(none)'}\n\nNew turns:\n{transcript}",
+        },
+    ]
+
+
+def _role(role: str) -> str:
+    # Client-supplied history never becomes a system message.
+    return role if role in ROLES else "user"
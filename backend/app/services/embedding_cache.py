@@ -0,0 +1,114 @@
+from __future__ import annotations
+
+import hashlib
+import sqlite3
+import time
+from array import array
+from threading import Lock
+from typing import Dict, Iterable, List, Mapping, Optional, Sequence
+
+from app.core.config import get_settings
+from app.core.sqlite import SQLiteStore
+
+_SQL_BATCH = 500
+
+
+def _pack(vector: Sequence[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def _unpack(blob: bytes) -> List[float]:
+    values = array("f")
+    values.frombytes(blob)
+    return values.tolist()
+
+
+class EmbeddingCache(SQLiteStore):
+    filename = "embeddings.sqlite3"
+
+    def __init__(self, max_entries: int, path: Optional[str] = None) -> None:
+        super().__init__(path)
+        self._lock = Lock()
+        self._max_entries = max_entries
+        self._size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _create_schema(self, conn: sqlite3.Connection) -> None:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embeddings_last_used ON embeddings(last_used)"
+        )
+        self._size = conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @staticmethod
+    def key(text: str, model: str) -> str:
+        return hashlib.sha256(f"{model}\0{text}".encode("utf-8")).hexdigest()
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, List[float]]:
+        wanted = list(dict.fromkeys(keys))
+        found: Dict[str, List[float]] = {}
+        with self._lock:
+            for offset in range(0, len(wanted), _SQL_BATCH):
+                batch = wanted[offset : offset + _SQL_BATCH]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({placeholders})",
+                    batch,
+                ).fetchall()
+                for key, blob in rows:
+                    found[key] = _unpack(blob)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+            self.hits += len(found)
+            self.misses += len(wanted) - len(found)
+        return found
+
+    def put_many(self, vectors: Mapping[str, Sequence[float]]) -> None:
+        if not vectors:
+            return
+        now = time.time()
+        rows = [(key, _pack(vector), now) for key, vector in vectors.items()]
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR IGNORE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                    rows,
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+            self._size += self._conn.total_changes - before
+            if self._size > self._max_entries:
+                self._evict()
+
+    def stats(self) -> Dict[str, int]:
+        self.open()
+        with self._lock:
+            return {"entries": self._size, "hits": self.hits, "misses": self.misses}
+
+    def _evict(self) -> None:
+        excess = self._size - int(self._max_entries * 0.9)
+        self._conn.execute(
+            "DELETE FROM embeddings WHERE key IN "
+            "(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)",
+            (excess,),
+        )
+        self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+
+def create_embedding_cache() -> EmbeddingCache | None:
+    settings = get_settings()
+    if not settings.embedding_cache_enabled:
+        return None
+    return EmbeddingCache(settings.embedding_cache_max_entries)
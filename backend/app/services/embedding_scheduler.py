@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import random
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from threading import Condition
+from typing import Callable, List, Optional, Sequence, Tuple
+
+from app.core.metrics import TOKENS
+from app.utils.tokens import count_tokens
+
+
+@lru_cache(maxsize=None)
+def _retryable() -> Tuple[type, ...]:
+    # openai is only needed once a request is sent; importing it lazily keeps
+    # it off the API's startup path.
+    import openai
+
+    return (
+        openai.RateLimitError,
+        openai.APIConnectionError,
+        openai.APITimeoutError,
+        openai.InternalServerError,
+    )
+
+
+class TokenBucket:
+    def __init__(self, per_minute: int) -> None:
+        self.capacity = float(per_minute)
+        self._tokens = float(per_minute)
+        self._rate = per_minute / 60.0
+        self._updated = time.monotonic()
+        self._condition = Condition()
+
+    def acquire(self, amount: float) -> None:
+        if self.capacity <= 0:
+            return
+        amount = min(float(amount), self.capacity)
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self._rate)
+                self._updated = now
+                if self._tokens >= amount:
+                    self._tokens -= amount
+                    return
+                self._condition.wait((amount - self._tokens) / self._rate)
+
+    def drain(self, seconds: float) -> None:
+        with self._condition:
+            self._tokens = min(self._tokens, -seconds * self._rate)
+            self._updated = time.monotonic()
+
+
+class EmbeddingScheduler:
+    def __init__(
+        self,
+        embed: Callable[[List[str]], List[List[float]]],
+        *,
+        max_batch_tokens: int,
+        max_batch_inputs: int,
+        tokens_per_minute: int,
+        requests_per_minute: int,
+        max_concurrency: int,
+        max_retries: int,
+    ) -> None:
+        self._embed = embed
+        self._max_batch_tokens = max(1, max_batch_tokens)
+        self._max_batch_inputs = max(1, max_batch_inputs)
+        self._tpm = TokenBucket(tokens_per_minute)
+        self._rpm = TokenBucket(requests_per_minute)
+        self._max_retries = max_retries
+        self._executor = ThreadPoolExecutor(
+            max_workers=max(1, max_concurrency), thread_name_prefix="embedding"
+        )
+
+    def embed(self, texts: Sequence[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        batches = self.pack(texts)
+        futures = [
+            self._executor.submit(self._send, [texts[i] for i in indices], tokens)
+            for indices, tokens in batches
+        ]
+        vectors: List[Optional[List[float]]] = [None] * len(texts)
+        for (indices, _), future in zip(batches, futures):
+            for index, vector in zip(indices, future.result()):
+                vectors[index] = vector
+        return vectors  # type: ignore[return-value]
+
+    def pack(self, texts: Sequence[str]) -> List[Tuple[List[int], int]]:
+        batches: List[Tuple[List[int], int]] = []
+        current: List[int] = []
+        current_tokens = 0
+        for index, text in enumerate(texts):
+            tokens = min(count_tokens(text), self._max_batch_tokens)
+            if current and (
+                current_tokens + tokens > self._max_batch_tokens
+                or len(current) >= self._max_batch_inputs
+            ):
+                batches.append((current, current_tokens))
+                current, current_tokens = [], 0
+            current.append(index)
+            current_tokens += tokens
+        if current:
+            batches.append((current, current_tokens))
+        return batches
+
+    def _send(self, texts: List[str], tokens: int) -> List[List[float]]:
+        import openai
+
+        attempt = 0
+        while True:
+            self._rpm.acquire(1)
+            self._tpm.acquire(tokens)
+            try:
+                vectors = self._embed(texts)
+            except _retryable() as exc:
+                attempt += 1
+                if attempt > self._max_retries:
+                    raise
+                delay = _retry_after(exc)
+                if delay is None:
+                    delay = min(60.0, 2 ** attempt)
+                if isinstance(exc, openai.RateLimitError):
+                    self._tpm.drain(delay)
+                    self._rpm.drain(delay)
+                time.sleep(delay + random.uniform(0, delay * 0.25 + 0.1))
+                continue
+            TOKENS.inc(tokens, kind="embedding")
+            return vectors
+
+
+def _retry_after(exc: Exception) -> Optional[float]:
+    response = getattr(exc, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        if "retry-after-ms" in headers:
+            return float(headers["retry-after-ms"]) / 1000
+        if "retry-after" in headers:
+            return float(headers["retry-after"])
+    except ValueError:
+        return None
+    return None
@@ -0,0 +1,17 @@
+from __future__ import annotations
+
+from typing import Dict, List, Sequence
+
+RRF_K = 60
+
+
+def reciprocal_rank_fusion(result_lists: Sequence[List[dict]], top_k: int) -> List[dict]:
+    scores: Dict[str, float] = {}
+    documents: Dict[str, dict] = {}
+    for results in result_lists:
+        for rank, result in enumerate(results, start=1):
+            key = result["id"]
+            scores[key] = scores.get(key, 0.0) + 1.0 / (RRF_K + rank)
+            documents.setdefault(key, result)
+    ranked = sorted(scores, key=scores.__getitem__, reverse=True)[:top_k]
+    return [{**documents[key], "@search.score": scores[key]} for key in ranked]
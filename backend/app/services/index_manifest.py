@@ -0,0 +1,155 @@
+from __future__ import annotations
+
+import sqlite3
+import time
+from dataclasses import dataclass
+from threading import Lock
+from typing import Dict, Iterable, List, Optional
+
+from app.core.sqlite import SQLiteStore
+
+
+@dataclass(frozen=True)
+class ManifestEntry:
+    chunk_id: str
+    content_hash: str
+    chunk_order: int
+    # JSON of the chunk's indexed metadata fields (offsets, pages, section),
+    # so a chunk whose text is unchanged but has moved is still updated.
+    fields: str = ""
+
+
+class IndexManifest(SQLiteStore):
+    filename = "index_manifest.sqlite3"
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        super().__init__(path)
+        self._lock = Lock()
+
+    def _create_schema(self, conn: sqlite3.Connection) -> None:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS manifest_sources ("
+            "source_path TEXT PRIMARY KEY, updated_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS manifest_chunks ("
+            "source_path TEXT NOT NULL, chunk_id TEXT NOT NULL, "
+            "content_hash TEXT NOT NULL, chunk_order INTEGER NOT NULL, "
+            "PRIMARY KEY (source_path, chunk_id))"
+        )
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(manifest_chunks)")}
+        if "fields" not in columns:
+            conn.execute(
+                "ALTER TABLE manifest_chunks ADD COLUMN fields TEXT NOT NULL DEFAULT ''"
+            )
+        # Whole-document hashes. A source either owns chunks for its hash
+        # (alias_of NULL) or is an alias of another source with the same bytes.
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS manifest_documents ("
+            "source_path TEXT PRIMARY KEY, content_hash TEXT NOT NULL, alias_of TEXT, "
+            "updated_at REAL NOT NULL)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS manifest_documents_hash "
+            "ON manifest_documents (content_hash, alias_of)"
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS manifest_documents_alias ON manifest_documents (alias_of)"
+        )
+
+    def get(self, source_path: str) -> Optional[Dict[str, ManifestEntry]]:
+        with self._lock:
+            known = self._conn.execute(
+                "SELECT 1 FROM manifest_sources WHERE source_path = ?", (source_path,)
+            ).fetchone()
+            if not known:
+                return None
+            rows = self._conn.execute(
+                "SELECT chunk_id, content_hash, chunk_order, fields FROM manifest_chunks "
+                "WHERE source_path = ?",
+                (source_path,),
+            ).fetchall()
+        return {row[0]: ManifestEntry(*row) for row in rows}
+
+    def replace(self, source_path: str, entries: Iterable[ManifestEntry]) -> None:
+        rows = [
+            (source_path, e.chunk_id, e.content_hash, e.chunk_order, e.fields) for e in entries
+        ]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute(
+                    "DELETE FROM manifest_chunks WHERE source_path = ?", (source_path,)
+                )
+                self._conn.executemany(
+                    "INSERT INTO manifest_chunks "
+                    "(source_path, chunk_id, content_hash, chunk_order, fields) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    rows,
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO manifest_sources (source_path, updated_at) VALUES (?, ?)",
+                    (source_path, time.time()),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def forget(self, source_path: str) -> None:
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute(
+                    "DELETE FROM manifest_chunks WHERE source_path = ?", (source_path,)
+                )
+                self._conn.execute(
+                    "DELETE FROM manifest_sources WHERE source_path = ?", (source_path,)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def canonical_source(self, content_hash: str) -> Optional[str]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT source_path FROM manifest_documents "
+                "WHERE content_hash = ? AND alias_of IS NULL LIMIT 1",
+                (content_hash,),
+            ).fetchone()
+        return row[0] if row else None
+
+    def record_document(
+        self, source_path: str, content_hash: str, *, alias_of: Optional[str] = None
+    ) -> List[str]:
+        # Records what source_path now holds and returns the aliases that
+        # pointed at its previous bytes; they no longer have chunks to share.
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                stale = [
+                    row[0]
+                    for row in self._conn.execute(
+                        "SELECT source_path FROM manifest_documents "
+                        "WHERE alias_of = ? AND (content_hash != ? OR ? IS NOT NULL)",
+                        (source_path, content_hash, alias_of),
+                    )
+                ]
+                self._conn.executemany(
+                    "DELETE FROM manifest_documents WHERE source_path = ?",
+                    [(name,) for name in stale],
+                )
+                self._conn.execute(
+                    "INSERT OR REPLACE INTO manifest_documents "
+                    "(source_path, content_hash, alias_of, updated_at) VALUES (?, ?, ?, ?)",
+                    (source_path, content_hash, alias_of, time.time()),
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return stale
+
+
+index_manifest = IndexManifest()
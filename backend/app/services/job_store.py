@@ -0,0 +1,397 @@
+from __future__ import annotations
+
+import json
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Tuple
+from uuid import UUID
+
+from app.core.config import get_settings
+from app.core.sqlite import SQLiteStore, state_path
+from app.models.schemas import ProcessStatus, ProcessStep
+
+CHECKPOINTS = ("pending", "downloaded", "embedded", "indexed", "moved")
+PENDING, DOWNLOADED, EMBEDDED, INDEXED, MOVED = range(len(CHECKPOINTS))
+ACTIVE_STATES = ("queued", "running")
+FINISHED_STATES = ("completed", "failed")
+# Per-blob queue states. A leased blob belongs to one worker until its lease
+# expires, after which any worker may claim it again.
+QUEUED, LEASED, DONE, FAILED = "queued", "leased", "done", "failed"
+
+
+@dataclass(frozen=True)
+class ClaimedBlob:
+    job_id: UUID
+    blob_name: str
+    checkpoint: int
+
+
+class JobStore(SQLiteStore):
+    filename = "jobs.sqlite3"
+
+    def __init__(self, path: Optional[str] = None) -> None:
+        super().__init__(path)
+        self._lock = threading.Lock()
+
+    def _create_schema(self, conn: sqlite3.Connection) -> None:
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "job_id TEXT PRIMARY KEY, state TEXT NOT NULL, job_limit INTEGER, "
+            "errors TEXT NOT NULL DEFAULT '[]', created_at REAL NOT NULL, "
+            "updated_at REAL NOT NULL, started_at REAL, finished_at REAL)"
+        )
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+        if "started_at" not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN started_at REAL")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, finished_at)"
+        )
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS job_blobs ("
+            "job_id TEXT NOT NULL, blob_name TEXT NOT NULL, checkpoint INTEGER NOT NULL, "
+            "chunks INTEGER NOT NULL DEFAULT 0, embeddings INTEGER NOT NULL DEFAULT 0, "
+            "updated_at REAL NOT NULL, PRIMARY KEY (job_id, blob_name))"
+        )
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(job_blobs)")}
+        for column, definition in (
+            ("status", "TEXT NOT NULL DEFAULT 'queued'"),
+            ("lease_owner", "TEXT"),
+            ("lease_expires", "REAL"),
+            ("attempts", "INTEGER NOT NULL DEFAULT 0"),
+        ):
+            if column not in columns:
+                conn.execute(f"ALTER TABLE job_blobs ADD COLUMN {column} {definition}")
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS job_blobs_queue ON job_blobs (status, lease_expires)"
+        )
+        # Sources whose chunks changed, polled by answer caches in every
+        # process that shares this database.
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS index_changes ("
+            "seq INTEGER PRIMARY KEY AUTOINCREMENT, source TEXT NOT NULL, "
+            "changed_at REAL NOT NULL)"
+        )
+
+    def create(self, job_id: UUID, limit: Optional[int]) -> None:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, state, job_limit, created_at, updated_at) "
+                "VALUES (?, 'queued', ?, ?, ?)",
+                (str(job_id), limit, now, now),
+            )
+
+    def set_state(self, job_id: UUID, state: str, error: Optional[str] = None) -> None:
+        now = time.time()
+        finished_at = now if state in FINISHED_STATES else None
+        started_at = now if state == "running" else None
+        with self._lock:
+            if error is None:
+                self._conn.execute(
+                    "UPDATE jobs SET state = ?, updated_at = ?, finished_at = ?, "
+                    "started_at = COALESCE(started_at, ?) WHERE job_id = ?",
+                    (state, now, finished_at, started_at, str(job_id)),
+                )
+                return
+            self._append_error(str(job_id), error, now)
+            self._conn.execute(
+                "UPDATE jobs SET state = ?, finished_at = ? WHERE job_id = ?",
+                (state, finished_at, str(job_id)),
+            )
+
+    def enqueue(self, job_id: UUID, blob_names: Iterable[str]) -> None:
+        now = time.time()
+        with self._lock, self._transaction():
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO job_blobs (job_id, blob_name, checkpoint, status, "
+                "updated_at) VALUES (?, ?, ?, ?, ?)",
+                [(str(job_id), name, PENDING, QUEUED, now) for name in blob_names],
+            )
+            self._finish_if_done(str(job_id))
+
+    def checkpoint(
+        self,
+        job_id: UUID,
+        blob_name: str,
+        checkpoint: Optional[int] = None,
+        *,
+        chunks: Optional[int] = None,
+        embeddings: Optional[int] = None,
+    ) -> None:
+        with self._lock:
+            self._conn.execute(
+                "UPDATE job_blobs SET checkpoint = MAX(checkpoint, COALESCE(?, checkpoint)), "
+                "chunks = COALESCE(?, chunks), embeddings = COALESCE(?, embeddings), "
+                "updated_at = ? WHERE job_id = ? AND blob_name = ?",
+                (checkpoint, chunks, embeddings, time.time(), str(job_id), blob_name),
+            )
+
+    def claim(self, owner: str, limit: int, lease_seconds: float) -> List[ClaimedBlob]:
+        # Expired leases that used their last attempt are left to
+        # expire_exhausted(), so the caller can release their blobs.
+        now = time.time()
+        max_attempts = get_settings().processing_worker_max_attempts
+        with self._lock, self._transaction():
+            rows = self._conn.execute(
+                "SELECT rowid, job_id, blob_name, checkpoint FROM job_blobs "
+                "WHERE status = ? OR (status = ? AND lease_expires < ? AND attempts < ?) "
+                "ORDER BY rowid LIMIT ?",
+                (QUEUED, LEASED, now, max_attempts, max(1, limit)),
+            ).fetchall()
+            if not rows:
+                return []
+            self._conn.executemany(
+                "UPDATE job_blobs SET status = ?, lease_owner = ?, lease_expires = ?, "
+                "attempts = attempts + 1, updated_at = ? WHERE rowid = ?",
+                [(LEASED, owner, now + lease_seconds, now, rowid) for rowid, *_ in rows],
+            )
+            self._conn.executemany(
+                "UPDATE jobs SET state = 'running', updated_at = ?, "
+                "started_at = COALESCE(started_at, ?) WHERE job_id = ? AND state = 'queued'",
+                [(now, now, job_id) for job_id in {row[1] for row in rows}],
+            )
+        return [
+            ClaimedBlob(job_id=UUID(job_id), blob_name=name, checkpoint=checkpoint)
+            for _, job_id, name, checkpoint in rows
+        ]
+
+    def heartbeat(self, owner: str, lease_seconds: float) -> int:
+        now = time.time()
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE job_blobs SET lease_expires = ? WHERE status = ? AND lease_owner = ?",
+                (now + lease_seconds, LEASED, owner),
+            ).rowcount
+
+    def release(self, owner: str) -> int:
+        # Hands unfinished leases back without charging an attempt, for a
+        # worker that is shutting down cleanly.
+        with self._lock:
+            return self._conn.execute(
+                "UPDATE job_blobs SET status = ?, lease_owner = NULL, lease_expires = NULL, "
+                "attempts = MAX(attempts - 1, 0), updated_at = ? "
+                "WHERE status = ? AND lease_owner = ?",
+                (QUEUED, time.time(), LEASED, owner),
+            ).rowcount
+
+    def complete(self, job_id: UUID, blob_name: str) -> Optional[str]:
+        with self._lock, self._transaction():
+            self._conn.execute(
+                "UPDATE job_blobs SET status = ?, checkpoint = MAX(checkpoint, ?), "
+                "lease_owner = NULL, lease_expires = NULL, updated_at = ? "
+                "WHERE job_id = ? AND blob_name = ?",
+                (DONE, MOVED, time.time(), str(job_id), blob_name),
+            )
+            return self._finish_if_done(str(job_id))
+
+    def fail(
+        self, job_id: UUID, blob_name: str, error: str, max_attempts: int
+    ) -> Tuple[bool, Optional[str]]:
+        now = time.time()
+        with self._lock, self._transaction():
+            row = self._conn.execute(
+                "SELECT attempts FROM job_blobs WHERE job_id = ? AND blob_name = ?",
+                (str(job_id), blob_name),
+            ).fetchone()
+            retry = row is not None and row[0] < max_attempts
+            self._conn.execute(
+                "UPDATE job_blobs SET status = ?, lease_owner = NULL, lease_expires = NULL, "
+                "updated_at = ? WHERE job_id = ? AND blob_name = ?",
+                (QUEUED if retry else FAILED, now, str(job_id), blob_name),
+            )
+            if retry:
+                return True, None
+            self._append_error(str(job_id), f"{blob_name}: {error}", now)
+            return False, self._finish_if_done(str(job_id))
+
+    def record_index_changes(self, sources: Iterable[str], retention_seconds: float) -> None:
+        now = time.time()
+        rows = [(source, now) for source in dict.fromkeys(sources)]
+        if not rows:
+            return
+        with self._lock, self._transaction():
+            self._conn.executemany(
+                "INSERT INTO index_changes (source, changed_at) VALUES (?, ?)", rows
+            )
+            self._conn.execute(
+                "DELETE FROM index_changes WHERE changed_at < ? "
+                "AND seq < (SELECT MAX(seq) FROM index_changes)",
+                (now - retention_seconds,),
+            )
+
+    def latest_index_change(self) -> int:
+        row = self._reader().execute("SELECT MAX(seq) FROM index_changes").fetchone()
+        return row[0] or 0
+
+    def index_changes_since(self, seq: int) -> Tuple[int, Optional[List[str]]]:
+        # None means changes after ``seq`` were already pruned, so the caller
+        # can't tell what went stale.
+        reader = self._reader()
+        oldest, latest = reader.execute(
+            "SELECT MIN(seq), MAX(seq) FROM index_changes"
+        ).fetchone()
+        if latest is None or latest <= seq:
+            return seq, []
+        if oldest > seq + 1:
+            return latest, None
+        rows = reader.execute(
+            "SELECT DISTINCT source FROM index_changes WHERE seq > ? AND seq <= ?",
+            (seq, latest),
+        ).fetchall()
+        return latest, [source for (source,) in rows]
+
+    def get(self, job_id: UUID) -> Optional[ProcessStatus]:
+        reader = self._reader()
+        row = reader.execute(
+            "SELECT state, errors, started_at, finished_at FROM jobs WHERE job_id = ?",
+            (str(job_id),),
+        ).fetchone()
+        if row is None:
+            return None
+        files, moved, chunks, indexed, embeddings, embedded = reader.execute(
+            "SELECT COUNT(*), "
+            "COALESCE(SUM(checkpoint >= :moved), 0), "
+            "COALESCE(SUM(chunks), 0), "
+            "COALESCE(SUM(CASE WHEN checkpoint >= :indexed THEN chunks ELSE 0 END), 0), "
+            "COALESCE(SUM(embeddings), 0), "
+            "COALESCE(SUM(CASE WHEN checkpoint >= :embedded THEN embeddings ELSE 0 END), 0) "
+            "FROM job_blobs WHERE job_id = :job_id",
+            {"moved": MOVED, "indexed": INDEXED, "embedded": EMBEDDED, "job_id": str(job_id)},
+        ).fetchone()
+        state, errors, started_at, finished_at = row
+        docs_per_second = chunks_per_second = eta_seconds = None
+        if started_at is not None:
+            elapsed = max((finished_at or time.time()) - started_at, 1e-6)
+            docs_per_second = moved / elapsed
+            chunks_per_second = indexed / elapsed
+            if state in ACTIVE_STATES and moved:
+                eta_seconds = (files - moved) / docs_per_second
+        return ProcessStatus(
+            job_id=job_id,
+            state=state,
+            steps=[
+                ProcessStep(step="filesDiscovered", current=files, total=files),
+                ProcessStep(step="filesProcessed", current=moved, total=files),
+                ProcessStep(step="chunksIndexed", current=indexed, total=chunks),
+                ProcessStep(step="embeddingsCreated", current=embedded, total=embeddings),
+            ],
+            errors=json.loads(errors),
+            docs_per_second=docs_per_second,
+            chunks_per_second=chunks_per_second,
+            eta_seconds=eta_seconds,
+        )
+
+    def evict(self, max_age_seconds: float, max_count: int) -> int:
+        cutoff = time.time() - max_age_seconds
+        with self._lock:
+            finished = [
+                job_id
+                for (job_id,) in self._conn.execute(
+                    "SELECT job_id FROM jobs WHERE state IN (?, ?) "
+                    "ORDER BY finished_at DESC",
+                    FINISHED_STATES,
+                ).fetchall()
+            ]
+            keep = set(finished[: max(0, max_count)])
+            recent = {
+                job_id
+                for (job_id,) in self._conn.execute(
+                    "SELECT job_id FROM jobs WHERE state IN (?, ?) AND finished_at >= ?",
+                    (*FINISHED_STATES, cutoff),
+                ).fetchall()
+            }
+            doomed = [(job_id,) for job_id in finished if job_id not in keep or job_id not in recent]
+            if not doomed:
+                return 0
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany("DELETE FROM job_blobs WHERE job_id = ?", doomed)
+                self._conn.executemany("DELETE FROM jobs WHERE job_id = ?", doomed)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return len(doomed)
+
+    def expire_exhausted(self) -> List[Tuple[UUID, str, Optional[str]]]:
+        # Fails blobs whose worker died holding their last attempt. Returns
+        # (job_id, blob_name, job state if the job finished) for each, so the
+        # caller can hand the blobs back to the catalog.
+        now = time.time()
+        max_attempts = get_settings().processing_worker_max_attempts
+        with self._lock, self._transaction():
+            rows = self._conn.execute(
+                "SELECT job_id, blob_name FROM job_blobs "
+                "WHERE status = ? AND lease_expires < ? AND attempts >= ?",
+                (LEASED, now, max_attempts),
+            ).fetchall()
+            for job_id, blob_name in rows:
+                self._conn.execute(
+                    "UPDATE job_blobs SET status = ?, lease_owner = NULL, "
+                    "lease_expires = NULL, updated_at = ? WHERE job_id = ? AND blob_name = ?",
+                    (FAILED, now, job_id, blob_name),
+                )
+                self._append_error(
+                    job_id, f"{blob_name}: lease expired after {max_attempts} attempts", now
+                )
+            states = {job_id: self._finish_if_done(job_id) for job_id, _ in rows}
+        return [(UUID(job_id), blob_name, states[job_id]) for job_id, blob_name in rows]
+
+    def _finish_if_done(self, job_id: str) -> Optional[str]:
+        open_blobs, failed = self._conn.execute(
+            "SELECT COALESCE(SUM(status IN (?, ?)), 0), COALESCE(SUM(status = ?), 0) "
+            "FROM job_blobs WHERE job_id = ?",
+            (QUEUED, LEASED, FAILED, job_id),
+        ).fetchone()
+        if open_blobs:
+            return None
+        state = "failed" if failed else "completed"
+        now = time.time()
+        updated = self._conn.execute(
+            "UPDATE jobs SET state = ?, updated_at = ?, finished_at = ? "
+            "WHERE job_id = ? AND state IN (?, ?)",
+            (state, now, now, job_id, *ACTIVE_STATES),
+        ).rowcount
+        return state if updated else None
+
+    def _append_error(self, job_id: str, error: str, now: float) -> None:
+        row = self._conn.execute("SELECT errors FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        errors = json.loads(row[0]) if row else []
+        errors.append(error)
+        self._conn.execute(
+            "UPDATE jobs SET errors = ?, updated_at = ? WHERE job_id = ?",
+            (json.dumps(errors), now, job_id),
+        )
+
+    @contextmanager
+    def _transaction(self) -> Iterator[None]:
+        # IMMEDIATE takes the write lock up front so claims from other worker
+        # processes serialize instead of racing on the same rows.
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._conn.execute("COMMIT")
+
+
+def job_scratch_dir(job_id: UUID) -> Path:
+    directory = state_path("jobs") / str(job_id)
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory
+
+
+def evict_finished_jobs() -> int:
+    settings = get_settings()
+    return job_store.evict(
+        settings.processing_job_retention_hours * 3600,
+        settings.processing_job_retention_count,
+    )
+
+
+job_store = JobStore()
@@ -0,0 +1,772 @@
+from __future__ import annotations
+
+import asyncio
+import base64
+import fcntl
+import hashlib
+import json
+import math
+import mmap
+import os
+import re
+import shutil
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+from functools import cached_property
+from pathlib import Path
+from threading import RLock
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from app.core.config import get_settings
+from app.services.fusion import reciprocal_rank_fusion
+from app.utils.quantization import (
+    binary_scores,
+    int8_scales,
+    int8_scores,
+    quantize_binary,
+    quantize_int8,
+)
+
+_TOKEN = re.compile(r"\w+")
+_BUCKETS = 1 << 20
+_K1 = 1.2
+_B = 0.75
+_MATMUL_ROWS = 65536
+_IVF_MIN_ROWS = 20000
+_KMEANS_SAMPLE = 50000
+_KMEANS_ITERATIONS = 10
+
+
+def _term_counts(text: str) -> Counter:
+    return Counter(
+        zlib.crc32(token.encode("utf-8")) & (_BUCKETS - 1)
+        for token in _TOKEN.findall(text.lower())
+    )
+
+
+def _key_hash(value: str) -> np.uint64:
+    digest = hashlib.blake2b(value.encode("utf-8"), digest_size=8).digest()
+    return np.uint64(int.from_bytes(digest, "little"))
+
+
+def _write_lookup(directory: Path, name: str, hashes: np.ndarray) -> None:
+    order = np.argsort(hashes, kind="stable")
+    np.save(directory / f"{name}_hashes.npy", hashes[order])
+    np.save(directory / f"{name}_rows.npy", order.astype(np.int32))
+
+
+def _unit(vector: Iterable[float]) -> np.ndarray:
+    array = np.asarray(vector, dtype=np.float32)
+    norm = float(np.linalg.norm(array))
+    return array / norm if norm else array
+
+
+def _top(scores: np.ndarray, k: int) -> np.ndarray:
+    if k >= len(scores):
+        return np.argsort(-scores)
+    best = np.argpartition(-scores, k)[:k]
+    return best[np.argsort(-scores[best])]
+
+
+def _spherical_kmeans(sample: np.ndarray, nlist: int) -> np.ndarray:
+    rng = np.random.default_rng(0)
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(_KMEANS_ITERATIONS):
+        assignment = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, sample)
+        counts = np.bincount(assignment, minlength=nlist)
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = sample[rng.choice(len(sample), int(empty.sum()), replace=False)]
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums / np.maximum(norms, 1e-12)
+    return centroids.astype(np.float32)
+
+
+class _Segment:
+    def __init__(self, directory: Optional[Path], dim: int) -> None:
+        self.directory = directory
+        self.dim = dim
+        self.count = 0
+        self.centroids: Optional[np.ndarray] = None
+        self.quantization = "none"
+        # Sorted key hashes -> rows, so id and source lookups don't parse
+        # every document. Segments written before these existed have none.
+        self.id_hashes: Optional[np.ndarray] = None
+        self.source_hashes: Optional[np.ndarray] = None
+        if directory is None:
+            return
+        meta = json.loads((directory / "meta.json").read_text())
+        self.count = meta["count"]
+        self.quantization = meta.get("quantization", "none")
+        if not self.count:
+            return
+        self.vectors = np.memmap(
+            directory / "vectors.f32", dtype=np.float32, mode="r", shape=(self.count, dim)
+        )
+        self.doc_offsets = np.load(directory / "docs_offsets.npy", mmap_mode="r")
+        with open(directory / "docs.jsonl", "rb") as handle:
+            self._docs = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        self.postings_offsets = np.load(directory / "postings_offsets.npy", mmap_mode="r")
+        self.postings_rows = np.load(directory / "postings_rows.npy", mmap_mode="r")
+        self.postings_tf = np.load(directory / "postings_tf.npy", mmap_mode="r")
+        self.doc_lengths = np.load(directory / "doc_lengths.npy", mmap_mode="r")
+        if (directory / "id_hashes.npy").exists():
+            self.id_hashes = np.load(directory / "id_hashes.npy", mmap_mode="r")
+            self.id_rows = np.load(directory / "id_rows.npy", mmap_mode="r")
+            self.source_hashes = np.load(directory / "source_hashes.npy", mmap_mode="r")
+            self.source_rows = np.load(directory / "source_rows.npy", mmap_mode="r")
+        if self.quantization == "int8":
+            self.codes = np.memmap(
+                directory / "codes.i8", dtype=np.int8, mode="r", shape=(self.count, dim)
+            )
+            self.scales = np.load(directory / "scales.npy")
+        elif self.quantization == "binary":
+            self.codes = np.memmap(
+                directory / "codes.bin", dtype=np.uint8, mode="r", shape=(self.count, (dim + 7) // 8)
+            )
+        if (directory / "ivf_centroids.npy").exists():
+            self.centroids = np.load(directory / "ivf_centroids.npy")
+            self.list_offsets = np.load(directory / "ivf_offsets.npy", mmap_mode="r")
+            self.list_rows = np.load(directory / "ivf_rows.npy", mmap_mode="r")
+
+    def doc(self, row: int) -> dict:
+        start, end = int(self.doc_offsets[row]), int(self.doc_offsets[row + 1])
+        return json.loads(self._docs[start:end])
+
+    def rows_for_id(self, key: str) -> List[int]:
+        return self._rows(self.id_hashes, self.id_rows, key)
+
+    def rows_for_source(self, source_path: str) -> List[int]:
+        return self._rows(self.source_hashes, self.source_rows, source_path)
+
+    def row_hashes(self) -> Tuple[np.ndarray, np.ndarray]:
+        ids = np.empty(self.count, dtype=np.uint64)
+        sources = np.empty(self.count, dtype=np.uint64)
+        ids[np.asarray(self.id_rows)] = self.id_hashes
+        sources[np.asarray(self.source_rows)] = self.source_hashes
+        return ids, sources
+
+    @staticmethod
+    def _rows(hashes: np.ndarray, rows: np.ndarray, value: str) -> List[int]:
+        key = _key_hash(value)
+        start = int(np.searchsorted(hashes, key, side="left"))
+        end = int(np.searchsorted(hashes, key, side="right"))
+        return [int(row) for row in rows[start:end]]
+
+    def document_frequency(self, bucket: int) -> int:
+        if not self.count:
+            return 0
+        return int(self.postings_offsets[bucket + 1] - self.postings_offsets[bucket])
+
+
+class LocalVectorIndex:
+    def __init__(
+        self,
+        path: str,
+        nprobe: int = 16,
+        compact_threshold: int = 20000,
+        quantization: str = "none",
+        oversampling: float = 4.0,
+    ) -> None:
+        self._root = Path(path)
+        self._root.mkdir(parents=True, exist_ok=True)
+        self._nprobe = nprobe
+        self._compact_threshold = compact_threshold
+        self._quantization = quantization
+        self._oversampling = max(1.0, oversampling)
+        self._lock = RLock()
+        self._dim = 0
+        self._base = _Segment(None, 0)
+        self._tombstones: set[int] = set()
+        self._base_ids: Optional[Dict[str, int]] = None
+        self._tail_docs: List[Optional[dict]] = []
+        self._tail_vectors: List[np.ndarray] = []
+        self._tail_terms: List[Counter] = []
+        self._tail_ids: Dict[str, int] = {}
+        self._tail_sources: Dict[str, set[str]] = {}
+        self._tail_matrix: Optional[np.ndarray] = None
+        self._tail_offset = 0
+        self._lock_handle = None
+        self._sync()
+
+    @property
+    def dim(self) -> int:
+        return self._dim
+
+    def __len__(self) -> int:
+        self._sync()
+        with self._lock:
+            return self._base.count - len(self._tombstones) + len(self._tail_ids)
+
+    def ensure_dimensions(self, dim: int) -> None:
+        with self._lock:
+            if self._dim and self._dim != dim:
+                raise ValueError(
+                    f"Local index at {self._root} stores {self._dim}-dim vectors, not {dim}"
+                )
+            if not self._dim:
+                self._dim = dim
+                (self._root / "index.json").write_text(json.dumps({"dim": dim}))
+
+    def upsert(self, documents: Iterable[dict]) -> None:
+        with self._writing(), open(self._root / "tail.log", "a", encoding="utf-8") as log:
+            for document in documents:
+                doc = {k: v for k, v in document.items() if k != "embedding"}
+                vector = _unit(document["embedding"])
+                self.ensure_dimensions(len(vector))
+                self._apply_upsert(doc, vector)
+                log.write(
+                    json.dumps(
+                        {
+                            "op": "upsert",
+                            "doc": doc,
+                            "vector": base64.b64encode(vector.tobytes()).decode("ascii"),
+                        }
+                    )
+                    + "\n"
+                )
+            log.flush()
+            os.fsync(log.fileno())
+            self._tail_offset = os.fstat(log.fileno()).st_size
+            if len(self._tail_docs) >= self._compact_threshold:
+                self.compact()
+
+    def merge(self, documents: Iterable[dict]) -> None:
+        with self._writing():
+            merged = []
+            for partial in documents:
+                found = self._lookup(partial["id"])
+                if found is None:
+                    raise KeyError(f"Document {partial['id']} not found in local index")
+                doc, vector = found
+                merged.append({**doc, **partial, "embedding": partial.get("embedding", vector)})
+            self.upsert(merged)
+
+    def delete(self, ids: Iterable[str]) -> None:
+        with self._writing(), open(self._root / "tail.log", "a", encoding="utf-8") as log:
+            for key in ids:
+                self._apply_delete(key)
+                log.write(json.dumps({"op": "delete", "id": key}) + "\n")
+            log.flush()
+            os.fsync(log.fileno())
+            self._tail_offset = os.fstat(log.fileno()).st_size
+
+    def ids_for_source(self, source_path: str) -> List[str]:
+        self._sync()
+        with self._lock:
+            base = self._base
+            if base.source_hashes is not None:
+                rows: Iterable[int] = base.rows_for_source(source_path)
+            else:
+                rows = range(base.count)
+            docs = (base.doc(row) for row in rows if row not in self._tombstones)
+            ids = [doc["id"] for doc in docs if doc.get("source_path") == source_path]
+            ids.extend(self._tail_sources.get(source_path, ()))
+        return ids
+
+    def export_vectors(self) -> np.ndarray:
+        self._sync()
+        with self._lock:
+            blocks = []
+            if self._base.count:
+                live = np.array(
+                    [row for row in range(self._base.count) if row not in self._tombstones],
+                    dtype=np.int64,
+                )
+                blocks.append(np.asarray(self._base.vectors[live]))
+            blocks.extend(
+                vector[None, :]
+                for vector, doc in zip(self._tail_vectors, self._tail_docs)
+                if doc is not None
+            )
+        if not blocks:
+            return np.zeros((0, self._dim), dtype=np.float32)
+        return np.vstack(blocks)
+
+    def vector_search(self, embedding: Iterable[float], top_k: int) -> List[dict]:
+        query = _unit(embedding)
+        self._sync()
+        with self._lock:
+            base, tombstones = self._base, set(self._tombstones)
+            tail_docs = list(self._tail_docs)
+            tail_matrix = self._tail_vector_matrix()
+        candidates: List[Tuple[float, int, int]] = []
+        if base.count:
+            rows, scores = self._base_vector_scores(base, query, top_k)
+            if tombstones:
+                keep = ~np.isin(rows, list(tombstones))
+                rows, scores = rows[keep], scores[keep]
+            for idx in _top(scores, top_k):
+                candidates.append((float(scores[idx]), 0, int(rows[idx])))
+        if tail_matrix is not None:
+            scores = tail_matrix @ query
+            scores[[i for i, doc in enumerate(tail_docs) if doc is None]] = -np.inf
+            for idx in _top(scores, top_k):
+                if tail_docs[idx] is not None:
+                    candidates.append((float(scores[idx]), 1, int(idx)))
+        return self._materialize(base, tail_docs, candidates, top_k)
+
+    def keyword_search(self, query: str, top_k: int) -> List[dict]:
+        terms = _term_counts(query)
+        if not terms:
+            return []
+        self._sync()
+        with self._lock:
+            base, tombstones = self._base, set(self._tombstones)
+            tail_docs = list(self._tail_docs)
+            tail_terms = list(self._tail_terms)
+        live_tail = [i for i, doc in enumerate(tail_docs) if doc is not None]
+        total = base.count - len(tombstones) + len(live_tail)
+        if total <= 0:
+            return []
+        tail_lengths = {i: sum(tail_terms[i].values()) for i in live_tail}
+        length_sum = float(np.sum(base.doc_lengths)) if base.count else 0.0
+        average_length = max(1.0, (length_sum + sum(tail_lengths.values())) / total)
+
+        base_scores = np.zeros(base.count, dtype=np.float32) if base.count else None
+        tail_scores: Dict[int, float] = {}
+        for bucket in terms:
+            tail_hits = [i for i in live_tail if bucket in tail_terms[i]]
+            df = base.document_frequency(bucket) + len(tail_hits)
+            if not df:
+                continue
+            idf = math.log(1.0 + (total - df + 0.5) / (df + 0.5))
+            if base_scores is not None:
+                start = int(base.postings_offsets[bucket])
+                end = int(base.postings_offsets[bucket + 1])
+                if end > start:
+                    rows = np.asarray(base.postings_rows[start:end])
+                    tf = np.asarray(base.postings_tf[start:end], dtype=np.float32)
+                    norm = _K1 * (1 - _B + _B * base.doc_lengths[rows] / average_length)
+                    np.add.at(base_scores, rows, idf * tf * (_K1 + 1) / (tf + norm))
+            for i in tail_hits:
+                tf = tail_terms[i][bucket]
+                norm = _K1 * (1 - _B + _B * tail_lengths[i] / average_length)
+                tail_scores[i] = tail_scores.get(i, 0.0) + idf * tf * (_K1 + 1) / (tf + norm)
+
+        candidates: List[Tuple[float, int, int]] = []
+        if base_scores is not None:
+            if tombstones:
+                base_scores[list(tombstones)] = 0.0
+            for row in _top(base_scores, top_k):
+                if base_scores[row] > 0:
+                    candidates.append((float(base_scores[row]), 0, int(row)))
+        candidates.extend((score, 1, i) for i, score in tail_scores.items())
+        return self._materialize(base, tail_docs, candidates, top_k)
+
+    def hybrid_search(self, query: str, top_k: int, embedding: Iterable[float]) -> List[dict]:
+        return reciprocal_rank_fusion(
+            [self.keyword_search(query, top_k), self.vector_search(embedding, top_k)],
+            top_k,
+        )
+
+    def compact(self) -> None:
+        with self._writing():
+            live_rows = np.array(
+                [row for row in range(self._base.count) if row not in self._tombstones],
+                dtype=np.int64,
+            )
+            live_tail = [i for i, doc in enumerate(self._tail_docs) if doc is not None]
+            count = len(live_rows) + len(live_tail)
+            generation = self._generation() + 1
+            directory = self._root / f"segment-{generation}"
+            shutil.rmtree(directory, ignore_errors=True)
+            directory.mkdir()
+            if count:
+                self._write_segment(directory, live_rows, live_tail)
+            (directory / "meta.json").write_text(
+                json.dumps(
+                    {
+                        "count": count,
+                        "dim": self._dim,
+                        "quantization": self._quantization if count else "none",
+                    }
+                )
+            )
+            current = self._root / "CURRENT.tmp"
+            current.write_text(directory.name)
+            os.replace(current, self._root / "CURRENT")
+            (self._root / "tail.log").write_text("")
+            self._tail_offset = 0
+            previous = self._base.directory
+            self._reset_tail()
+            self._base = _Segment(directory, self._dim)
+            if previous is not None and previous != directory:
+                shutil.rmtree(previous, ignore_errors=True)
+
+    def _write_segment(self, directory: Path, live_rows: np.ndarray, live_tail: List[int]) -> None:
+        base = self._base
+        vectors = np.memmap(
+            directory / "vectors.f32",
+            dtype=np.float32,
+            mode="w+",
+            shape=(len(live_rows) + len(live_tail), self._dim),
+        )
+        for start in range(0, len(live_rows), _MATMUL_ROWS):
+            rows = live_rows[start : start + _MATMUL_ROWS]
+            vectors[start : start + len(rows)] = base.vectors[rows]
+        for offset, idx in enumerate(live_tail):
+            vectors[len(live_rows) + offset] = self._tail_vectors[idx]
+        vectors.flush()
+        if self._quantization != "none":
+            self._write_codes(directory, vectors)
+
+        offsets = [0]
+        with open(directory / "docs.jsonl", "wb") as handle:
+            for row in live_rows:
+                start, end = int(base.doc_offsets[row]), int(base.doc_offsets[row + 1])
+                handle.write(base._docs[start:end])
+                offsets.append(offsets[-1] + end - start)
+            for idx in live_tail:
+                line = json.dumps(self._tail_docs[idx]).encode("utf-8")
+                handle.write(line)
+                offsets.append(offsets[-1] + len(line))
+        np.save(directory / "docs_offsets.npy", np.asarray(offsets, dtype=np.int64))
+        self._write_lookups(directory, live_rows, live_tail)
+
+        buckets: List[np.ndarray] = []
+        rows_out: List[np.ndarray] = []
+        tfs: List[np.ndarray] = []
+        lengths = np.zeros(len(live_rows) + len(live_tail), dtype=np.float32)
+        if base.count and len(live_rows):
+            remap = np.full(base.count, -1, dtype=np.int64)
+            remap[live_rows] = np.arange(len(live_rows))
+            base_buckets = np.repeat(
+                np.arange(_BUCKETS, dtype=np.int64), np.diff(base.postings_offsets)
+            )
+            new_rows = remap[np.asarray(base.postings_rows)]
+            keep = new_rows >= 0
+            buckets.append(base_buckets[keep])
+            rows_out.append(new_rows[keep])
+            tfs.append(np.asarray(base.postings_tf)[keep])
+            lengths[: len(live_rows)] = np.asarray(base.doc_lengths)[live_rows]
+        for offset, idx in enumerate(live_tail):
+            row = len(live_rows) + offset
+            terms = self._tail_terms[idx]
+            buckets.append(np.fromiter(terms.keys(), dtype=np.int64, count=len(terms)))
+            rows_out.append(np.full(len(terms), row, dtype=np.int64))
+            tfs.append(np.fromiter(terms.values(), dtype=np.float32, count=len(terms)))
+            lengths[row] = sum(terms.values())
+        all_buckets = np.concatenate(buckets) if buckets else np.zeros(0, dtype=np.int64)
+        order = np.argsort(all_buckets, kind="stable")
+        postings_offsets = np.zeros(_BUCKETS + 1, dtype=np.int64)
+        np.cumsum(np.bincount(all_buckets, minlength=_BUCKETS), out=postings_offsets[1:])
+        np.save(directory / "postings_offsets.npy", postings_offsets)
+        np.save(
+            directory / "postings_rows.npy",
+            (np.concatenate(rows_out) if rows_out else np.zeros(0))[order].astype(np.int32),
+        )
+        np.save(
+            directory / "postings_tf.npy",
+            (np.concatenate(tfs) if tfs else np.zeros(0))[order].astype(np.float32),
+        )
+        np.save(directory / "doc_lengths.npy", lengths)
+
+        total = len(lengths)
+        if total >= _IVF_MIN_ROWS:
+            nlist = min(4096, int(4 * math.sqrt(total)))
+            rng = np.random.default_rng(0)
+            sample_rows = np.sort(rng.choice(total, min(total, _KMEANS_SAMPLE), replace=False))
+            centroids = _spherical_kmeans(np.asarray(vectors[sample_rows]), nlist)
+            assignment = np.empty(total, dtype=np.int32)
+            for start in range(0, total, _MATMUL_ROWS):
+                block = np.asarray(vectors[start : start + _MATMUL_ROWS])
+                assignment[start : start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+            list_offsets = np.zeros(nlist + 1, dtype=np.int64)
+            np.cumsum(np.bincount(assignment, minlength=nlist), out=list_offsets[1:])
+            np.save(directory / "ivf_centroids.npy", centroids)
+            np.save(directory / "ivf_offsets.npy", list_offsets)
+            np.save(
+                directory / "ivf_rows.npy",
+                np.argsort(assignment, kind="stable").astype(np.int32),
+            )
+
+    def _write_lookups(self, directory: Path, live_rows: np.ndarray, live_tail: List[int]) -> None:
+        base = self._base
+        id_hashes = np.empty(len(live_rows) + len(live_tail), dtype=np.uint64)
+        source_hashes = np.empty_like(id_hashes)
+        if len(live_rows) and base.id_hashes is not None:
+            base_ids, base_sources = base.row_hashes()
+            id_hashes[: len(live_rows)] = base_ids[live_rows]
+            source_hashes[: len(live_rows)] = base_sources[live_rows]
+        else:
+            for offset, row in enumerate(live_rows):
+                doc = base.doc(int(row))
+                id_hashes[offset] = _key_hash(doc["id"])
+                source_hashes[offset] = _key_hash(doc.get("source_path") or "")
+        for offset, idx in enumerate(live_tail, start=len(live_rows)):
+            doc = self._tail_docs[idx]
+            id_hashes[offset] = _key_hash(doc["id"])
+            source_hashes[offset] = _key_hash(doc.get("source_path") or "")
+        _write_lookup(directory, "id", id_hashes)
+        _write_lookup(directory, "source", source_hashes)
+
+    def _write_codes(self, directory: Path, vectors: np.ndarray) -> None:
+        total = len(vectors)
+        if self._quantization == "int8":
+            max_abs = np.zeros(self._dim, dtype=np.float32)
+            for start in range(0, total, _MATMUL_ROWS):
+                block = np.abs(np.asarray(vectors[start : start + _MATMUL_ROWS]))
+                max_abs = np.maximum(max_abs, block.max(axis=0))
+            scales = int8_scales(max_abs)
+            np.save(directory / "scales.npy", scales)
+            codes = np.memmap(
+                directory / "codes.i8", dtype=np.int8, mode="w+", shape=(total, self._dim)
+            )
+            for start in range(0, total, _MATMUL_ROWS):
+                block = np.asarray(vectors[start : start + _MATMUL_ROWS])
+                codes[start : start + len(block)] = quantize_int8(block, scales)
+        else:
+            codes = np.memmap(
+                directory / "codes.bin",
+                dtype=np.uint8,
+                mode="w+",
+                shape=(total, (self._dim + 7) // 8),
+            )
+            for start in range(0, total, _MATMUL_ROWS):
+                block = np.asarray(vectors[start : start + _MATMUL_ROWS])
+                codes[start : start + len(block)] = quantize_binary(block)
+        codes.flush()
+
+    def _base_vector_scores(
+        self, base: _Segment, query: np.ndarray, top_k: int
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        if base.centroids is not None:
+            nprobe = min(self._nprobe, len(base.centroids))
+            probes = _top(base.centroids @ query, nprobe)
+            rows = np.sort(
+                np.concatenate(
+                    [
+                        np.asarray(base.list_rows[base.list_offsets[p] : base.list_offsets[p + 1]])
+                        for p in probes
+                    ]
+                )
+            )
+        else:
+            rows = np.arange(base.count)
+        if base.quantization == "none":
+            return rows, self._score_rows(base.vectors, rows, lambda block: block @ query)
+        if base.quantization == "int8":
+            approximate = self._score_rows(
+                base.codes, rows, lambda block: int8_scores(block, base.scales, query)
+            )
+        else:
+            approximate = self._score_rows(
+                base.codes, rows, lambda block: binary_scores(block, query)
+            )
+        shortlist = np.sort(rows[_top(approximate, int(math.ceil(top_k * self._oversampling)))])
+        return shortlist, np.asarray(base.vectors[shortlist]) @ query
+
+    @staticmethod
+    def _score_rows(
+        matrix: np.ndarray, rows: np.ndarray, score: Callable[[np.ndarray], np.ndarray]
+    ) -> np.ndarray:
+        scores = np.empty(len(rows), dtype=np.float32)
+        for start in range(0, len(rows), _MATMUL_ROWS):
+            block = np.asarray(matrix[rows[start : start + _MATMUL_ROWS]])
+            scores[start : start + len(block)] = score(block)
+        return scores
+
+    def _materialize(
+        self,
+        base: _Segment,
+        tail_docs: List[Optional[dict]],
+        candidates: List[Tuple[float, int, int]],
+        top_k: int,
+    ) -> List[dict]:
+        candidates.sort(key=lambda item: item[0], reverse=True)
+        results = []
+        for score, source, position in candidates[:top_k]:
+            doc = base.doc(position) if source == 0 else tail_docs[position]
+            results.append({**doc, "@search.score": score})
+        return results
+
+    def _tail_vector_matrix(self) -> Optional[np.ndarray]:
+        if not self._tail_vectors:
+            return None
+        if self._tail_matrix is None or len(self._tail_matrix) != len(self._tail_vectors):
+            self._tail_matrix = np.vstack(self._tail_vectors)
+        return self._tail_matrix
+
+    def _lookup(self, key: str) -> Optional[Tuple[dict, List[float]]]:
+        if key in self._tail_ids:
+            idx = self._tail_ids[key]
+            return dict(self._tail_docs[idx]), self._tail_vectors[idx].tolist()
+        row = self._base_row(key)
+        if row is None or row in self._tombstones:
+            return None
+        return self._base.doc(row), np.asarray(self._base.vectors[row]).tolist()
+
+    def _apply_upsert(self, doc: dict, vector: np.ndarray) -> None:
+        self._apply_delete(doc["id"])
+        self._tail_ids[doc["id"]] = len(self._tail_docs)
+        self._tail_sources.setdefault(doc.get("source_path") or "", set()).add(doc["id"])
+        self._tail_docs.append(doc)
+        self._tail_vectors.append(vector)
+        self._tail_terms.append(_term_counts(doc.get("content", "")))
+
+    def _apply_delete(self, key: str) -> None:
+        idx = self._tail_ids.pop(key, None)
+        if idx is not None:
+            self._tail_sources[self._tail_docs[idx].get("source_path") or ""].discard(key)
+            self._tail_docs[idx] = None
+            self._tail_vectors[idx] = np.zeros(self._dim, dtype=np.float32)
+            self._tail_terms[idx] = Counter()
+            self._tail_matrix = None
+            return
+        row = self._base_row(key)
+        if row is not None:
+            self._tombstones.add(row)
+
+    def _base_row(self, key: str) -> Optional[int]:
+        if self._base.id_hashes is None:
+            return self._base_id_map().get(key)
+        for row in self._base.rows_for_id(key):
+            if self._base.doc(row)["id"] == key:
+                return row
+        return None
+
+    def _base_id_map(self) -> Dict[str, int]:
+        if self._base_ids is None:
+            self._base_ids = {self._base.doc(row)["id"]: row for row in range(self._base.count)}
+        return self._base_ids
+
+    def _reset_tail(self) -> None:
+        self._tombstones = set()
+        self._base_ids = None
+        self._tail_docs = []
+        self._tail_vectors = []
+        self._tail_terms = []
+        self._tail_ids = {}
+        self._tail_sources = {}
+        self._tail_matrix = None
+
+    def _generation(self) -> int:
+        if self._base.directory is None:
+            return 0
+        return int(self._base.directory.name.rsplit("-", 1)[1])
+
+    @contextmanager
+    def _file_lock(self, exclusive: bool) -> Iterator[None]:
+        # Serialises tail appends and compaction across processes sharing the
+        # directory; nested calls from this process reuse the held lock.
+        with self._lock:
+            if self._lock_handle is not None:
+                yield
+                return
+            with open(self._root / "LOCK", "a") as handle:
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+                self._lock_handle = handle
+                try:
+                    yield
+                finally:
+                    self._lock_handle = None
+                    fcntl.flock(handle.fileno(), fcntl.LOCK_UN)
+
+    @contextmanager
+    def _writing(self) -> Iterator[None]:
+        with self._file_lock(exclusive=True):
+            self._refresh()
+            yield
+
+    def _sync(self) -> None:
+        with self._lock:
+            if self._changed():
+                with self._file_lock(exclusive=False):
+                    self._refresh()
+
+    def _current_segment(self) -> Optional[str]:
+        try:
+            return (self._root / "CURRENT").read_text().strip()
+        except FileNotFoundError:
+            return None
+
+    def _tail_size(self) -> int:
+        try:
+            return (self._root / "tail.log").stat().st_size
+        except FileNotFoundError:
+            return 0
+
+    def _changed(self) -> bool:
+        base = self._base.directory.name if self._base.directory is not None else None
+        return self._current_segment() != base or self._tail_size() != self._tail_offset
+
+    def _refresh(self) -> None:
+        """Picks up segments and tail entries written by other processes."""
+        if not self._dim and (self._root / "index.json").exists():
+            self._dim = json.loads((self._root / "index.json").read_text())["dim"]
+        if not self._changed():
+            return
+        current = self._current_segment()
+        base = self._base.directory.name if self._base.directory is not None else None
+        if current != base or self._tail_size() < self._tail_offset:
+            self._base = _Segment(self._root / current, self._dim) if current else _Segment(None, 0)
+            self._reset_tail()
+            self._tail_offset = 0
+        with open(self._root / "tail.log", "ab+") as handle:
+            handle.seek(self._tail_offset)
+            for line in handle:
+                if not line.endswith(b"\n"):
+                    break
+                self._tail_offset += len(line)
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                if entry["op"] == "upsert":
+                    vector = np.frombuffer(base64.b64decode(entry["vector"]), dtype=np.float32)
+                    self._apply_upsert(entry["doc"], vector)
+                else:
+                    self._apply_delete(entry["id"])
+
+
+class LocalSearchService:
+    def __init__(
+        self,
+        path: str,
+        nprobe: int = 16,
+        compact_threshold: int = 20000,
+        quantization: str = "none",
+        oversampling: float = 4.0,
+    ) -> None:
+        self._path = path
+        self._options = dict(
+            nprobe=nprobe,
+            compact_threshold=compact_threshold,
+            quantization=quantization,
+            oversampling=oversampling,
+        )
+
+    # Loaded on first use, like the Azure clients, so importing the app
+    # reads no segments.
+    @cached_property
+    def index(self) -> LocalVectorIndex:
+        return LocalVectorIndex(self._path, **self._options)
+
+    def ensure_index(self, vector_dimensions: int | None = None) -> None:
+        self.index.ensure_dimensions(vector_dimensions or get_settings().vector_dimensions)
+
+    def upload_documents(self, documents: Iterable[dict]) -> None:
+        self.index.upsert(documents)
+
+    def merge_documents(self, documents: Iterable[dict]) -> None:
+        self.index.merge(documents)
+
+    def delete_documents(self, ids: Iterable[str]) -> None:
+        self.index.delete(ids)
+
+    def list_chunk_ids(self, source_path: str) -> List[str]:
+        return self.index.ids_for_source(source_path)
+
+    def semantic_hybrid_search(self, query: str, top_k: int, embedding: List[float]):
+        return self.index.hybrid_search(query, top_k, embedding)
+
+    async def akeyword_search(self, query: str, top_k: int) -> List[dict]:
+        return await asyncio.to_thread(self.index.keyword_search, query, top_k)
+
+    async def avector_search(self, embedding: List[float], top_k: int) -> List[dict]:
+        return await asyncio.to_thread(self.index.vector_search, embedding, top_k)
@@ -1,53 +1,236 @@
 from __future__ import annotations
 
+import asyncio
+import logging
 import time
-from typing import List, Sequence
+from functools import cached_property
+from typing import TYPE_CHECKING, AsyncIterator, Dict, List, Optional, Sequence, Set
 
-from langchain_openai import AzureChatOpenAI, AzureOpenAIEmbeddings
+from app.core import metrics
+from app.core.config import NATIVE_EMBEDDING_DIMENSIONS, get_settings
+from app.core.metrics import CACHE_LOOKUPS, TOKENS
+from app.services.embedding_cache import EmbeddingCache, create_embedding_cache
+from app.services.embedding_scheduler import EmbeddingScheduler
+from app.services.query_batcher import QueryEmbeddingBatcher
+from app.utils.tokens import count_tokens
 
-from app.core.config import get_settings
+if TYPE_CHECKING:
+    from langchain_openai import AzureChatOpenAI, AzureOpenAIEmbeddings
+
+logger = logging.getLogger(__name__)
 
 
 class OpenAIClient:
     def __init__(self) -> None:
         settings = get_settings()
-        self.chat = AzureChatOpenAI(
+        self.embedding_scheduler = EmbeddingScheduler(
+            lambda texts: self.bulk_embedding.embed_documents(texts),
+            max_batch_tokens=settings.embedding_batch_max_tokens,
+            max_batch_inputs=settings.processing_batch_size,
+            tokens_per_minute=settings.embedding_tpm_limit,
+            requests_per_minute=settings.embedding_rpm_limit,
+            max_concurrency=settings.embedding_max_concurrency,
+            max_retries=settings.embedding_max_retries,
+        )
+        self.embedding_model = (
+            f"{settings.azure_openai_embedding_deployment}@{settings.vector_dimensions}"
+        )
+        self.embedding_cache: EmbeddingCache | None = create_embedding_cache()
+        self.query_batcher: QueryEmbeddingBatcher | None = None
+        # Cache writes from the async path; held so they are not garbage
+        # collected mid-flight.
+        self._cache_writes: Set[asyncio.Task] = set()
+        if settings.query_embedding_batch_window_ms > 0:
+            self.query_batcher = QueryEmbeddingBatcher(
+                lambda texts: self.embedding.aembed_documents(texts),
+                lambda text: self.embedding.aembed_query(text),
+                max_wait_ms=settings.query_embedding_batch_window_ms,
+                max_batch=settings.query_embedding_batch_max,
+            )
+
+    # The LangChain clients are built on first use: importing langchain_openai
+    # costs more than the rest of the API's startup combined.
+    @cached_property
+    def chat(self) -> AzureChatOpenAI:
+        from langchain_openai import AzureChatOpenAI
+
+        settings = get_settings()
+        return AzureChatOpenAI(
             azure_endpoint=settings.azure_openai_endpoint,
             azure_deployment=settings.azure_openai_gpt4o_deployment,
             api_key=settings.azure_openai_api_key,
             api_version="2024-08-01-preview",
             temperature=0.1,
         )
-        self.embedding = AzureOpenAIEmbeddings(
-            azure_endpoint=settings.azure_openai_endpoint,
-            azure_deployment=settings.azure_openai_embedding_deployment,
-            api_key=settings.azure_openai_api_key,
-            api_version="2024-08-01-preview",
-        )
+
+    @cached_property
+    def embedding(self) -> AzureOpenAIEmbeddings:
+        return _embeddings()
+
+    @cached_property
+    def bulk_embedding(self) -> AzureOpenAIEmbeddings:
+        return _embeddings(max_retries=0)
+
+    def warm_up(self) -> None:
+        self.chat
+        self.embedding
+        self.bulk_embedding
 
     def create_embedding(self, text: str) -> List[float]:
+        if self.embedding_cache is None:
+            return self._embed_query(text)
+        key = EmbeddingCache.key(text, self.embedding_model)
+        cached = self.embedding_cache.get_many([key])
+        if key in cached:
+            CACHE_LOOKUPS.inc(cache="embedding", result="hit")
+            return cached[key]
+        CACHE_LOOKUPS.inc(cache="embedding", result="miss")
+        vector = self._embed_query(text)
+        self.embedding_cache.put_many({key: vector})
+        return vector
+
+    def _embed_query(self, text: str) -> List[float]:
         vector = self.embedding.embed_query(text)
+        if metrics.ENABLED:
+            TOKENS.inc(count_tokens(text), kind="embedding")
         return vector
 
     def batch_embeddings(self, texts: Sequence[str]) -> List[List[float]]:
-        return self.embedding.embed_documents(list(texts))
+        if self.embedding_cache is None:
+            return self.embedding_scheduler.embed(list(texts))
+        keys = [EmbeddingCache.key(text, self.embedding_model) for text in texts]
+        vectors = self.embedding_cache.get_many(keys)
+        missing = {key: text for key, text in zip(keys, texts) if key not in vectors}
+        CACHE_LOOKUPS.inc(len(keys) - len(missing), cache="embedding", result="hit")
+        CACHE_LOOKUPS.inc(len(missing), cache="embedding", result="miss")
+        if missing:
+            fresh = dict(zip(missing, self.embedding_scheduler.embed(list(missing.values()))))
+            self.embedding_cache.put_many(fresh)
+            vectors.update(fresh)
+        return [vectors[key] for key in keys]
 
-    def chat_completion(self, prompt: str, context: str, citations: str) -> tuple[str, float]:
-        system_prompt = (
-            "You are an Azure RAG assistant. Answer only using the provided context."
+    async def acreate_embedding(self, text: str) -> List[float]:
+        if self.embedding_cache is None:
+            return await self._aembed_query(text)
+        key = EmbeddingCache.key(text, self.embedding_model)
+        # SQLite stays off the event loop: even a lookup updates last_used,
+        # and a write can wait out busy_timeout behind an ingestion worker.
+        cached = await asyncio.to_thread(self.embedding_cache.get_many, [key])
+        if key in cached:
+            CACHE_LOOKUPS.inc(cache="embedding", result="hit")
+            return cached[key]
+        CACHE_LOOKUPS.inc(cache="embedding", result="miss")
+        vector = await self._aembed_query(text)
+        self._put_later({key: vector})
+        return vector
+
+    def _put_later(self, vectors: Dict[str, List[float]]) -> None:
+        # The answer doesn't wait for the cache write.
+        task = asyncio.get_running_loop().create_task(
+            asyncio.to_thread(self.embedding_cache.put_many, vectors)
         )
+        self._cache_writes.add(task)
+        task.add_done_callback(self._cache_written)
+
+    def _cache_written(self, task: asyncio.Task) -> None:
+        self._cache_writes.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Embedding cache write failed: %s", task.exception())
+
+    async def _aembed_query(self, text: str) -> List[float]:
+        if self.query_batcher is None:
+            vector = await self.embedding.aembed_query(text)
+        else:
+            vector = await self.query_batcher.embed(text)
+        if metrics.ENABLED:
+            TOKENS.inc(count_tokens(text), kind="embedding")
+        return vector
+
+    def chat_completion(
+        self, prompt: str, context: str, citations: str, history: Sequence[dict] = ()
+    ) -> tuple[str, float]:
+        messages = self._messages(prompt, context, citations, history)
         start = time.perf_counter()
-        response = self.chat.invoke(
-            [
-                {"role": "system", "content": system_prompt},
-                {
-                    "role": "user",
-                    "content": f"Context:\n{context}\nCitations:\n{citations}\nQuestion:{prompt}",
-                },
-            ]
-        )
+        response = self.chat.invoke(messages)
+        latency = (time.perf_counter() - start) * 1000
+        _record_usage(messages, response.content, getattr(response, "usage_metadata", None))
+        return response.content, latency
+
+    async def achat_completion(
+        self, prompt: str, context: str, citations: str, history: Sequence[dict] = ()
+    ) -> tuple[str, float]:
+        messages = self._messages(prompt, context, citations, history)
+        start = time.perf_counter()
+        response = await self.chat.ainvoke(messages)
         latency = (time.perf_counter() - start) * 1000
+        _record_usage(messages, response.content, getattr(response, "usage_metadata", None))
         return response.content, latency
 
+    async def astream_chat(
+        self, prompt: str, context: str, citations: str, history: Sequence[dict] = ()
+    ) -> AsyncIterator[str]:
+        messages = self._messages(prompt, context, citations, history)
+        parts: List[str] = []
+        try:
+            async for chunk in self.chat.astream(messages):
+                if chunk.content:
+                    parts.append(chunk.content)
+                    yield chunk.content
+        finally:
+            _record_usage(messages, "".join(parts), None)
+
+    def complete(self, messages: List[dict]) -> str:
+        response = self.chat.invoke(messages)
+        _record_usage(messages, response.content, getattr(response, "usage_metadata", None))
+        return response.content
+
+    async def acomplete(self, messages: List[dict]) -> str:
+        response = await self.chat.ainvoke(messages)
+        _record_usage(messages, response.content, getattr(response, "usage_metadata", None))
+        return response.content
+
+    @staticmethod
+    def _messages(
+        prompt: str, context: str, citations: str, history: Sequence[dict] = ()
+    ) -> List[dict]:
+        system_prompt = (
+            "You are an Azure RAG assistant. Answer only using the provided context."
+        )
+        return [
+            {"role": "system", "content": system_prompt},
+            *history,
+            {
+                "role": "user",
+                "content": f"Context:\n{context}\nCitations:\n{citations}\nQuestion:{prompt}",
+            },
+        ]
+
+
+def _embeddings(**kwargs) -> AzureOpenAIEmbeddings:
+    from langchain_openai import AzureOpenAIEmbeddings
+
+    settings = get_settings()
+    requested = settings.embedding_dimensions
+    if requested and requested != NATIVE_EMBEDDING_DIMENSIONS.get(settings.embedding_model):
+        kwargs["dimensions"] = requested
+    return AzureOpenAIEmbeddings(
+        azure_endpoint=settings.azure_openai_endpoint,
+        azure_deployment=settings.azure_openai_embedding_deployment,
+        api_key=settings.azure_openai_api_key,
+        api_version="2024-08-01-preview",
+        **kwargs,
+    )
+
+
+def _record_usage(messages: List[dict], completion: str, usage: Optional[dict]) -> None:
+    if not metrics.ENABLED:
+        return
+    if usage:
+        TOKENS.inc(usage.get("input_tokens", 0), kind="prompt")
+        TOKENS.inc(usage.get("output_tokens", 0), kind="completion")
+        return
+    TOKENS.inc(sum(count_tokens(message["content"]) for message in messages), kind="prompt")
+    TOKENS.inc(count_tokens(completion), kind="completion")
+
 
 openai_client = OpenAIClient()
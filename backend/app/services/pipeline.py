@@ -0,0 +1,121 @@
+from __future__ import annotations
+
+import queue
+import threading
+from dataclasses import dataclass
+from typing import Any, Callable, Iterable, List, Optional
+
+_DONE = object()
+
+
+@dataclass
+class Stage:
+    name: str
+    handler: Callable[[Any], Any]
+    workers: int = 1
+    batch_size: int = 1
+    # Flush a partial batch after this long without new input, so a stage fed
+    # by a long-running source does not hold items back indefinitely.
+    batch_wait_seconds: Optional[float] = None
+
+
+class StagedPipeline:
+    def __init__(self, stages: List[Stage], queue_size: int = 8) -> None:
+        if not stages:
+            raise ValueError("A pipeline needs at least one stage")
+        self._stages = stages
+        self._queue_size = max(1, queue_size)
+        self._failed = threading.Event()
+        self._error: Optional[BaseException] = None
+        self._error_lock = threading.Lock()
+
+    def run(self, items: Iterable[Any]) -> None:
+        queues: List[queue.Queue] = [
+            queue.Queue(maxsize=self._queue_size) for _ in self._stages
+        ]
+        threads: List[threading.Thread] = []
+        for index, stage in enumerate(self._stages):
+            inbox = queues[index]
+            outbox = queues[index + 1] if index + 1 < len(queues) else None
+            workers = max(1, stage.workers)
+            remaining = [workers]
+            remaining_lock = threading.Lock()
+            for worker in range(workers):
+                thread = threading.Thread(
+                    target=self._work,
+                    args=(stage, inbox, outbox, remaining, remaining_lock),
+                    name=f"pipeline-{stage.name}-{worker}",
+                    daemon=True,
+                )
+                thread.start()
+                threads.append(thread)
+
+        try:
+            for item in items:
+                if self._failed.is_set():
+                    break
+                queues[0].put(item)
+        except BaseException as exc:  # noqa: BLE001
+            self._record_error(exc)
+        finally:
+            queues[0].put(_DONE)
+            for thread in threads:
+                thread.join()
+
+        if self._error is not None:
+            raise self._error
+
+    def _work(
+        self,
+        stage: Stage,
+        inbox: queue.Queue,
+        outbox: Optional[queue.Queue],
+        remaining: List[int],
+        remaining_lock: threading.Lock,
+    ) -> None:
+        batch: List[Any] = []
+        while True:
+            try:
+                item = inbox.get(timeout=stage.batch_wait_seconds if batch else None)
+            except queue.Empty:
+                self._handle(stage, batch, outbox)
+                batch = []
+                continue
+            if item is _DONE:
+                inbox.put(_DONE)
+                if batch:
+                    self._handle(stage, batch, outbox)
+                with remaining_lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last and outbox is not None:
+                    outbox.put(_DONE)
+                return
+            if self._failed.is_set():
+                continue
+            if stage.batch_size <= 1:
+                self._handle(stage, item, outbox)
+                continue
+            batch.append(item)
+            if len(batch) >= stage.batch_size:
+                self._handle(stage, batch, outbox)
+                batch = []
+
+    def _handle(self, stage: Stage, item: Any, outbox: Optional[queue.Queue]) -> None:
+        if self._failed.is_set():
+            return
+        try:
+            result = stage.handler(item)
+        except BaseException as exc:  # noqa: BLE001
+            self._record_error(exc)
+            return
+        if result is None or outbox is None:
+            return
+        for output in result if stage.batch_size > 1 else (result,):
+            outbox.put(output)
+
+    def _record_error(self, exc: BaseException) -> None:
+        with self._error_lock:
+            if self._error is None:
+                self._error = exc
+        self._failed.set()
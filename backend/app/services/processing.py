@@ -1,167 +1,660 @@
 from __future__ import annotations
 
+import bisect
+import hashlib
 import json
+import logging
+import os
 import re
-from concurrent.futures import ThreadPoolExecutor
-from dataclasses import dataclass
-from threading import Lock
-from typing import Dict, List, Optional
+import shutil
+import socket
+import threading
+from dataclasses import dataclass, field
+from functools import cached_property
+from pathlib import Path
+from typing import (
+    TYPE_CHECKING,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Tuple,
+    TypeVar,
+)
 from uuid import UUID, uuid4
 
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-
+from app.core import metrics
 from app.core.config import get_settings
-from app.models.schemas import ProcessStatus, ProcessStep
+from app.core.metrics import timed
+from app.models.schemas import ProcessStatus
+from app.services.blob_catalog import PENDING as CATALOG_PENDING, PROCESSING, blob_catalog
+from app.services.index_manifest import ManifestEntry, index_manifest
+from app.services.job_store import (
+    DOWNLOADED,
+    EMBEDDED,
+    INDEXED,
+    PENDING,
+    evict_finished_jobs,
+    job_scratch_dir,
+    job_store,
+)
 from app.services.openai_client import openai_client
-from app.services.search import search_service
+from app.services.pipeline import Stage, StagedPipeline
+from app.services.search import IndexingError, search_fields, search_service
 from app.services.storage import storage_service
-from app.utils.document_loader import to_text
+from app.utils.chunking import Chunker, Span
+from app.utils.document_loader import default_extract_workers, iter_pages
+from app.utils.tokens import count_tokens
+
+if TYPE_CHECKING:
+    from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+logger = logging.getLogger(__name__)
 
 
 @dataclass
 class ChunkRecord:
     id: str
-    content: str
     metadata: dict
+    # The chunk is source[start:end]. Native chunks share the document text
+    # and are only copied out when they are embedded or uploaded.
+    source: str
+    start: int = 0
+    end: Optional[int] = None
+
+    @property
+    def content(self) -> str:
+        return self.source[self.start : self.end]
+
+
+@dataclass
+class BlobWork:
+    job_id: UUID
+    blob_name: str
+    file_path: Optional[Path] = None
+    pieces: List[Tuple[str, int]] = field(default_factory=list)
+    # (window, start, end, metadata) from the native chunker.
+    spans: List[Tuple[str, int, int, dict]] = field(default_factory=list)
+    chunks: List[ChunkRecord] = field(default_factory=list)
+    changed: List[ChunkRecord] = field(default_factory=list)
+    reordered: List[ChunkRecord] = field(default_factory=list)
+    orphan_ids: List[str] = field(default_factory=list)
+    embeddings: List[List[float]] = field(default_factory=list)
+    checkpoint: int = PENDING
+    content_hash: Optional[str] = None
+    # Set when these exact bytes are already indexed under this name: the
+    # source whose chunks the blob shares (possibly itself).
+    alias_of: Optional[str] = None
+
+    @property
+    def indexed(self) -> bool:
+        return self.checkpoint >= INDEXED or self.alias_of is not None
+
+
+def new_worker_id() -> str:
+    return f"{socket.gethostname()}-{os.getpid()}-{uuid4().hex[:8]}"
+
+
+def _heartbeat(worker_id: str, lease_seconds: float, stop: threading.Event) -> None:
+    while not stop.wait(lease_seconds / 3):
+        job_store.heartbeat(worker_id, lease_seconds)
 
 
 class ProcessingManager:
     def __init__(self) -> None:
-        self._jobs: Dict[UUID, ProcessStatus] = {}
-        self._lock = Lock()
-        self._executor = ThreadPoolExecutor(max_workers=2)
-        storage_service.ensure_containers()
-        search_service.ensure_index()
-        self._splitter = RecursiveCharacterTextSplitter(
-            chunk_size=get_settings().processing_chunk_size,
-            chunk_overlap=get_settings().processing_chunk_overlap,
-        )
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._workers: List[threading.Thread] = []
 
     def start_job(self, limit: Optional[int]) -> UUID:
         job_id = uuid4()
-        with self._lock:
-            self._jobs[job_id] = ProcessStatus(
-                job_id=job_id,
-                state="queued",
-                steps=[
-                    ProcessStep(step="filesDiscovered", current=0, total=0),
-                    ProcessStep(step="filesProcessed", current=0, total=0),
-                    ProcessStep(step="chunksIndexed", current=0, total=0),
-                    ProcessStep(step="embeddingsCreated", current=0, total=0),
-                ],
+        job_store.create(job_id, limit)
+        claimed: List[str] = []
+        try:
+            raw_files = storage_service.list_unprocessed_blob_names(
+                limit or get_settings().max_documents_per_run
             )
-        self._executor.submit(self._run_job, job_id, limit)
+            claimed = blob_catalog.claim(raw_files, storage_service.raw_container)
+            job_store.enqueue(job_id, claimed)
+        except Exception as exc:  # noqa: BLE001
+            # Claimed blobs that never reached the queue go back to pending,
+            # or no later job would pick them up.
+            blob_catalog.set_state(claimed, CATALOG_PENDING, only_from=PROCESSING)
+            job_store.set_state(job_id, "failed", error=str(exc))
+        self._wake.set()
         return job_id
 
     def get_status(self, job_id: UUID) -> Optional[ProcessStatus]:
-        with self._lock:
-            return self._jobs.get(job_id)
+        return job_store.get(job_id)
+
+    @cached_property
+    def _splitter(self) -> RecursiveCharacterTextSplitter:
+        from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+        return RecursiveCharacterTextSplitter(
+            chunk_size=get_settings().processing_chunk_size,
+            chunk_overlap=get_settings().processing_chunk_overlap,
+        )
+
+    @cached_property
+    def _chunker(self) -> Chunker:
+        settings = get_settings()
+        return Chunker(
+            settings.processing_chunk_tokens,
+            settings.processing_chunk_overlap_tokens,
+        )
+
+    def warm_up(self) -> None:
+        if get_settings().processing_chunker == "recursive":
+            self._splitter
+        else:
+            count_tokens("")
 
-    def _run_job(self, job_id: UUID, limit: Optional[int]) -> None:
-        status = self._jobs[job_id]
+    def start_workers(self, count: int) -> None:
+        for _ in range(count - len(self._workers)):
+            thread = threading.Thread(
+                target=self.run_worker,
+                args=(new_worker_id(), self._stop),
+                name=f"ingest-worker-{len(self._workers)}",
+                daemon=True,
+            )
+            thread.start()
+            self._workers.append(thread)
+
+    def stop_workers(self) -> None:
+        self._stop.set()
+        self._wake.set()
+        for thread in self._workers:
+            thread.join()
+        self._workers = []
+        self._stop = threading.Event()
+
+    def run_worker(self, worker_id: str, stop: threading.Event, *, drain: bool = False) -> None:
+        settings = get_settings()
+        lease = settings.processing_worker_lease_seconds
+        beating = threading.Event()
+        heartbeat = threading.Thread(
+            target=_heartbeat, args=(worker_id, lease, beating), daemon=True
+        )
+        heartbeat.start()
         try:
-            status.state = "running"
-            raw_files = storage_service.list_unprocessed_blob_names(limit or get_settings().max_documents_per_run)
-            self._update_step(job_id, "filesDiscovered", current=len(raw_files), total=len(raw_files))
-            self._update_step(job_id, "filesProcessed", current=0, total=len(raw_files))
-            total_chunks = 0
-            total_embeddings = 0
-            for blob_name in raw_files:
-                blob = storage_service.download_blob(storage_service.raw_container, blob_name)
-                file_bytes = blob.download_blob().readall()
-                text = to_text(file_bytes, blob_name)
-                chunks = self._splitter.split_text(text)
-                chunk_records = self._build_chunk_payloads(blob_name, chunks)
-                embeddings = openai_client.batch_embeddings([c.content for c in chunk_records])
-                documents = []
-                for record, vector in zip(chunk_records, embeddings):
-                    doc = {
-                        "id": record.id,
-                        "content": record.content,
-                        "chunk_id": record.metadata["chunk_id"],
-                        "source_path": record.metadata["source_path"],
-                        "chunk_order": record.metadata["chunk_order"],
-                        "metadata": json.dumps(record.metadata),
-                        "embedding": vector,
-                    }
-                    documents.append(doc)
-                search_service.upload_documents(documents)
-                storage_service.move_blob(
-                    storage_service.raw_container,
-                    storage_service.processed_container,
-                    blob_name,
+            while not stop.is_set():
+                try:
+                    self._build_pipeline().run(self._claimed(worker_id, stop, drain))
+                except Exception:  # noqa: BLE001
+                    logger.exception("Ingestion worker %s crashed; restarting", worker_id)
+                    job_store.release(worker_id)
+                    stop.wait(settings.processing_worker_poll_seconds)
+                    continue
+                if drain:
+                    break
+        finally:
+            beating.set()
+            heartbeat.join()
+            job_store.release(worker_id)
+
+    def _claimed(
+        self, worker_id: str, stop: threading.Event, drain: bool
+    ) -> Iterator[BlobWork]:
+        settings = get_settings()
+        while not stop.is_set():
+            self._wake.clear()
+            for job_id, blob_name, state in job_store.expire_exhausted():
+                blob_catalog.set_state([blob_name], CATALOG_PENDING, only_from=PROCESSING)
+                self._finish(job_id, state)
+            claimed = job_store.claim(
+                worker_id,
+                settings.processing_worker_claim_batch,
+                settings.processing_worker_lease_seconds,
+            )
+            if not claimed:
+                if drain:
+                    return
+                # Enqueues from this process wake the worker immediately;
+                # the poll interval only bounds how long work queued by
+                # another process waits.
+                self._wake.wait(settings.processing_worker_poll_seconds)
+                continue
+            for blob in claimed:
+                yield BlobWork(
+                    job_id=blob.job_id, blob_name=blob.blob_name, checkpoint=blob.checkpoint
                 )
-                total_chunks += len(chunk_records)
-                total_embeddings += len(embeddings)
-                processed = self._get_step(job_id, "filesProcessed")
-                if processed:
-                    self._update_step(
-                        job_id,
-                        "filesProcessed",
-                        current=processed.current + 1,
-                        total=processed.total,
+
+    def _finish(self, job_id: UUID, state: Optional[str]) -> None:
+        if state is None:
+            return
+        shutil.rmtree(job_scratch_dir(job_id), ignore_errors=True)
+        evict_finished_jobs()
+
+    def _fail(self, work: BlobWork, exc: Exception) -> None:
+        logger.warning("Ingesting %s failed: %s", work.blob_name, exc)
+        retrying, state = job_store.fail(
+            work.job_id,
+            work.blob_name,
+            str(exc),
+            get_settings().processing_worker_max_attempts,
+        )
+        if not retrying:
+            blob_catalog.set_state([work.blob_name], CATALOG_PENDING, only_from=PROCESSING)
+        self._finish(work.job_id, state)
+
+    def _build_pipeline(self) -> StagedPipeline:
+        settings = get_settings()
+        extract_workers = settings.pdf_extract_workers or default_extract_workers()
+
+        def download(work: BlobWork) -> BlobWork:
+            if work.checkpoint >= INDEXED:
+                return work
+            # Blobs uploaded through the API carry their hash, so a known
+            # duplicate is linked without being downloaded at all.
+            entry = blob_catalog.get(work.blob_name)
+            work.content_hash = entry.content_hash if entry is not None else None
+            if self._link_duplicate(work):
+                return work
+            digest = hashlib.sha256(work.blob_name.encode("utf-8")).hexdigest()[:32]
+            scratch = job_scratch_dir(work.job_id)
+            work.file_path = scratch / f"{digest}{Path(work.blob_name).suffix.lower()}"
+            if work.checkpoint < DOWNLOADED or not work.file_path.exists():
+                container = entry.container if entry is not None else storage_service.raw_container
+                blob = storage_service.download_blob(container, work.blob_name)
+                partial = work.file_path.with_suffix(work.file_path.suffix + ".part")
+                with open(partial, "wb") as handle:
+                    blob.download_blob().readinto(handle)
+                partial.replace(work.file_path)
+                job_store.checkpoint(work.job_id, work.blob_name, DOWNLOADED)
+            with open(work.file_path, "rb") as handle:
+                work.content_hash = hashlib.file_digest(handle, "sha256").hexdigest()
+            if self._link_duplicate(work):
+                work.file_path.unlink(missing_ok=True)
+                work.file_path = None
+            return work
+
+        def parse(work: BlobWork) -> BlobWork:
+            if work.indexed:
+                return work
+            pages = iter_pages(
+                work.file_path,
+                work.blob_name,
+                workers=extract_workers,
+                parallel_min_pages=settings.pdf_parallel_min_pages,
+                pages_per_task=settings.pdf_pages_per_task,
+            )
+            if settings.processing_chunker == "recursive":
+                work.pieces = list(self._split_pages(pages))
+            else:
+                work.spans = self._span_chunks(pages)
+            work.file_path.unlink(missing_ok=True)
+            work.file_path = None
+            return work
+
+        def split(work: BlobWork) -> BlobWork:
+            if work.indexed:
+                return work
+            if settings.processing_chunker == "recursive":
+                chunks = [(text, 0, len(text), {"page": page}) for text, page in work.pieces]
+            else:
+                chunks = work.spans
+            work.chunks = self._build_chunk_payloads(
+                work.blob_name, chunks, content_ids=settings.processing_incremental
+            )
+            work.pieces = []
+            work.spans = []
+            job_store.checkpoint(work.job_id, work.blob_name, chunks=len(work.chunks))
+            return work
+
+        def embed(work: BlobWork) -> BlobWork:
+            if work.indexed:
+                return work
+            if settings.processing_incremental:
+                self._diff_against_manifest(work)
+            else:
+                work.changed = work.chunks
+            job_store.checkpoint(work.job_id, work.blob_name, embeddings=len(work.changed))
+            work.embeddings = openai_client.batch_embeddings([c.content for c in work.changed])
+            job_store.checkpoint(work.job_id, work.blob_name, EMBEDDED)
+            return work
+
+        def index(batch: List[BlobWork]) -> List[BlobWork]:
+            indexed: List[BlobWork] = []
+            fresh: List[BlobWork] = []
+            for work in batch:
+                if work.checkpoint >= INDEXED:
+                    indexed.append(work)
+                elif work.alias_of is not None:
+                    try:
+                        self._index_alias(work)
+                    except Exception as exc:  # noqa: BLE001
+                        self._fail(work, exc)
+                        continue
+                    indexed.append(work)
+                else:
+                    fresh.append(work)
+            failed = self._index_chunks(fresh)
+            for work in fresh:
+                if work.blob_name in failed:
+                    self._fail(work, failed[work.blob_name])
+                    continue
+                if settings.processing_incremental:
+                    index_manifest.replace(
+                        work.blob_name,
+                        (
+                            ManifestEntry(
+                                chunk_id=record.id,
+                                content_hash=record.metadata["content_hash"],
+                                chunk_order=record.metadata["chunk_order"],
+                                fields=_layout(record.metadata),
+                            )
+                            for record in work.chunks
+                        ),
                     )
-                self._update_step(
-                    job_id,
-                    "chunksIndexed",
-                    current=total_chunks,
-                    total=total_chunks,
+                self._requeue(index_manifest.record_document(work.blob_name, work.content_hash))
+                job_store.checkpoint(work.job_id, work.blob_name, INDEXED)
+                work.chunks = []
+                work.changed = []
+                work.reordered = []
+                work.orphan_ids = []
+                work.embeddings = []
+                indexed.append(work)
+            return indexed
+
+        def mark_processed(batch: List[BlobWork]) -> None:
+            storage_service.mark_processed([work.blob_name for work in batch])
+            for work in batch:
+                self._finish(work.job_id, job_store.complete(work.job_id, work.blob_name))
+
+        return StagedPipeline(
+            [
+                Stage(
+                    name,
+                    self._guarded(_timed(f"ingest_{name}", handler), batch_size > 1),
+                    workers,
+                    batch_size=batch_size,
+                    batch_wait_seconds=batch_wait_ms / 1000,
                 )
-                self._update_step(
-                    job_id,
-                    "embeddingsCreated",
-                    current=total_embeddings,
-                    total=total_embeddings,
+                for name, handler, workers, batch_size, batch_wait_ms in (
+                    ("download", download, settings.processing_download_workers, 1, 0),
+                    ("parse", parse, settings.processing_parse_workers, 1, 0),
+                    ("split", split, settings.processing_split_workers, 1, 0),
+                    ("embed", embed, settings.processing_embed_workers, 1, 0),
+                    (
+                        "index",
+                        index,
+                        settings.processing_index_workers,
+                        settings.processing_index_batch_size,
+                        settings.processing_index_batch_wait_ms,
+                    ),
+                    (
+                        "move",
+                        mark_processed,
+                        settings.processing_move_workers,
+                        settings.processing_move_batch_size,
+                        settings.processing_move_batch_wait_ms,
+                    ),
                 )
-            status.state = "completed"
-        except Exception as exc:  # noqa: BLE001
-            status.state = "failed"
-            status.errors.append(str(exc))
+            ],
+            queue_size=settings.processing_queue_size,
+        )
 
-    def _build_chunk_payloads(self, blob_name: str, chunks: List[str]) -> List[ChunkRecord]:
+    def _guarded(self, handler: Callable[[T], R], batched: bool) -> Callable[[T], Optional[R]]:
+        # A failing blob is retried or marked failed on its own; it must not
+        # stop the pipeline that other jobs' blobs are flowing through.
+        def run(item: T) -> Optional[R]:
+            try:
+                return handler(item)
+            except Exception as exc:  # noqa: BLE001
+                for work in item if batched else (item,):
+                    self._fail(work, exc)
+                return None
+
+        return run
+
+    def _build_chunk_payloads(
+        self,
+        blob_name: str,
+        chunks: Sequence[Tuple[str, int, int, dict]],
+        *,
+        content_ids: bool = False,
+    ) -> List[ChunkRecord]:
         payloads: List[ChunkRecord] = []
         safe_blob_name = re.sub(r"[^0-9A-Za-z_\-=]", "-", blob_name)
-        for order, chunk in enumerate(chunks):
-            chunk_id = f"{safe_blob_name}-{order}"
+        seen: Dict[str, int] = {}
+        for order, (source, start, end, extra) in enumerate(chunks):
+            content_hash = hashlib.sha256(source[start:end].encode("utf-8")).hexdigest()
+            if content_ids:
+                occurrence = seen.get(content_hash, 0)
+                seen[content_hash] = occurrence + 1
+                chunk_id = f"{safe_blob_name}-{content_hash[:16]}"
+                if occurrence:
+                    chunk_id = f"{chunk_id}-{occurrence}"
+            else:
+                chunk_id = f"{safe_blob_name}-{order}"
+            metadata = {
+                "chunk_id": chunk_id,
+                "source_path": blob_name,
+                "chunk_order": order,
+                "content_hash": content_hash,
+                **extra,
+            }
             payloads.append(
-                ChunkRecord(
-                    id=chunk_id,
-                    content=chunk,
-                    metadata={
-                        "chunk_id": chunk_id,
-                        "source_path": blob_name,
-                        "chunk_order": order,
-                    },
-                )
+                ChunkRecord(id=chunk_id, metadata=metadata, source=source, start=start, end=end)
             )
         return payloads
 
-    def _update_step(
-        self,
-        job_id: UUID,
-        step: str,
-        *,
-        current: Optional[int] = None,
-        total: Optional[int] = None,
-    ) -> None:
-        with self._lock:
-            status = self._jobs[job_id]
-            for idx, s in enumerate(status.steps):
-                if s.step == step:
-                    new_step = ProcessStep(
-                        step=step,
-                        current=current if current is not None else s.current,
-                        total=total if total is not None else s.total,
-                    )
-                    status.steps[idx] = new_step
-                    break
+    def _split_pages(self, pages: Iterable[Tuple[int, str]]) -> Iterator[Tuple[str, int]]:
+        flush_at = get_settings().processing_chunk_size * 8
+        buffer = ""
+        page_starts: List[Tuple[int, int]] = []
+        for number, text in pages:
+            if buffer:
+                buffer += "\n"
+            page_starts.append((len(buffer), number))
+            buffer += text
+            if len(buffer) < flush_at:
+                continue
+            located = self._locate_chunks(buffer, self._splitter.split_text(buffer))
+            if len(located) < 2:
+                continue
+            carry_from = located[-1][0]
+            for offset, chunk in located[:-1]:
+                yield chunk, self._page_at(page_starts, offset)
+            buffer = buffer[carry_from:]
+            page_starts = [(max(0, start - carry_from), page) for start, page in page_starts]
+            page_starts = [
+                entry
+                for index, entry in enumerate(page_starts)
+                if index + 1 == len(page_starts) or page_starts[index + 1][0] > 0
+            ]
+        for offset, chunk in self._locate_chunks(buffer, self._splitter.split_text(buffer)):
+            yield chunk, self._page_at(page_starts, offset)
+
+    def _span_chunks(self, pages: Iterable[Tuple[int, str]]) -> List[Tuple[str, int, int, dict]]:
+        # Pages are chunked in windows of about eight chunks, so the document
+        # text is never joined; each chunk slices the window it came from.
+        window_chars = get_settings().processing_chunk_tokens * 8 * 4
+        return [
+            (window, span.start, span.end, _span_metadata(span, base))
+            for window, base, span in self._chunker.split_pages(pages, window_chars)
+        ]
+
+    @staticmethod
+    def _locate_chunks(text: str, chunks: List[str]) -> List[Tuple[int, str]]:
+        overlap = get_settings().processing_chunk_overlap
+        located: List[Tuple[int, str]] = []
+        cursor = 0
+        for chunk in chunks:
+            offset = text.find(chunk, cursor)
+            if offset < 0:
+                offset = cursor
+            located.append((offset, chunk))
+            cursor = max(offset + 1, offset + len(chunk) - overlap)
+        return located
+
+    @staticmethod
+    def _page_at(page_starts: List[Tuple[int, int]], offset: int) -> int:
+        index = bisect.bisect_right([start for start, _ in page_starts], offset) - 1
+        return page_starts[max(0, index)][1] if page_starts else 1
+
+    def _index_chunks(self, works: List[BlobWork]) -> Dict[str, Exception]:
+        # One bulk upload, merge and delete for the whole batch. Documents the
+        # index rejects fail only the blobs they belong to; returns those by
+        # blob name.
+        failed: Dict[str, Exception] = {}
+
+        def run(
+            send: Callable[[Iterable], None], items: Iterable[Tuple[BlobWork, Iterable]]
+        ) -> None:
+            owners: Dict[str, str] = {}
+
+            def stream() -> Iterator:
+                for work, entries in items:
+                    if work.blob_name in failed:
+                        continue
+                    for entry in entries:
+                        owners[entry if isinstance(entry, str) else entry["id"]] = work.blob_name
+                        yield entry
+
+            try:
+                send(stream())
+            except IndexingError as exc:
+                for key, message in exc.failed.items():
+                    failed.setdefault(owners[key], IndexingError({key: message}))
+
+        run(
+            search_service.upload_documents,
+            (
+                (
+                    work,
+                    (
+                        {
+                            "id": record.id,
+                            "content": record.content,
+                            **search_fields(record.metadata),
+                            "embedding": vector,
+                        }
+                        for record, vector in zip(work.changed, work.embeddings)
+                    ),
+                )
+                for work in works
+            ),
+        )
+        run(
+            search_service.merge_documents,
+            (
+                (
+                    work,
+                    (
+                        {"id": record.id, **search_fields(record.metadata)}
+                        for record in work.reordered
+                    ),
+                )
+                for work in works
+            ),
+        )
+        run(search_service.delete_documents, ((work, work.orphan_ids) for work in works))
+        job_store.record_index_changes(
+            (
+                work.blob_name
+                for work in works
+                if work.blob_name not in failed
+                and (work.changed or work.reordered or work.orphan_ids)
+            ),
+            get_settings().answer_cache_ttl_seconds,
+        )
+        return failed
+
+    def _link_duplicate(self, work: BlobWork) -> bool:
+        if work.content_hash is None:
+            return False
+        work.alias_of = index_manifest.canonical_source(work.content_hash)
+        return work.alias_of is not None
+
+    def _index_alias(self, work: BlobWork) -> None:
+        stale: List[str] = []
+        if work.alias_of != work.blob_name:
+            # Chunks this name owned for earlier bytes are superseded by the
+            # ones it now shares.
+            previous = index_manifest.get(work.blob_name)
+            chunk_ids = (
+                list(previous)
+                if previous is not None
+                else search_service.list_chunk_ids(work.blob_name)
+            )
+            if chunk_ids:
+                search_service.delete_documents(chunk_ids)
+                job_store.record_index_changes(
+                    [work.blob_name], get_settings().answer_cache_ttl_seconds
+                )
+            index_manifest.forget(work.blob_name)
+            stale = index_manifest.record_document(
+                work.blob_name, work.content_hash, alias_of=work.alias_of
+            )
+        self._requeue(stale)
+        job_store.checkpoint(work.job_id, work.blob_name, INDEXED)
+
+    def _requeue(self, aliases: List[str]) -> None:
+        # Aliases of a source whose bytes changed lost the chunks they shared;
+        # the next job indexes them in their own right.
+        if aliases:
+            logger.info("Re-queueing %d aliases of changed sources", len(aliases))
+            blob_catalog.set_state(aliases, CATALOG_PENDING)
+
+    def _diff_against_manifest(self, work: BlobWork) -> None:
+        previous = index_manifest.get(work.blob_name)
+        if previous is None:
+            indexed_ids = set(search_service.list_chunk_ids(work.blob_name))
+            previous = {
+                chunk_id: ManifestEntry(chunk_id=chunk_id, content_hash="", chunk_order=-1)
+                for chunk_id in indexed_ids
+            }
+        current_ids = {record.id for record in work.chunks}
+        work.changed = []
+        work.reordered = []
+        for record in work.chunks:
+            entry = previous.get(record.id)
+            if entry is None or entry.content_hash != record.metadata["content_hash"]:
+                work.changed.append(record)
+            elif (
+                entry.chunk_order != record.metadata["chunk_order"]
+                or entry.fields != _layout(record.metadata)
+            ):
+                # Same text, new position: only its metadata fields are merged.
+                work.reordered.append(record)
+        work.orphan_ids = [chunk_id for chunk_id in previous if chunk_id not in current_ids]
+
+
+def _layout(metadata: dict) -> str:
+    return json.dumps(search_fields(metadata), sort_keys=True)
+
+
+def _span_metadata(span: Span, base: int = 0) -> dict:
+    # base is the document offset of the text the span indexes.
+    metadata = {
+        "page": span.page,
+        "page_end": span.page_end,
+        "char_start": base + span.start,
+        "char_end": base + span.end,
+        "tokens": span.tokens,
+    }
+    if span.section:
+        metadata["section"] = span.section
+    return metadata
+
+
+def _timed(stage: str, handler: Callable[[T], R]) -> Callable[[T], R]:
+    if not metrics.ENABLED:
+        return handler
+
+    def run(item: T) -> R:
+        with timed(stage):
+            return handler(item)
 
-    def _get_step(self, job_id: UUID, step: str) -> Optional[ProcessStep]:
-        status = self._jobs[job_id]
-        for s in status.steps:
-            if s.step == step:
-                return s
-        return None
+    return run
 
 
 processing_manager = ProcessingManager()
@@ -0,0 +1,79 @@
+from __future__ import annotations
+
+import asyncio
+import time
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+from app.core.metrics import QUERY_BATCH_SIZE, QUERY_BATCH_WAIT_MS
+
+EmbedMany = Callable[[List[str]], Awaitable[List[List[float]]]]
+EmbedOne = Callable[[str], Awaitable[List[float]]]
+
+
+class QueryEmbeddingBatcher:
+    def __init__(
+        self,
+        embed_many: EmbedMany,
+        embed_one: EmbedOne,
+        *,
+        max_wait_ms: float,
+        max_batch: int,
+    ) -> None:
+        self._embed_many = embed_many
+        self._embed_one = embed_one
+        self._max_wait = max_wait_ms / 1000
+        self._max_batch = max(1, max_batch)
+        self._pending: List[Tuple[str, asyncio.Future, float]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+    async def embed(self, text: str) -> List[float]:
+        loop = asyncio.get_running_loop()
+        future: asyncio.Future = loop.create_future()
+        self._pending.append((text, future, time.perf_counter()))
+        if len(self._pending) >= self._max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self._max_wait, self._flush)
+        return await future
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "batch_size": QUERY_BATCH_SIZE.snapshot(),
+            "wait_ms": QUERY_BATCH_WAIT_MS.snapshot(),
+        }
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            asyncio.get_running_loop().create_task(self._run(batch))
+
+    async def _run(self, batch: List[Tuple[str, asyncio.Future, float]]) -> None:
+        flushed = time.perf_counter()
+        waiting = [(text, future) for text, future, _ in batch if not future.done()]
+        for _, _, enqueued in batch:
+            QUERY_BATCH_WAIT_MS.observe((flushed - enqueued) * 1000)
+        texts = list(dict.fromkeys(text for text, _ in waiting))
+        if not texts:
+            return
+        QUERY_BATCH_SIZE.observe(len(texts))
+        try:
+            vectors = dict(zip(texts, await self._embed_many(texts)))
+        except Exception:  # noqa: BLE001
+            await asyncio.gather(*(self._embed_alone(text, future) for text, future in waiting))
+            return
+        for text, future in waiting:
+            if not future.done():
+                future.set_result(vectors[text])
+
+    async def _embed_alone(self, text: str, future: asyncio.Future) -> None:
+        try:
+            vector = await self._embed_one(text)
+        except Exception as exc:  # noqa: BLE001
+            if not future.done():
+                future.set_exception(exc)
+            return
+        if not future.done():
+            future.set_result(vector)
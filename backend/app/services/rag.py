@@ -1,26 +1,38 @@
 from __future__ import annotations
 
-import json
-from typing import List
+import asyncio
+import time
+from typing import AsyncIterator, Dict, List, Optional, Sequence, Tuple, Union
 
-from app.models.schemas import ChatHistoryItem, ChatResponse, Citation
+from app.core.config import get_settings
+from app.core.metrics import CACHE_LOOKUPS, STAGE_SECONDS, TOKENS, timed
+from app.models.schemas import ChatHistoryItem, ChatRequest, ChatResponse, Citation
+from app.services.answer_cache import answer_cache
+from app.services.context_builder import Hit, PackedContext, pack_context
+from app.services.conversation import (
+    ChatTurn,
+    aprepare_turn,
+    aremember_turn,
+    prepare_turn,
+    remember_turn,
+)
 from app.services.openai_client import openai_client
-from app.services.search import search_service
+from app.services.fusion import reciprocal_rank_fusion
+from app.services.search import chunk_metadata, search_service
 
 
-def run_rag(question: str, history: List[ChatHistoryItem], top_k: int) -> ChatResponse:
-    embedding = openai_client.create_embedding(question)
-    search_results = search_service.semantic_hybrid_search(
-        query=question,
-        top_k=top_k,
-        embedding=embedding,
+def _from_cache(response: ChatResponse, start: float) -> ChatResponse:
+    return response.model_copy(
+        update={"cached": True, "latency_ms": (time.perf_counter() - start) * 1000}
     )
-    context_chunks = []
-    citations: List[Citation] = []
-    ranked_hits: List[tuple[float, dict, dict]] = []
+
+
+def _select_hits(search_results: List[dict]) -> List[Hit]:
+    selected: List[Hit] = []
+    ranked_hits: List[Hit] = []
     for result in search_results:
         score = float(result.get("@search.score", 0.0) or 0.0)
-        metadata = json.loads(result["metadata"])
+        metadata = chunk_metadata(result)
         ranked_hits.append((score, result, metadata))
 
     if ranked_hits:
@@ -29,44 +41,325 @@ def run_rag(question: str, history: List[ChatHistoryItem], top_k: int) -> ChatRe
         primary_doc = top_metadata.get("source_path", "unknown")
         dynamic_threshold = max(0.2, top_score * 0.6)
 
-        for score, result, metadata in ranked_hits:
-            same_doc = metadata.get("source_path") == primary_doc
-            if not same_doc and score < dynamic_threshold:
+        for hit in ranked_hits:
+            same_doc = hit[2].get("source_path") == primary_doc
+            if not same_doc and hit[0] < dynamic_threshold:
                 continue
-            context_chunks.append(result["content"])
-            citations.append(
-                Citation(
-                    chunk_id=metadata.get("chunk_id", "unknown"),
-                    source_document=metadata.get("source_path", "unknown"),
-                    score=score,
-                    snippet=result["content"][:400],
-                )
-            )
-            if same_doc and len(citations) >= 4:
+            selected.append(hit)
+            if same_doc and len(selected) >= 4:
                 break
 
-        if not citations:
-            score, result, metadata = ranked_hits[0]
-            context_chunks.append(result["content"])
-            citations.append(
-                Citation(
-                    chunk_id=metadata.get("chunk_id", "unknown"),
-                    source_document=metadata.get("source_path", "unknown"),
-                    score=score,
-                    snippet=result["content"][:400],
-                )
-            )
-    context = "\n---\n".join(context_chunks)
-    citation_str = "\n".join(
+        if not selected:
+            selected.append(ranked_hits[0])
+    return selected
+
+
+def _select_context(search_results: List[dict]) -> PackedContext:
+    settings = get_settings()
+    # PROCESSING_CHUNK_OVERLAP bounds the recursive splitter's overlap in
+    # characters. The native chunker's is counted in tokens, so it is only
+    # bounded by the length of the chunk it comes from.
+    max_overlap = (
+        settings.processing_chunk_overlap if settings.processing_chunker == "recursive" else None
+    )
+    with timed("chat_context"):
+        packed = pack_context(
+            _select_hits(search_results),
+            max_tokens=settings.chat_context_max_tokens,
+            max_overlap=max_overlap,
+        )
+    TOKENS.inc(packed.tokens_saved, kind="prompt_saved")
+    return packed
+
+
+def _cached_answer(question: str, top_k: int) -> Optional[ChatResponse]:
+    cached = answer_cache.get(question, top_k)
+    CACHE_LOOKUPS.inc(cache="answer", result="miss" if cached is None else "hit")
+    return cached
+
+
+def _similar_answer(embedding: List[float], top_k: int) -> Optional[ChatResponse]:
+    cached = answer_cache.find_similar(embedding, top_k)
+    CACHE_LOOKUPS.inc(cache="answer_similar", result="miss" if cached is None else "hit")
+    return cached
+
+
+def _citation_summary(citations: List[Citation]) -> str:
+    return "\n".join(
         f"chunk: {c.chunk_id} source: {c.source_document} score:{c.score:.3f}"
         for c in citations
     )
-    answer, latency = openai_client.chat_completion(question, context, citation_str)
+
+
+def _build_response(
+    question: str,
+    top_k: int,
+    embedding: List[float],
+    answer: str,
+    latency: float,
+    packed: PackedContext,
+) -> ChatResponse:
+    citations = packed.citations
     top_score = max((c.score for c in citations), default=0.0)
     confidence = min(1.0, top_score)
-    return ChatResponse(
+    response = ChatResponse(
         answer=answer,
         citations=citations,
         latency_ms=latency,
         confidence=confidence,
+        prompt_tokens_saved=packed.tokens_saved,
     )
+    if answer_cache is not None and citations:
+        answer_cache.put(question, top_k, embedding, response)
+    return response
+
+
+def run_rag(
+    question: str,
+    history: List[ChatHistoryItem],
+    top_k: int,
+    conversation_id: Optional[str] = None,
+) -> ChatResponse:
+    start = time.perf_counter()
+    turn = prepare_turn(question, history, conversation_id)
+    response = _answer(turn, top_k, start)
+    remember_turn(turn, response.answer)
+    return response.model_copy(update={"conversation_id": turn.conversation.id})
+
+
+def _answer(turn: ChatTurn, top_k: int, start: float) -> ChatResponse:
+    question = turn.query
+    if answer_cache is not None:
+        cached = _cached_answer(question, top_k)
+        if cached is not None:
+            return _from_cache(cached, start)
+    with timed("chat_embedding"):
+        embedding = openai_client.create_embedding(question)
+    if answer_cache is not None:
+        cached = _similar_answer(embedding, top_k)
+        if cached is not None:
+            return _from_cache(cached, start)
+    with timed("chat_search"):
+        search_results = search_service.semantic_hybrid_search(
+            query=question,
+            top_k=top_k,
+            embedding=embedding,
+        )
+    packed = _select_context(search_results)
+    with timed("chat_llm"):
+        answer, latency = openai_client.chat_completion(
+            question, packed.text, _citation_summary(packed.citations), turn.history
+        )
+    return _build_response(question, top_k, embedding, answer, latency, packed)
+
+
+async def _aretrieve(
+    question: str, top_k: int, start: float
+) -> tuple[Optional[ChatResponse], List[float], List[dict]]:
+    settings = get_settings()
+    if answer_cache is not None:
+        # Cache lookups poll the job store (SQLite) for index changes, so
+        # they run in a thread rather than on the loop.
+        cached = await asyncio.to_thread(_cached_answer, question, top_k)
+        if cached is not None:
+            return _from_cache(cached, start), [], []
+
+    keyword_task = asyncio.create_task(search_service.akeyword_search(question, top_k))
+    try:
+        async with asyncio.timeout(settings.chat_retrieval_timeout_seconds):
+            with timed("chat_embedding"):
+                embedding = await openai_client.acreate_embedding(question)
+            if answer_cache is not None:
+                cached = await asyncio.to_thread(_similar_answer, embedding, top_k)
+                if cached is not None:
+                    return _from_cache(cached, start), embedding, []
+            with timed("chat_search"):
+                vector_hits = await search_service.avector_search(embedding, top_k)
+                keyword_hits = await keyword_task
+    finally:
+        keyword_task.cancel()
+    return None, embedding, reciprocal_rank_fusion([keyword_hits, vector_hits], top_k)
+
+
+async def _asearch(question: str, embedding: List[float], top_k: int) -> List[dict]:
+    async with asyncio.timeout(get_settings().chat_retrieval_timeout_seconds):
+        with timed("chat_search"):
+            keyword_hits, vector_hits = await asyncio.gather(
+                search_service.akeyword_search(question, top_k),
+                search_service.avector_search(embedding, top_k),
+            )
+    return reciprocal_rank_fusion([keyword_hits, vector_hits], top_k)
+
+
+async def _acomplete(
+    turn: ChatTurn, top_k: int, embedding: List[float], search_results: List[dict]
+) -> ChatResponse:
+    question = turn.query
+    packed = _select_context(search_results)
+    with timed("chat_llm"):
+        async with asyncio.timeout(get_settings().chat_completion_timeout_seconds):
+            answer, latency = await openai_client.achat_completion(
+                question, packed.text, _citation_summary(packed.citations), turn.history
+            )
+    return _build_response(question, top_k, embedding, answer, latency, packed)
+
+
+async def arun_rag(
+    question: str,
+    history: List[ChatHistoryItem],
+    top_k: int,
+    conversation_id: Optional[str] = None,
+) -> ChatResponse:
+    start = time.perf_counter()
+    turn = await aprepare_turn(question, history, conversation_id)
+    response = await _aanswer(turn, top_k, start)
+    await aremember_turn(turn, response.answer)
+    return response.model_copy(update={"conversation_id": turn.conversation.id})
+
+
+async def _aanswer(turn: ChatTurn, top_k: int, start: float) -> ChatResponse:
+    cached, embedding, search_results = await _aretrieve(turn.query, top_k, start)
+    if cached is not None:
+        return cached
+    return await _acomplete(turn, top_k, embedding, search_results)
+
+
+async def arun_rag_batch(
+    requests: Sequence[ChatRequest], concurrency: int
+) -> AsyncIterator[Tuple[int, Union[ChatResponse, Exception]]]:
+    # Yields (index, response or error) as each request finishes. Questions are
+    # embedded together up front, identical retrievals run once, and at most
+    # `concurrency` requests search or generate at a time.
+    gate = asyncio.Semaphore(max(1, concurrency))
+
+    async def prepare(request: ChatRequest) -> ChatTurn:
+        async with gate:
+            return await aprepare_turn(
+                request.question, request.history, request.conversation_id
+            )
+
+    turns = await asyncio.gather(*(prepare(r) for r in requests), return_exceptions=True)
+    queries = list(dict.fromkeys(t.query for t in turns if isinstance(t, ChatTurn)))
+    embeddings: Dict[str, List[float]] = {}
+    if queries:
+        with timed("chat_embedding"):
+            vectors = await asyncio.to_thread(openai_client.batch_embeddings, queries)
+        embeddings = dict(zip(queries, vectors))
+
+    searches: Dict[Tuple[str, int], asyncio.Task] = {}
+    # Requests with no history and the same query share one answer as well.
+    answers: Dict[Tuple[str, int], asyncio.Task] = {}
+
+    def search(query: str, top_k: int) -> asyncio.Task:
+        key = (query, top_k)
+        if key not in searches:
+            searches[key] = asyncio.ensure_future(_asearch(query, embeddings[query], top_k))
+        return searches[key]
+
+    async def answer(turn: ChatTurn, top_k: int) -> ChatResponse:
+        start = time.perf_counter()
+        embedding = embeddings[turn.query]
+        if answer_cache is not None:
+            cached = await asyncio.to_thread(
+                lambda: _cached_answer(turn.query, top_k) or _similar_answer(embedding, top_k)
+            )
+            if cached is not None:
+                return _from_cache(cached, start)
+        async with gate:
+            search_results = await search(turn.query, top_k)
+            return await _acomplete(turn, top_k, embedding, search_results)
+
+    async def run(index: int, request: ChatRequest) -> Tuple[int, Union[ChatResponse, Exception]]:
+        turn = turns[index]
+        if not isinstance(turn, ChatTurn):
+            return index, turn
+        try:
+            if turn.history:
+                response = await answer(turn, request.top_k)
+            else:
+                key = (turn.query, request.top_k)
+                if key not in answers:
+                    answers[key] = asyncio.ensure_future(answer(turn, request.top_k))
+                response = await asyncio.shield(answers[key])
+        except Exception as exc:  # noqa: BLE001
+            return index, exc
+        # Stateless questions (the usual evaluation set) are not stored as
+        # conversations.
+        if not (request.conversation_id or request.history):
+            return index, response
+        await aremember_turn(turn, response.answer)
+        return index, response.model_copy(update={"conversation_id": turn.conversation.id})
+
+    pending = [asyncio.ensure_future(run(i, r)) for i, r in enumerate(requests)]
+    try:
+        for finished in asyncio.as_completed(pending):
+            yield await finished
+    finally:
+        for task in [*pending, *searches.values(), *answers.values()]:
+            task.cancel()
+
+
+def batch_result(index: int, result: Union[ChatResponse, Exception]) -> dict:
+    if isinstance(result, Exception):
+        return {"index": index, "error": str(result) or type(result).__name__}
+    return {"index": index, "response": result.model_dump(mode="json")}
+
+
+async def astream_rag(
+    question: str,
+    history: List[ChatHistoryItem],
+    top_k: int,
+    conversation_id: Optional[str] = None,
+) -> AsyncIterator[tuple[str, dict]]:
+    start = time.perf_counter()
+    turn = await aprepare_turn(question, history, conversation_id)
+    question = turn.query
+    cached, embedding, search_results = await _aretrieve(question, top_k, start)
+    if cached is not None:
+        yield "citations", {
+            "citations": [c.model_dump() for c in cached.citations],
+            "confidence": cached.confidence,
+        }
+        yield "token", {"content": cached.answer}
+        elapsed = (time.perf_counter() - start) * 1000
+        yield "done", {
+            "ttft_ms": elapsed,
+            "latency_ms": elapsed,
+            "cached": True,
+            "prompt_tokens_saved": cached.prompt_tokens_saved,
+            "conversation_id": turn.conversation.id,
+        }
+        await aremember_turn(turn, cached.answer)
+        return
+
+    packed = _select_context(search_results)
+    citations = packed.citations
+    confidence = min(1.0, max((c.score for c in citations), default=0.0))
+    yield "citations", {
+        "citations": [c.model_dump() for c in citations],
+        "confidence": confidence,
+    }
+
+    llm_start = time.perf_counter()
+    ttft: Optional[float] = None
+    parts: List[str] = []
+    async with asyncio.timeout(get_settings().chat_completion_timeout_seconds):
+        async for token in openai_client.astream_chat(
+            question, packed.text, _citation_summary(citations), turn.history
+        ):
+            if ttft is None:
+                ttft = (time.perf_counter() - start) * 1000
+            parts.append(token)
+            yield "token", {"content": token}
+    llm_latency = (time.perf_counter() - llm_start) * 1000
+    STAGE_SECONDS.observe(llm_latency / 1000, stage="chat_llm")
+    answer = "".join(parts)
+    _build_response(question, top_k, embedding, answer, llm_latency, packed)
+    await aremember_turn(turn, answer)
+    yield "done", {
+        "ttft_ms": ttft if ttft is not None else (time.perf_counter() - start) * 1000,
+        "latency_ms": (time.perf_counter() - start) * 1000,
+        "cached": False,
+        "prompt_tokens_saved": packed.tokens_saved,
+        "conversation_id": turn.conversation.id,
+    }
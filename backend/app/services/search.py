@@ -1,15 +1,26 @@
 from __future__ import annotations
 
-from typing import Iterable, List
+import json
+import logging
+import random
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Protocol, Sequence, Set
 
 from azure.core.credentials import AzureKeyCredential
+from azure.core.exceptions import HttpResponseError, ResourceNotFoundError
 from azure.identity import DefaultAzureCredential
+from azure.identity.aio import DefaultAzureCredential as AsyncDefaultAzureCredential
 from azure.search.documents import SearchClient
+from azure.search.documents.aio import SearchClient as AsyncSearchClient
 from azure.search.documents.indexes import SearchIndexClient
 from azure.search.documents.indexes.models import (
+    BinaryQuantizationCompression,
     ExhaustiveKnnAlgorithmConfiguration,
     SearchField,
     SearchFieldDataType,
+    ScalarQuantizationCompression,
     SearchIndex,
     SearchSuggester,
     SimpleField,
@@ -17,9 +28,179 @@ from azure.search.documents.indexes.models import (
     VectorSearchAlgorithmConfiguration,
     VectorSearchProfile,
 )
-from azure.search.documents.models import VectorizedQuery
+from azure.search.documents.models import IndexingResult, VectorizedQuery
 
 from app.core.config import get_settings
+from app.services.fusion import reciprocal_rank_fusion
+
+logger = logging.getLogger(__name__)
+
+# Chunk metadata is indexed as typed fields of its own rather than a JSON
+# string. Queries select only these, never the embedding.
+METADATA_FIELDS = (
+    "chunk_id",
+    "source_path",
+    "chunk_order",
+    "page",
+    "page_end",
+    "char_start",
+    "char_end",
+    "section",
+)
+SELECT_FIELDS = ["id", "content", *METADATA_FIELDS]
+# Per-document statuses worth sending again: version conflicts, index
+# unavailable, throttling and transient server errors.
+RETRYABLE_STATUS = {409, 422, 429, 500, 502, 503, 504}
+# A float serialised in a request body, with its separator.
+_FLOAT_BYTES = 20
+
+
+def search_fields(metadata: dict) -> dict:
+    return {name: metadata[name] for name in METADATA_FIELDS if name in metadata}
+
+
+def chunk_metadata(result: dict) -> dict:
+    return {name: result[name] for name in METADATA_FIELDS if result.get(name) is not None}
+
+
+class IndexingError(RuntimeError):
+    def __init__(self, failed: Dict[str, str]) -> None:
+        key, message = next(iter(failed.items()))
+        super().__init__(f"{len(failed)} documents failed to index, e.g. {key}: {message}")
+        # document key -> error message
+        self.failed = failed
+
+
+# Packs documents into requests of at most max_documents and about max_bytes,
+# across however many source documents they come from, and keeps up to
+# concurrency requests in flight. Documents that fail with a retryable status
+# are sent again on their own; the rest of their batch is not.
+class BulkIndexer:
+    def __init__(
+        self,
+        send: Callable[[List[dict]], List[IndexingResult]],
+        executor: ThreadPoolExecutor,
+        *,
+        max_documents: int,
+        max_bytes: int,
+        concurrency: int,
+        max_attempts: int,
+    ) -> None:
+        self._send = send
+        self._executor = executor
+        self._max_documents = max(1, max_documents)
+        self._max_bytes = max_bytes
+        self._concurrency = max(1, concurrency)
+        self._max_attempts = max(1, max_attempts)
+        self._batch: List[dict] = []
+        self._batch_bytes = 0
+        self._in_flight: Set[Future] = set()
+        self._failed: Dict[str, str] = {}
+
+    def add(self, document: dict) -> None:
+        size = _estimate_bytes(document)
+        if self._batch and (
+            len(self._batch) >= self._max_documents or self._batch_bytes + size > self._max_bytes
+        ):
+            self._submit()
+        self._batch.append(document)
+        self._batch_bytes += size
+
+    def flush(self) -> None:
+        if self._batch:
+            self._submit()
+        self._collect(wait(self._in_flight).done)
+        if self._failed:
+            failed, self._failed = self._failed, {}
+            raise IndexingError(failed)
+
+    def __enter__(self) -> BulkIndexer:
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> None:
+        if exc_type is None:
+            self.flush()
+        else:
+            wait(self._in_flight)
+
+    def _submit(self) -> None:
+        if len(self._in_flight) >= self._concurrency:
+            self._collect(wait(self._in_flight, return_when=FIRST_COMPLETED).done)
+        self._in_flight.add(self._executor.submit(self._index, self._batch))
+        self._batch, self._batch_bytes = [], 0
+
+    def _collect(self, done: Iterable[Future]) -> None:
+        for future in list(done):
+            self._in_flight.discard(future)
+            self._failed.update(future.result())
+
+    def _index(self, documents: List[dict]) -> Dict[str, str]:
+        failed: Dict[str, str] = {}
+        attempt = 0
+        while documents:
+            attempt += 1
+            try:
+                results = self._send(documents)
+            except HttpResponseError as exc:
+                if exc.status_code == 413 and len(documents) > 1:
+                    # The byte estimate was short: halve the request.
+                    half = len(documents) // 2
+                    failed.update(self._index(documents[:half]))
+                    failed.update(self._index(documents[half:]))
+                    return failed
+                if exc.status_code not in RETRYABLE_STATUS or attempt >= self._max_attempts:
+                    raise
+                _backoff(attempt)
+                continue
+            by_key = {document["id"]: document for document in documents}
+            documents = []
+            for result in results:
+                if result.succeeded:
+                    continue
+                if result.status_code in RETRYABLE_STATUS and attempt < self._max_attempts:
+                    documents.append(by_key[result.key])
+                else:
+                    failed[result.key] = result.error_message or f"status {result.status_code}"
+            if documents:
+                logger.info("Retrying %d documents the index rejected", len(documents))
+                _backoff(attempt)
+        return failed
+
+
+def _estimate_bytes(document: dict) -> int:
+    size = 2
+    for name, value in document.items():
+        size += len(name) + 4
+        if isinstance(value, list):
+            size += len(value) * _FLOAT_BYTES
+        elif isinstance(value, str):
+            size += len(value.encode("utf-8")) + 2
+        else:
+            size += len(json.dumps(value))
+    return size
+
+
+def _backoff(attempt: int) -> None:
+    delay = min(30.0, 0.5 * 2 ** attempt)
+    time.sleep(delay + random.uniform(0, delay * 0.25))
+
+
+class SearchBackend(Protocol):
+    def ensure_index(self, vector_dimensions: int | None = None) -> None: ...
+
+    def upload_documents(self, documents: Iterable[dict]) -> None: ...
+
+    def merge_documents(self, documents: Iterable[dict]) -> None: ...
+
+    def delete_documents(self, ids: Iterable[str]) -> None: ...
+
+    def list_chunk_ids(self, source_path: str) -> List[str]: ...
+
+    def semantic_hybrid_search(self, query: str, top_k: int, embedding: List[float]) -> List[dict]: ...
+
+    async def akeyword_search(self, query: str, top_k: int) -> List[dict]: ...
+
+    async def avector_search(self, embedding: List[float], top_k: int) -> List[dict]: ...
 
 
 class AzureAISearchService:
@@ -35,34 +216,81 @@ class AzureAISearchService:
         self._index_credential = credential
         self.endpoint = settings.azure_search_endpoint
         self.index_name = settings.azure_search_index
-        self._search_client = SearchClient(
-            endpoint=self.endpoint,
-            index_name=self.index_name,
-            credential=self._data_credential,
-        )
-        self._index_client = SearchIndexClient(
-            endpoint=self.endpoint,
-            credential=self._index_credential,
+        self._api_key = settings.azure_search_api_key
+        self._sync_search_client: SearchClient | None = None
+        self._sync_index_client: SearchIndexClient | None = None
+        self._async_search_client: AsyncSearchClient | None = None
+        self._index_executor = ThreadPoolExecutor(
+            max_workers=max(1, settings.search_index_concurrency),
+            thread_name_prefix="search-index",
         )
 
-    def ensure_index(self, vector_dimensions: int = 3072) -> None:
-        if self._index_exists():
-            return
+    @property
+    def _search_client(self) -> SearchClient:
+        if self._sync_search_client is None:
+            self._sync_search_client = SearchClient(
+                endpoint=self.endpoint,
+                index_name=self.index_name,
+                credential=self._data_credential,
+            )
+        return self._sync_search_client
+
+    @property
+    def _index_client(self) -> SearchIndexClient:
+        if self._sync_index_client is None:
+            self._sync_index_client = SearchIndexClient(
+                endpoint=self.endpoint,
+                credential=self._index_credential,
+            )
+        return self._sync_index_client
+
+    def ensure_index(self, vector_dimensions: int | None = None) -> None:
+        settings = get_settings()
+        vector_dimensions = vector_dimensions or settings.vector_dimensions
         fields = [
             SimpleField(name="id", type="Edm.String", key=True),
             SimpleField(name="content", type="Edm.String", searchable=True),
             SimpleField(name="chunk_id", type="Edm.String", filterable=True),
             SimpleField(name="source_path", type="Edm.String", filterable=True),
             SimpleField(name="chunk_order", type="Edm.Int32", filterable=True),
-            SimpleField(name="metadata", type="Edm.String", searchable=True),
+            SimpleField(name="page", type="Edm.Int32", filterable=True),
+            SimpleField(name="page_end", type="Edm.Int32"),
+            SimpleField(name="char_start", type="Edm.Int32"),
+            SimpleField(name="char_end", type="Edm.Int32"),
+            SimpleField(name="section", type="Edm.String"),
+            # Searchable for vector queries but never returned: at 3072
+            # dimensions it would dwarf everything else in a response.
             SearchField(
                 name="embedding",
                 type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
                 searchable=True,
+                hidden=True,
                 vector_search_dimensions=vector_dimensions,
-                vector_search_configuration="defaultProfile",
+                vector_search_profile_name="defaultProfile",
             ),
         ]
+        existing = self._existing_index()
+        if existing is not None:
+            self._check_vector_config(existing, vector_dimensions, settings.vector_quantization)
+            self._upgrade_index(existing, fields)
+            return
+        compressions = []
+        if settings.vector_quantization == "int8":
+            compressions.append(
+                ScalarQuantizationCompression(
+                    compression_name="quantized",
+                    rerank_with_original_vectors=True,
+                    default_oversampling=settings.vector_oversampling,
+                )
+            )
+        elif settings.vector_quantization == "binary":
+            compressions.append(
+                BinaryQuantizationCompression(
+                    compression_name="quantized",
+                    rerank_with_original_vectors=True,
+                    default_oversampling=settings.vector_oversampling,
+                )
+            )
         vector_search = VectorSearch(
             algorithms=[
                 VectorSearchAlgorithmConfiguration(
@@ -75,8 +303,10 @@ class AzureAISearchService:
                 VectorSearchProfile(
                     name="defaultProfile",
                     algorithm_configuration_name="default",
+                    compression_name="quantized" if compressions else None,
                 )
             ],
+            compressions=compressions or None,
         )
         suggester = SearchSuggester(name="sg", source_fields=["content"])
         index = SearchIndex(
@@ -87,31 +317,177 @@ class AzureAISearchService:
         )
         self._index_client.create_index(index)
 
-    def _index_exists(self) -> bool:
-        for index in self._index_client.list_indexes():
-            if index.name == self.index_name:
-                return True
-        return False
+    def _existing_index(self) -> SearchIndex | None:
+        try:
+            return self._index_client.get_index(self.index_name)
+        except ResourceNotFoundError:
+            return None
 
-    def upload_documents(self, documents: Iterable[dict]) -> None:
-        batch = list(documents)
-        if not batch:
+    def _check_vector_config(
+        self, index: SearchIndex, vector_dimensions: int, quantization: str
+    ) -> None:
+        # Neither can change on an existing index; failing here beats every
+        # upload or vector query being rejected later.
+        embedding = next((f for f in index.fields if f.name == "embedding"), None)
+        if embedding is None:
             return
-        self._search_client.upload_documents(documents=batch)
+        existing_dimensions = embedding.vector_search_dimensions
+        existing_quantization = "none"
+        vector_search = index.vector_search or VectorSearch()
+        profile = next(
+            (
+                p
+                for p in vector_search.profiles or []
+                if p.name == embedding.vector_search_profile_name
+            ),
+            None,
+        )
+        if profile is not None and profile.compression_name:
+            compression = next(
+                (
+                    c
+                    for c in vector_search.compressions or []
+                    if c.compression_name == profile.compression_name
+                ),
+                None,
+            )
+            if isinstance(compression, ScalarQuantizationCompression):
+                existing_quantization = "int8"
+            elif isinstance(compression, BinaryQuantizationCompression):
+                existing_quantization = "binary"
+        if (existing_dimensions, existing_quantization) != (vector_dimensions, quantization):
+            raise ValueError(
+                f"Search index {self.index_name} stores {existing_dimensions}-dim vectors "
+                f"with {existing_quantization!r} quantization, but EMBEDDING_DIMENSIONS/"
+                f"EMBEDDING_MODEL and VECTOR_QUANTIZATION ask for {vector_dimensions} "
+                f"with {quantization!r}. Point AZURE_SEARCH_INDEX at a new index to change them."
+            )
 
-    def semantic_hybrid_search(self, query: str, top_k: int, embedding: List[float]):
-        vector_query = VectorizedQuery(
-            vector=embedding,
-            k_nearest_neighbors=top_k,
-            fields="embedding",
+    def _upgrade_index(self, index: SearchIndex, fields: List[SearchField]) -> None:
+        # Fields can be added and made non-retrievable in place. An index from
+        # before the lean schema keeps its unused metadata field; documents
+        # indexed since fill the new ones.
+        changed = False
+        present = {field.name: field for field in index.fields}
+        for field in fields:
+            if field.name not in present:
+                index.fields.append(field)
+                changed = True
+        embedding = present.get("embedding")
+        if embedding is not None and not embedding.hidden:
+            embedding.hidden = True
+            changed = True
+        if changed:
+            logger.info("Updating search index %s to the current schema", self.index_name)
+            self._index_client.create_or_update_index(index)
+
+    def upload_documents(self, documents: Iterable[dict]) -> None:
+        with self._bulk(self._search_client.upload_documents) as bulk:
+            for document in documents:
+                bulk.add(document)
+
+    def merge_documents(self, documents: Iterable[dict]) -> None:
+        with self._bulk(self._search_client.merge_documents) as bulk:
+            for document in documents:
+                bulk.add(document)
+
+    def delete_documents(self, ids: Iterable[str]) -> None:
+        with self._bulk(self._search_client.delete_documents) as bulk:
+            for key in ids:
+                bulk.add({"id": key})
+
+    def _bulk(self, send: Callable[[List[dict]], List[IndexingResult]]) -> BulkIndexer:
+        settings = get_settings()
+        return BulkIndexer(
+            send,
+            self._index_executor,
+            max_documents=settings.search_batch_max_documents,
+            max_bytes=settings.search_batch_max_bytes,
+            concurrency=settings.search_index_concurrency,
+            max_attempts=settings.search_index_max_attempts,
         )
+
+    def list_chunk_ids(self, source_path: str) -> List[str]:
+        escaped = source_path.replace("'", "''")
+        results = self._search_client.search(
+            search_text="*",
+            filter=f"source_path eq '{escaped}'",
+            select=["id"],
+        )
+        return [r["id"] for r in results]
+
+    def semantic_hybrid_search(self, query: str, top_k: int, embedding: List[float]):
+        vector_query = self._vector_query(embedding, top_k)
         results = self._search_client.search(
             search_text=query,
             semantic_configuration_name="semanticConfig",
             vector_queries=[vector_query],
             top=top_k,
+            select=SELECT_FIELDS,
         )
         return [r for r in results]
 
+    async def akeyword_search(self, query: str, top_k: int) -> List[dict]:
+        results = await self._async_client().search(
+            search_text=query,
+            semantic_configuration_name="semanticConfig",
+            top=top_k,
+            select=SELECT_FIELDS,
+        )
+        return [r async for r in results]
+
+    async def avector_search(self, embedding: List[float], top_k: int) -> List[dict]:
+        vector_query = self._vector_query(embedding, top_k)
+        results = await self._async_client().search(
+            search_text=None,
+            vector_queries=[vector_query],
+            top=top_k,
+            select=SELECT_FIELDS,
+        )
+        return [r async for r in results]
+
+    def _vector_query(self, embedding: List[float], top_k: int) -> VectorizedQuery:
+        settings = get_settings()
+        return VectorizedQuery(
+            vector=embedding,
+            k_nearest_neighbors=top_k,
+            fields="embedding",
+            oversampling=(
+                settings.vector_oversampling if settings.vector_quantization != "none" else None
+            ),
+        )
+
+    def _async_client(self) -> AsyncSearchClient:
+        if self._async_search_client is None:
+            if self._api_key:
+                credential = AzureKeyCredential(self._api_key)
+            else:
+                credential = AsyncDefaultAzureCredential(
+                    exclude_interactive_browser_credential=False
+                )
+            self._async_search_client = AsyncSearchClient(
+                endpoint=self.endpoint,
+                index_name=self.index_name,
+                credential=credential,
+            )
+        return self._async_search_client
+
+
+def create_search_service() -> SearchBackend:
+    settings = get_settings()
+    if settings.search_backend == "local":
+        from app.services.local_index import LocalSearchService
+
+        return LocalSearchService(
+            settings.local_index_path or str(Path(settings.local_state_dir) / "local-index"),
+            nprobe=settings.local_index_nprobe,
+            compact_threshold=settings.local_index_compact_threshold,
+            quantization=settings.vector_quantization,
+            oversampling=settings.vector_oversampling,
+        )
+    if settings.search_backend != "azure":
+        raise ValueError(f"Unknown search backend: {settings.search_backend}")
+    return AzureAISearchService()
+
 
-search_service = AzureAISearchService()
+search_service: SearchBackend = create_search_service()
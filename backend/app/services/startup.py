@@ -0,0 +1,107 @@
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+
+from app.core.config import get_settings
+from app.services.blob_catalog import blob_catalog
+from app.services.conversation import conversation_store
+from app.services.index_manifest import index_manifest
+from app.services.job_store import evict_finished_jobs, job_store
+from app.services.openai_client import openai_client
+from app.services.processing import processing_manager
+from app.services.search import search_service
+from app.services.storage import storage_service
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class CheckResult:
+    ok: bool
+    seconds: float
+    error: Optional[str] = None
+
+
+class StartupChecks:
+    def __init__(self, checks: Dict[str, Callable[[], None]]) -> None:
+        self._checks = checks
+        self._results: Dict[str, CheckResult] = {}
+        self.started_at = time.monotonic()
+        self.ready_at: Optional[float] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.ready_at is not None
+
+    async def run(self) -> bool:
+        # Each check blocks on network or imports, so they run side by side in
+        # threads; ones that already passed are not repeated on a retry.
+        pending = [name for name in self._checks if not self._passed(name)]
+        await asyncio.gather(*(self._run_one(name) for name in pending))
+        if self.ready_at is None and all(self._passed(name) for name in self._checks):
+            self.ready_at = time.monotonic()
+        return self.ready
+
+    async def run_until_ready(self, retry_seconds: float) -> None:
+        while not await self.run():
+            await asyncio.sleep(retry_seconds)
+
+    def report(self) -> dict:
+        return {
+            "ready": self.ready,
+            "seconds_to_ready": (
+                round(self.ready_at - self.started_at, 3) if self.ready_at is not None else None
+            ),
+            "checks": {
+                name: {
+                    "ok": result.ok,
+                    "seconds": round(result.seconds, 3),
+                    "error": result.error,
+                }
+                for name, result in self._results.items()
+            },
+        }
+
+    async def _run_one(self, name: str) -> None:
+        start = time.perf_counter()
+        try:
+            await asyncio.to_thread(self._checks[name])
+        except Exception as exc:  # noqa: BLE001
+            logger.warning("Startup check %s failed: %s", name, exc)
+            self._results[name] = CheckResult(False, time.perf_counter() - start, str(exc))
+            return
+        self._results[name] = CheckResult(True, time.perf_counter() - start)
+
+    def _passed(self, name: str) -> bool:
+        result = self._results.get(name)
+        return result is not None and result.ok
+
+
+def open_local_state() -> None:
+    # The SQLite stores create their schema when first opened; doing that
+    # here keeps it off both the import and the first request.
+    stores = [blob_catalog, conversation_store, index_manifest, job_store]
+    if openai_client.embedding_cache is not None:
+        stores.append(openai_client.embedding_cache)
+    for store in stores:
+        store.open()
+    evict_finished_jobs()
+
+
+startup_checks = StartupChecks(
+    {
+        "local_state": open_local_state,
+        "storage_containers": storage_service.ensure_containers,
+        "search_index": search_service.ensure_index,
+        "openai_clients": openai_client.warm_up,
+        "text_splitter": processing_manager.warm_up,
+    }
+)
+
+
+async def run_startup_checks() -> None:
+    await startup_checks.run_until_ready(get_settings().startup_check_retry_seconds)
@@ -1,14 +1,38 @@
 from __future__ import annotations
 
+import asyncio
+import base64
+import hashlib
+import itertools
+import logging
+import threading
 from dataclasses import dataclass
+from datetime import datetime, timezone
 import time
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import AsyncIterator, Iterator, List, Optional, Set, Tuple
 
-from azure.core.exceptions import ResourceExistsError
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
 from azure.identity import DefaultAzureCredential
-from azure.storage.blob import BlobClient, BlobServiceClient, ContentSettings
+from azure.identity.aio import DefaultAzureCredential as AsyncDefaultAzureCredential
+from azure.storage.blob import BlobBlock, BlobClient, BlobServiceClient, ContentSettings
+from azure.storage.blob.aio import BlobServiceClient as AsyncBlobServiceClient
 
 from app.core.config import get_settings
+from app.services.blob_catalog import (
+    PENDING,
+    PROCESSED,
+    CatalogEntry,
+    ListedBlob,
+    blob_catalog,
+)
+
+CONTENT_HASH_METADATA = "content_sha256"
+PROCESSED_MARKER = "docupilot_processed"
+DELETE_BATCH_SIZE = 256
+
+logger = logging.getLogger(__name__)
 
 
 @dataclass
@@ -17,83 +41,331 @@ class StoredFile:
     size_bytes: int
     uploaded_at: str
     container: str
+    content_hash: str | None = None
+    state: str = PENDING
+    # Set when the same bytes are already stored: to this blob's own name when
+    # the upload was skipped, otherwise to the blob it duplicates.
+    duplicate_of: str | None = None
 
 
 class StorageService:
     def __init__(self) -> None:
         settings = get_settings()
-        if settings.azure_storage_connection_string:
-            self._client = BlobServiceClient.from_connection_string(
-                settings.azure_storage_connection_string
-            )
-        else:
-            credential = DefaultAzureCredential(exclude_interactive_browser_credential=False)
-            self._client = BlobServiceClient(
-                account_url=settings.azure_storage_account_url,
-                credential=credential,
-            )
         self.raw_container = settings.azure_storage_raw_container
         self.processed_container = settings.azure_storage_processed_container
-        self.ensure_containers()
+        self._blob_client: BlobServiceClient | None = None
+        self._async_blob_client: AsyncBlobServiceClient | None = None
+        self._reconcile_lock = threading.Lock()
+
+    @property
+    def _client(self) -> BlobServiceClient:
+        if self._blob_client is None:
+            settings = get_settings()
+            if settings.azure_storage_connection_string:
+                self._blob_client = BlobServiceClient.from_connection_string(
+                    settings.azure_storage_connection_string
+                )
+            else:
+                credential = DefaultAzureCredential(exclude_interactive_browser_credential=False)
+                self._blob_client = BlobServiceClient(
+                    account_url=settings.azure_storage_account_url,
+                    credential=credential,
+                )
+        return self._blob_client
 
     def upload_file(self, file_bytes: bytes, blob_name: str, content_type: str) -> StoredFile:
+        content_hash = hashlib.sha256(file_bytes).hexdigest()
+        duplicate = blob_catalog.find_content(content_hash, prefer=blob_name)
+        if duplicate is not None and duplicate.name == blob_name:
+            try:
+                props = self._client.get_blob_client(
+                    duplicate.container, blob_name
+                ).get_blob_properties()
+            except ResourceNotFoundError:
+                props = None
+            if _holds(props, content_hash):
+                return _unchanged(duplicate)
+            duplicate = None
         blob = self._client.get_blob_client(self.raw_container, blob_name)
         blob.upload_blob(
             file_bytes,
             overwrite=True,
             content_settings=ContentSettings(content_type=content_type),
+            metadata={CONTENT_HASH_METADATA: content_hash},
         )
         props = blob.get_blob_properties()
+        blob_catalog.record_upload(
+            ListedBlob(
+                name=blob_name,
+                container=self.raw_container,
+                size_bytes=props.size,
+                uploaded_at=props.last_modified.timestamp(),
+                content_hash=content_hash,
+            )
+        )
         return StoredFile(
             name=blob_name,
             size_bytes=props.size,
             uploaded_at=props.last_modified.isoformat(),
             container=self.raw_container,
+            content_hash=content_hash,
+            duplicate_of=duplicate.name if duplicate is not None else None,
         )
 
-    def list_recent(self, limit: int = 20) -> List[StoredFile]:
-        container = self._client.get_container_client(self.raw_container)
-        blobs = sorted(
-            container.list_blobs(), key=lambda b: b.last_modified, reverse=True
-        )[:limit]
-        records = []
-        for blob in blobs:
-            records.append(
-                StoredFile(
-                    name=blob.name,
-                    size_bytes=blob.size,
-                    uploaded_at=blob.last_modified.isoformat(),
-                    container=self.raw_container,
-                )
+    async def upload_stream(
+        self,
+        chunks: AsyncIterator[bytes],
+        blob_name: str,
+        content_type: str,
+        content_hash: Optional[str] = None,
+    ) -> StoredFile:
+        # A hash the client computed lets an unchanged file skip staging
+        # altogether; without one the upload is hashed as it is staged.
+        if content_hash is not None:
+            stored = await self._stored_copy(blob_name, content_hash)
+            if stored is not None:
+                return _unchanged(stored)
+        settings = get_settings()
+        blob = self._async_client().get_blob_client(self.raw_container, blob_name)
+        hasher = hashlib.sha256()
+        blocks: List[BlobBlock] = []
+        pending: Set[asyncio.Task] = set()
+        try:
+            async for block in _rechunk(chunks, settings.upload_block_size):
+                hasher.update(block)
+                block_id = base64.b64encode(f"{len(blocks):08d}".encode()).decode()
+                blocks.append(BlobBlock(block_id=block_id))
+                pending.add(asyncio.create_task(blob.stage_block(block_id, block)))
+                if len(pending) >= settings.upload_max_concurrency:
+                    done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                    for task in done:
+                        task.result()
+            if pending:
+                await asyncio.gather(*pending)
+                pending = set()
+        finally:
+            for task in pending:
+                task.cancel()
+        if content_hash is not None and content_hash != hasher.hexdigest():
+            raise ValueError(f"{blob_name}: content_sha256 does not match the uploaded bytes")
+        content_hash = hasher.hexdigest()
+        duplicate = blob_catalog.find_content(content_hash, prefer=blob_name)
+        if duplicate is not None and duplicate.name == blob_name:
+            # Same name, same bytes: leave the blob and its processing state
+            # alone. The staged blocks are never committed and Azure discards
+            # them. A copy under another name is committed as usual and only
+            # reported through duplicate_of.
+            if await self._stored_copy(blob_name, content_hash) is not None:
+                return _unchanged(duplicate)
+            # The catalog entry is stale; this upload replaces it.
+            duplicate = None
+        await blob.commit_block_list(
+            blocks,
+            content_settings=ContentSettings(content_type=content_type),
+            metadata={CONTENT_HASH_METADATA: content_hash},
+        )
+        props = await blob.get_blob_properties()
+        blob_catalog.record_upload(
+            ListedBlob(
+                name=blob_name,
+                container=self.raw_container,
+                size_bytes=props.size,
+                uploaded_at=props.last_modified.timestamp(),
+                content_hash=content_hash,
+            )
+        )
+        return StoredFile(
+            name=blob_name,
+            size_bytes=props.size,
+            uploaded_at=props.last_modified.isoformat(),
+            container=self.raw_container,
+            content_hash=content_hash,
+            duplicate_of=duplicate.name if duplicate is not None else None,
+        )
+
+    async def _stored_copy(self, blob_name: str, content_hash: str) -> Optional[CatalogEntry]:
+        # The catalog can lag a blob deleted or overwritten behind our back, so
+        # a skip is only trusted once the blob itself carries the hash.
+        entry = blob_catalog.find_content(content_hash, prefer=blob_name)
+        if entry is None or entry.name != blob_name:
+            return None
+        blob = self._async_client().get_blob_client(entry.container, blob_name)
+        try:
+            props = await blob.get_blob_properties()
+        except ResourceNotFoundError:
+            return None
+        return entry if _holds(props, content_hash) else None
+
+    def list_recent(
+        self,
+        limit: int = 20,
+        *,
+        cursor: Optional[str] = None,
+        state: Optional[str] = None,
+    ) -> Tuple[List[StoredFile], Optional[str]]:
+        self._ensure_catalog()
+        entries, next_cursor = blob_catalog.page(limit, state=state, cursor=cursor)
+        records = [
+            StoredFile(
+                name=entry.name,
+                size_bytes=entry.size_bytes,
+                uploaded_at=datetime.fromtimestamp(entry.uploaded_at, timezone.utc).isoformat(),
+                container=entry.container,
+                content_hash=entry.content_hash,
+                state=entry.state,
             )
-        return records
+            for entry in entries
+        ]
+        return records, next_cursor
 
     def download_blob(self, container: str, blob_name: str) -> BlobClient:
         return self._client.get_blob_client(container, blob_name)
 
     def move_blob(self, source_container: str, target_container: str, blob_name: str) -> None:
-        source_blob = self._client.get_blob_client(source_container, blob_name)
-        target_blob = self._client.get_blob_client(target_container, blob_name)
-        target_blob.start_copy_from_url(source_blob.url)
-        props = target_blob.get_blob_properties()
-        while props.copy.status == "pending":
-            time.sleep(0.5)
-            props = target_blob.get_blob_properties()
-        if props.copy.status != "success":
-            raise RuntimeError(
-                f"Copy failed for {blob_name}: {props.copy.status_description}"
+        self._move_many(source_container, target_container, [blob_name])
+
+    def mark_processed(self, blob_names: List[str]) -> None:
+        if not blob_names:
+            return
+        mode = get_settings().blob_processed_mode
+        if mode == "move":
+            self._move_many(self.raw_container, self.processed_container, blob_names)
+            return
+        if mode == "tag":
+            mark = self._tag_processed
+        elif mode == "metadata":
+            mark = self._flag_processed
+        else:
+            raise ValueError(f"Unsupported BLOB_PROCESSED_MODE: {mode}")
+        with ThreadPoolExecutor(max_workers=get_settings().blob_state_concurrency) as pool:
+            list(pool.map(mark, blob_names))
+        blob_catalog.set_state(blob_names, PROCESSED, container=self.raw_container)
+
+    def _tag_processed(self, blob_name: str) -> None:
+        blob = self._client.get_blob_client(self.raw_container, blob_name)
+        blob.set_blob_tags({PROCESSED_MARKER: "true"})
+
+    def _flag_processed(self, blob_name: str) -> None:
+        blob = self._client.get_blob_client(self.raw_container, blob_name)
+        props = blob.get_blob_properties()
+        blob.set_blob_metadata(
+            {**(props.metadata or {}), PROCESSED_MARKER: "true"},
+            etag=props.etag,
+            match_condition=MatchConditions.IfNotModified,
+        )
+
+    def _move_many(
+        self, source_container: str, target_container: str, blob_names: List[str]
+    ) -> None:
+        def start_copy(blob_name: str) -> Optional[str]:
+            source_blob = self._client.get_blob_client(source_container, blob_name)
+            target_blob = self._client.get_blob_client(target_container, blob_name)
+            try:
+                target_blob.start_copy_from_url(source_blob.url)
+            except ResourceNotFoundError:
+                # Already moved by an earlier, interrupted attempt.
+                target_blob.get_blob_properties()
+                return None
+            return blob_name
+
+        def copy_status(blob_name: str) -> Tuple[str, str, Optional[str]]:
+            props = self._client.get_blob_client(target_container, blob_name).get_blob_properties()
+            return blob_name, props.copy.status, props.copy.status_description
+
+        with ThreadPoolExecutor(max_workers=get_settings().blob_state_concurrency) as pool:
+            copied = [name for name in pool.map(start_copy, blob_names) if name is not None]
+            pending = list(copied)
+            while pending:
+                waiting = []
+                for blob_name, status, description in pool.map(copy_status, pending):
+                    if status == "pending":
+                        waiting.append(blob_name)
+                    elif status != "success":
+                        raise RuntimeError(f"Copy failed for {blob_name}: {description}")
+                pending = waiting
+                if pending:
+                    time.sleep(0.5)
+
+        container = self._client.get_container_client(source_container)
+        for start in range(0, len(copied), DELETE_BATCH_SIZE):
+            responses = container.delete_blobs(
+                *copied[start : start + DELETE_BATCH_SIZE], raise_on_any_failure=False
             )
-        source_blob.delete_blob()
+            for response in responses:
+                if response.status_code not in (202, 404):
+                    raise RuntimeError(
+                        f"Delete failed after copy ({response.status_code}): {response.reason}"
+                    )
+        blob_catalog.set_state(blob_names, PROCESSED, container=target_container)
 
     def list_unprocessed_blob_names(self, limit: int | None = None) -> List[str]:
-        container = self._client.get_container_client(self.raw_container)
-        blobs = container.list_blobs()
-        names: List[str] = []
-        for blob in blobs:
-            names.append(blob.name)
-            if limit and len(names) >= limit:
-                break
-        return names
+        self._ensure_catalog()
+        return blob_catalog.pending_names(limit)
+
+    def reconcile_catalog(self) -> None:
+        with self._reconcile_lock:
+            self._reconcile()
+
+    def _reconcile(self) -> None:
+        blob_catalog.reconcile(
+            itertools.chain(
+                self._list_container(self.processed_container, PROCESSED),
+                self._list_container(self.raw_container, PENDING),
+            )
+        )
+
+    def _list_container(self, container: str, state: str) -> Iterator[ListedBlob]:
+        client = self._client.get_container_client(container)
+        include = ["metadata"]
+        if get_settings().blob_processed_mode == "tag":
+            include.append("tags")
+        for blob in client.list_blobs(include=include):
+            metadata = blob.metadata or {}
+            marked = PROCESSED_MARKER in metadata or PROCESSED_MARKER in (blob.tags or {})
+            yield ListedBlob(
+                name=blob.name,
+                container=container,
+                size_bytes=blob.size,
+                uploaded_at=blob.last_modified.timestamp(),
+                content_hash=metadata.get(CONTENT_HASH_METADATA),
+                state=PROCESSED if marked else state,
+            )
+
+    def _ensure_catalog(self) -> None:
+        reconciled_at = blob_catalog.reconciled_at()
+        if reconciled_at is None:
+            self.reconcile_catalog()
+            return
+        interval = get_settings().blob_catalog_reconcile_seconds
+        if interval <= 0 or time.time() - reconciled_at < interval:
+            return
+        threading.Thread(target=self._reconcile_in_background, daemon=True).start()
+
+    def _reconcile_in_background(self) -> None:
+        if not self._reconcile_lock.acquire(blocking=False):
+            return
+        try:
+            self._reconcile()
+        except Exception:  # noqa: BLE001
+            logger.exception("Blob catalog reconciliation failed")
+        finally:
+            self._reconcile_lock.release()
+
+    def _async_client(self) -> AsyncBlobServiceClient:
+        if self._async_blob_client is None:
+            settings = get_settings()
+            if settings.azure_storage_connection_string:
+                self._async_blob_client = AsyncBlobServiceClient.from_connection_string(
+                    settings.azure_storage_connection_string
+                )
+            else:
+                self._async_blob_client = AsyncBlobServiceClient(
+                    account_url=settings.azure_storage_account_url,
+                    credential=AsyncDefaultAzureCredential(
+                        exclude_interactive_browser_credential=False
+                    ),
+                )
+        return self._async_blob_client
 
     def ensure_containers(self) -> None:
         for container_name in [self.raw_container, self.processed_container]:
@@ -103,4 +375,31 @@ class StorageService:
                 continue
 
 
+def _holds(props, content_hash: str) -> bool:
+    return props is not None and (props.metadata or {}).get(CONTENT_HASH_METADATA) == content_hash
+
+
+def _unchanged(entry: CatalogEntry) -> StoredFile:
+    return StoredFile(
+        name=entry.name,
+        size_bytes=entry.size_bytes,
+        uploaded_at=datetime.fromtimestamp(entry.uploaded_at, timezone.utc).isoformat(),
+        container=entry.container,
+        content_hash=entry.content_hash,
+        state=entry.state,
+        duplicate_of=entry.name,
+    )
+
+
+async def _rechunk(chunks: AsyncIterator[bytes], block_size: int) -> AsyncIterator[bytes]:
+    buffer = bytearray()
+    async for chunk in chunks:
+        buffer.extend(chunk)
+        while len(buffer) >= block_size:
+            yield bytes(buffer[:block_size])
+            del buffer[:block_size]
+    if buffer:
+        yield bytes(buffer)
+
+
 storage_service = StorageService()
@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from typing import AsyncIterator, List, Optional, Sequence, TextIO
+
+from app.models.schemas import ChatRequest
+
+
+def read_requests(stream: TextIO, top_k: Optional[int]) -> List[ChatRequest]:
+    # One request per line: a ChatRequest JSON object or a bare question.
+    requests: List[ChatRequest] = []
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        if line.startswith("{"):
+            request = ChatRequest.model_validate_json(line)
+        else:
+            request = ChatRequest(question=line)
+        if top_k is not None and "top_k" not in request.model_fields_set:
+            request = request.model_copy(update={"top_k": top_k})
+        requests.append(request)
+    return requests
+
+
+async def _local_results(requests: Sequence[ChatRequest], concurrency: int) -> AsyncIterator[dict]:
+    from app.services.rag import arun_rag_batch, batch_result
+
+    async for index, result in arun_rag_batch(requests, concurrency):
+        yield batch_result(index, result)
+
+
+async def _remote_results(
+    url: str, requests: Sequence[ChatRequest], concurrency: int
+) -> AsyncIterator[dict]:
+    import httpx
+
+    body = {
+        "requests": [request.model_dump(mode="json") for request in requests],
+        "concurrency": concurrency,
+    }
+    async with httpx.AsyncClient(timeout=None) as client:
+        async with client.stream("POST", f"{url.rstrip('/')}/api/chat/batch", json=body) as response:
+            response.raise_for_status()
+            async for line in response.aiter_lines():
+                if line:
+                    yield json.loads(line)
+
+
+async def run(args: argparse.Namespace, requests: Sequence[ChatRequest], output: TextIO) -> int:
+    if args.url:
+        results = _remote_results(args.url, requests, args.concurrency)
+    else:
+        results = _local_results(requests, args.concurrency)
+    start = time.perf_counter()
+    done = errors = 0
+    async for line in results:
+        output.write(json.dumps(line) + "\n")
+        done += 1
+        errors += "error" in line
+        if args.progress and done % args.progress == 0:
+            print(f"{done}/{len(requests)} answered", file=sys.stderr)
+    elapsed = time.perf_counter() - start
+    print(
+        f"{done} answered, {errors} failed in {elapsed:.1f}s "
+        f"({done / elapsed if elapsed else 0:.1f} questions/s)",
+        file=sys.stderr,
+    )
+    return 1 if errors else 0
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Answer a file of questions through the batch RAG pipeline, writing NDJSON."
+    )
+    parser.add_argument(
+        "input", help="JSONL of ChatRequest objects or one question per line; - for stdin"
+    )
+    parser.add_argument("--output", help="NDJSON results file (default stdout)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--top-k", type=int, default=None)
+    parser.add_argument(
+        "--url", help="Send the batch to a running API instead of answering in-process"
+    )
+    parser.add_argument(
+        "--progress", type=int, default=500, help="Report every N results on stderr; 0 disables"
+    )
+    args = parser.parse_args(argv)
+
+    if args.input == "-":
+        requests = read_requests(sys.stdin, args.top_k)
+    else:
+        with open(args.input, encoding="utf-8") as stream:
+            requests = read_requests(stream, args.top_k)
+    if not requests:
+        print("No questions to answer", file=sys.stderr)
+        return 1
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as output:
+            return asyncio.run(run(args, requests, output))
+    return asyncio.run(run(args, requests, sys.stdout))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,147 @@
+from __future__ import annotations
+
+import argparse
+import json
+import sys
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+from app.utils.quantization import (
+    binary_scores,
+    bytes_per_vector,
+    int8_scales,
+    int8_scores,
+    quantize_binary,
+    quantize_int8,
+    truncate,
+)
+
+_QUERY_BATCH = 64
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    best = np.argpartition(-scores, k, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, best, axis=1), axis=1)
+    return np.take_along_axis(best, order, axis=1)
+
+
+def _recall(found: np.ndarray, truth: np.ndarray) -> float:
+    hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+    return hits / truth.size
+
+
+def _exclude_self(scores: np.ndarray, query_rows: np.ndarray) -> np.ndarray:
+    scores[np.arange(len(query_rows)), query_rows] = -np.inf
+    return scores
+
+
+def evaluate(
+    vectors: np.ndarray,
+    query_count: int = 200,
+    k: int = 10,
+    dimensions: Sequence[int] = (3072, 1536, 1024, 512, 256),
+    oversampling: Sequence[float] = (1, 2, 4, 8),
+    seed: int = 0,
+) -> List[Dict[str, float]]:
+    full = truncate(vectors, vectors.shape[1])
+    rng = np.random.default_rng(seed)
+    query_rows = np.sort(rng.choice(len(full), min(query_count, len(full)), replace=False))
+    truth = np.vstack(
+        [
+            _top_k(_exclude_self(full[batch] @ full.T, batch), k)
+            for batch in np.array_split(query_rows, max(1, len(query_rows) // _QUERY_BATCH))
+        ]
+    )
+
+    report: List[Dict[str, float]] = []
+    for dims in sorted({d for d in dimensions if d <= full.shape[1]}, reverse=True):
+        reduced = truncate(full, dims)
+        scales = int8_scales(np.abs(reduced).max(axis=0))
+        encoded = {
+            "int8": quantize_int8(reduced, scales),
+            "binary": quantize_binary(reduced),
+        }
+        for quantization in ("none", "int8", "binary"):
+            factors = [1.0] if quantization == "none" else list(oversampling)
+            for factor in factors:
+                shortlist = max(k, int(np.ceil(k * factor)))
+                found = []
+                for batch in np.array_split(query_rows, max(1, len(query_rows) // _QUERY_BATCH)):
+                    queries = reduced[batch]
+                    if quantization == "none":
+                        scores = queries @ reduced.T
+                    elif quantization == "int8":
+                        scores = np.vstack(
+                            [int8_scores(encoded["int8"], scales, q) for q in queries]
+                        )
+                    else:
+                        scores = np.vstack([binary_scores(encoded["binary"], q) for q in queries])
+                    candidates = _top_k(_exclude_self(scores, batch), shortlist)
+                    if quantization != "none" and factor > 1:
+                        exact = np.einsum("qd,qcd->qc", queries, reduced[candidates])
+                        candidates = np.take_along_axis(candidates, _top_k(exact, k), axis=1)
+                    found.append(candidates[:, :k])
+                report.append(
+                    {
+                        "dimensions": dims,
+                        "quantization": quantization,
+                        "oversampling": factor,
+                        "recall_at_k": round(_recall(np.vstack(found), truth), 4),
+                        "bytes_per_vector": bytes_per_vector(dims, quantization),
+                        "index_mb": round(
+                            bytes_per_vector(dims, quantization) * len(full) / 2**20, 2
+                        ),
+                    }
+                )
+    return report
+
+
+def _load_vectors(args: argparse.Namespace) -> np.ndarray:
+    if args.vectors:
+        return np.load(args.vectors, mmap_mode="r")
+    from app.services.local_index import LocalVectorIndex
+
+    return LocalVectorIndex(args.index).export_vectors()
+
+
+def main(argv: Sequence[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Report recall@k against memory for truncated and quantized embeddings."
+    )
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--index", help="Local index directory to read embeddings from")
+    source.add_argument("--vectors", help=".npy file with one embedding per row")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--dimensions", default="3072,1536,1024,512,256")
+    parser.add_argument("--oversampling", default="1,2,4,8")
+    parser.add_argument("--json", action="store_true", help="Emit JSON instead of a table")
+    args = parser.parse_args(argv)
+
+    vectors = _load_vectors(args)
+    if len(vectors) <= args.k:
+        print(f"Need more than {args.k} vectors, found {len(vectors)}", file=sys.stderr)
+        return 1
+    report = evaluate(
+        np.asarray(vectors, dtype=np.float32),
+        query_count=args.queries,
+        k=args.k,
+        dimensions=[int(d) for d in args.dimensions.split(",")],
+        oversampling=[float(o) for o in args.oversampling.split(",")],
+    )
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 0
+    print(f"{len(vectors)} vectors, {args.queries} queries, recall@{args.k}")
+    print(f"{'dims':>6} {'quant':>7} {'over':>5} {'recall':>7} {'B/vec':>7} {'MB':>9}")
+    for row in report:
+        print(
+            f"{row['dimensions']:>6} {row['quantization']:>7} {row['oversampling']:>5g} "
+            f"{row['recall_at_k']:>7.4f} {row['bytes_per_vector']:>7} {row['index_mb']:>9.2f}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,287 @@
+from __future__ import annotations
+
+import bisect
+import re
+from dataclasses import dataclass, replace
+from typing import Callable, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from app.utils.tokens import count_tokens
+
+HEADING = re.compile(r"^#{1,6}[ \t]+\S[^\n]*", re.MULTILINE)
+PARAGRAPH_BREAK = re.compile(r"\n[ \t]*\n")
+# Tried in order on a block that is over budget on its own.
+FALLBACK_BREAKS = (
+    re.compile(r"\n"),
+    re.compile(r"(?<=[.!?])\s+"),
+    re.compile(r"\s+"),
+)
+SENTENCE_BREAK = re.compile(r"(?<=[.!?])\s+|\n")
+# Joining two blocks costs about one token for the separator.
+JOIN_TOKENS = 1
+# A chunk that is less full than this when the next block does not fit takes
+# that block's leading sentences instead of ending at the paragraph break.
+FILL_TARGET = 0.75
+
+
+@dataclass(frozen=True)
+class Span:
+    start: int
+    end: int
+    tokens: int
+    page: int
+    page_end: int
+    section: Optional[str] = None
+
+
+@dataclass(frozen=True)
+class _Block:
+    start: int
+    end: int
+    tokens: int
+    heading: bool = False
+    # Starts mid-paragraph, so the chunk before it should overlap into it.
+    continued: bool = False
+
+
+# Splits a document into token-budgeted (start, end) spans without copying
+# it. Blocks are Markdown headings and paragraphs and never cross a page
+# boundary; they are packed greedily up to max_tokens. A heading starts a new
+# chunk once the current one holds min_tokens. Chunks that end inside a
+# paragraph overlap the next one by about overlap_tokens.
+class Chunker:
+    def __init__(
+        self,
+        max_tokens: int,
+        overlap_tokens: int = 0,
+        *,
+        min_tokens: Optional[int] = None,
+        count: Callable[[str], int] = count_tokens,
+    ) -> None:
+        if max_tokens <= 0:
+            raise ValueError("max_tokens must be positive")
+        self.max_tokens = max_tokens
+        self.overlap_tokens = max(0, min(overlap_tokens, max_tokens // 2))
+        self.min_tokens = max_tokens // 4 if min_tokens is None else min_tokens
+        # Oversized blocks are cut short of the budget so the next chunk still
+        # has room for its overlap.
+        self._block_tokens = max_tokens - self.overlap_tokens
+        self._count = count
+
+    def split(self, text: str, page_starts: Sequence[Tuple[int, int]] = ((0, 1),)) -> List[Span]:
+        return self._split(text, page_starts, None)
+
+    # Splits (number, text) pages as they arrive, holding about window_chars
+    # of text at a time instead of the joined document. Each full window is
+    # split and all but its last chunk are yielded; the next window starts
+    # where that chunk did. Yields (window, base, span): span's offsets index
+    # window, which begins at offset base of the "\n"-joined pages.
+    def split_pages(
+        self, pages: Iterable[Tuple[int, str]], window_chars: int
+    ) -> Iterator[Tuple[str, int, Span]]:
+        window = ""
+        base = 0
+        page_starts: List[Tuple[int, int]] = []
+        section: Optional[str] = None
+        for number, text in pages:
+            if page_starts:
+                window += "\n"
+            page_starts.append((len(window), number))
+            window += text
+            if len(window) < window_chars:
+                continue
+            spans = self._split(window, page_starts, section)
+            if len(spans) < 2:
+                continue
+            carry = spans[-1]
+            for span in spans[:-1]:
+                yield window, base, span
+            window = window[carry.start :]
+            base += carry.start
+            section = carry.section
+            page_starts = [(max(0, start - carry.start), page) for start, page in page_starts]
+            page_starts = [
+                entry
+                for index, entry in enumerate(page_starts)
+                if index + 1 == len(page_starts) or page_starts[index + 1][0] > 0
+            ]
+        for span in self._split(window, page_starts, section):
+            yield window, base, span
+
+    def _split(
+        self, text: str, page_starts: Sequence[Tuple[int, int]], section: Optional[str]
+    ) -> List[Span]:
+        offsets = [start for start, _ in page_starts]
+        pages = [page for _, page in page_starts]
+
+        def page_at(offset: int) -> int:
+            index = bisect.bisect_right(offsets, offset) - 1
+            return pages[max(0, index)] if pages else 1
+
+        spans: List[Span] = []
+        start = end = tokens = 0
+        chunk_section = section
+
+        def emit() -> None:
+            spans.append(
+                Span(start, end, tokens, page_at(start), page_at(end - 1), chunk_section)
+            )
+
+        # (start, tokens, chunk end before it, chunk tokens before it) of a
+        # heading that is currently the last block of the chunk.
+        trailing: Optional[Tuple[int, int, int, int]] = None
+        for block in self._blocks(text, offsets):
+            if block.heading:
+                section = text[block.start : block.end].lstrip("#").strip()
+                if tokens >= self.min_tokens:
+                    emit()
+                    tokens = 0
+            while tokens and tokens + JOIN_TOKENS + block.tokens > self.max_tokens:
+                if trailing is not None:
+                    if trailing[3]:
+                        # Never end a chunk on a heading: it opens the next one.
+                        heading_start, heading_tokens, end_before, tokens_before = trailing
+                        heading_end = end
+                        end, tokens = end_before, tokens_before
+                        emit()
+                        start, end, tokens = heading_start, heading_end, heading_tokens
+                        chunk_section = section
+                    # A chunk holding only a heading keeps the block after it,
+                    # even if that goes over budget by the heading's tokens.
+                    break
+                room = self.max_tokens - tokens - JOIN_TOKENS
+                cut = None
+                if not block.heading and room >= self.max_tokens * (1 - FILL_TARGET):
+                    cut = self._cut(text, block, room)
+                if cut is None:
+                    emit()
+                    if block.continued:
+                        start, tokens = self._overlap(text, start, end, tokens, block)
+                    else:
+                        tokens = 0
+                    break
+                end, cut_tokens, block = cut
+                tokens += JOIN_TOKENS + cut_tokens
+                emit()
+                start, tokens = self._overlap(text, start, end, tokens, block)
+            before = (end, tokens)
+            if tokens == 0:
+                start = block.start
+                chunk_section = section
+            else:
+                tokens += JOIN_TOKENS
+            end = block.end
+            tokens += block.tokens
+            trailing = (block.start, block.tokens, *before) if block.heading else None
+        if tokens:
+            emit()
+        return spans
+
+    def _overlap(
+        self, text: str, start: int, end: int, tokens: int, following: _Block
+    ) -> Tuple[int, int]:
+        if not self.overlap_tokens or following.heading:
+            return following.start, 0
+        chars_per_token = (end - start) / max(tokens, 1)
+        position = max(start + 1, end - int(self.overlap_tokens * chars_per_token))
+        # Begin the overlap on a word boundary.
+        while position < end and not text[position - 1].isspace():
+            position += 1
+        while position < end and text[position].isspace():
+            position += 1
+        if position >= end:
+            return following.start, 0
+        overlap = self._count(text[position:end])
+        if overlap + JOIN_TOKENS + following.tokens > self.max_tokens:
+            return following.start, 0
+        return position, overlap
+
+    def _cut(self, text: str, block: _Block, budget: int) -> Optional[Tuple[int, int, _Block]]:
+        # The longest run of whole sentences at the start of block that fits
+        # budget, and the rest of the block.
+        taken = 0
+        position = block.start
+        cut: Optional[Tuple[int, int, int]] = None
+        for match in SENTENCE_BREAK.finditer(text, block.start, block.end):
+            piece = self._count(text[position : match.start()])
+            if taken + piece > budget:
+                break
+            taken += piece
+            position = match.start()
+            cut = (position, taken, match.end())
+        if cut is None:
+            return None
+        end, tokens, rest = cut
+        return end, tokens, _Block(rest, block.end, max(1, block.tokens - tokens), continued=True)
+
+    def _blocks(self, text: str, page_offsets: Sequence[int]) -> Iterator[_Block]:
+        bounds = list(page_offsets) or [0]
+        if bounds[0] != 0:
+            bounds.insert(0, 0)
+        bounds.append(len(text))
+        for page_start, page_end in zip(bounds, bounds[1:]):
+            position = page_start
+            for brk in PARAGRAPH_BREAK.finditer(text, page_start, page_end):
+                yield from self._paragraph(text, position, brk.start())
+                position = brk.end()
+            yield from self._paragraph(text, position, page_end)
+
+    def _paragraph(self, text: str, start: int, end: int) -> Iterator[_Block]:
+        position = start
+        for heading in HEADING.finditer(text, start, end):
+            yield from self._pieces(text, position, heading.start())
+            yield from self._fit(text, heading.start(), heading.end(), heading=True)
+            position = heading.end()
+        yield from self._pieces(text, position, end)
+
+    def _pieces(self, text: str, start: int, end: int) -> Iterator[_Block]:
+        for index, block in enumerate(self._fit(text, start, end)):
+            yield replace(block, continued=True) if index else block
+
+    def _fit(
+        self,
+        text: str,
+        start: int,
+        end: int,
+        *,
+        heading: bool = False,
+        level: int = 0,
+        tokens: Optional[int] = None,
+    ) -> Iterator[_Block]:
+        start, end = _strip(text, start, end)
+        if start >= end:
+            return
+        if tokens is None:
+            tokens = self._count(text[start:end])
+        if tokens <= self.max_tokens and (level == 0 or tokens <= self._block_tokens):
+            yield _Block(start, end, tokens, heading)
+            return
+        if level >= len(FALLBACK_BREAKS):
+            # No separator left: cut at evenly spaced character offsets.
+            parts = -(-tokens // self._block_tokens)
+            step = -(-(end - start) // parts)
+            for offset in range(start, end, step):
+                yield from self._fit(text, offset, min(end, offset + step), level=level)
+            return
+        # Pack the pieces between separators back up to the budget, so an
+        # oversized paragraph becomes a few full blocks rather than many lines.
+        piece_start = run_start = start
+        run_tokens = 0
+        pieces = [m.end() for m in FALLBACK_BREAKS[level].finditer(text, start, end)]
+        for piece_end in [*pieces, end]:
+            piece_tokens = self._count(text[piece_start:piece_end])
+            if run_tokens and run_tokens + piece_tokens > self._block_tokens:
+                yield from self._fit(
+                    text, run_start, piece_start, level=level + 1, tokens=run_tokens
+                )
+                run_start, run_tokens = piece_start, 0
+            run_tokens += piece_tokens
+            piece_start = piece_end
+        yield from self._fit(text, run_start, end, level=level + 1, tokens=run_tokens)
+
+
+def _strip(text: str, start: int, end: int) -> Tuple[int, int]:
+    while start < end and text[start].isspace():
+        start += 1
+    while end > start and text[end - 1].isspace():
+        end -= 1
+    return start, end
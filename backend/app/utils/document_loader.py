@@ -1,9 +1,16 @@
 from __future__ import annotations
 
 import io
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import Future, ProcessPoolExecutor
 from pathlib import Path
+from threading import Lock
+from typing import BinaryIO, Deque, Iterator, List, Optional, Tuple
 
-from pypdf import PdfReader
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = Lock()
 
 
 def guess_mime_type(filename: str) -> str:
@@ -16,9 +23,83 @@ def guess_mime_type(filename: str) -> str:
 
 
 def to_text(file_bytes: bytes, filename: str) -> str:
+    return "\n".join(text for _, text in iter_pages(io.BytesIO(file_bytes), filename))
+
+
+def iter_pages(
+    source: str | Path | BinaryIO,
+    filename: str,
+    *,
+    workers: int = 1,
+    parallel_min_pages: int = 128,
+    pages_per_task: int = 32,
+) -> Iterator[Tuple[int, str]]:
     suffix = Path(filename).suffix.lower()
-    if suffix == ".pdf":
-        reader = PdfReader(io.BytesIO(file_bytes))
-        pages = [page.extract_text() or "" for page in reader.pages]
-        return "\n".join(pages)
-    return file_bytes.decode("utf-8", errors="ignore")
+    if suffix != ".pdf":
+        if isinstance(source, (str, Path)):
+            with open(source, "rb") as handle:
+                data = handle.read()
+        else:
+            data = source.read()
+        yield 1, data.decode("utf-8", errors="ignore")
+        return
+
+    from pypdf import PdfReader
+
+    reader = PdfReader(source)
+    page_count = len(reader.pages)
+    if workers <= 1 or page_count < parallel_min_pages or not isinstance(source, (str, Path)):
+        for number, page in enumerate(reader.pages, start=1):
+            yield number, page.extract_text() or ""
+        return
+
+    del reader
+    pool = _process_pool(workers)
+    ranges = deque(
+        (start, min(start + pages_per_task, page_count))
+        for start in range(0, page_count, pages_per_task)
+    )
+    in_flight: Deque[Tuple[int, Future]] = deque()
+    try:
+        while ranges or in_flight:
+            while ranges and len(in_flight) < workers * 2:
+                start, end = ranges.popleft()
+                in_flight.append((start, pool.submit(_extract_range, str(source), start, end)))
+            start, future = in_flight.popleft()
+            for offset, text in enumerate(future.result()):
+                yield start + offset + 1, text
+    finally:
+        for _, future in in_flight:
+            future.cancel()
+
+
+def _extract_range(path: str, start: int, end: int) -> List[str]:
+    from pypdf import PdfReader
+
+    reader = PdfReader(path)
+    return [reader.pages[index].extract_text() or "" for index in range(start, end)]
+
+
+def _process_pool(workers: int) -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=workers,
+                mp_context=multiprocessing.get_context("spawn"),
+            )
+        return _pool
+
+
+def shutdown_pool() -> None:
+    # Stops the extraction processes; the next parallel extraction starts a
+    # new pool.
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True, cancel_futures=True)
+
+
+def default_extract_workers() -> int:
+    return os.cpu_count() or 1
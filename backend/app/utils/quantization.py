@@ -0,0 +1,43 @@
+from __future__ import annotations
+
+import numpy as np
+
+QUANTIZATIONS = ("none", "int8", "binary")
+
+_POPCOUNT = np.array([bin(value).count("1") for value in range(256)], dtype=np.uint8)
+
+
+def truncate(vectors: np.ndarray, dimensions: int) -> np.ndarray:
+    truncated = np.asarray(vectors[..., :dimensions], dtype=np.float32)
+    norms = np.linalg.norm(truncated, axis=-1, keepdims=True)
+    return truncated / np.maximum(norms, 1e-12)
+
+
+def int8_scales(max_abs: np.ndarray) -> np.ndarray:
+    return (np.maximum(max_abs, 1e-12) / 127.0).astype(np.float32)
+
+
+def quantize_int8(vectors: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    return np.clip(np.rint(vectors / scales), -127, 127).astype(np.int8)
+
+
+def int8_scores(codes: np.ndarray, scales: np.ndarray, query: np.ndarray) -> np.ndarray:
+    return np.asarray(codes, dtype=np.float32) @ (query * scales)
+
+
+def quantize_binary(vectors: np.ndarray) -> np.ndarray:
+    return np.packbits(vectors > 0, axis=-1)
+
+
+def binary_scores(codes: np.ndarray, query: np.ndarray) -> np.ndarray:
+    packed = quantize_binary(query)
+    distance = _POPCOUNT[np.bitwise_xor(np.asarray(codes), packed)].sum(axis=1, dtype=np.int32)
+    return -distance.astype(np.float32)
+
+
+def bytes_per_vector(dimensions: int, quantization: str) -> int:
+    if quantization == "int8":
+        return dimensions
+    if quantization == "binary":
+        return (dimensions + 7) // 8
+    return dimensions * 4
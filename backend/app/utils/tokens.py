@@ -0,0 +1,34 @@
+from __future__ import annotations
+
+from functools import lru_cache
+from typing import Any, Optional
+
+ENCODING_NAME = "cl100k_base"
+_CHARS_PER_TOKEN = 4
+
+
+@lru_cache
+def get_encoding() -> Optional[Any]:
+    try:
+        import tiktoken
+
+        return tiktoken.get_encoding(ENCODING_NAME)
+    except Exception:  # noqa: BLE001
+        return None
+
+
+def count_tokens(text: str) -> int:
+    encoding = get_encoding()
+    if encoding is None:
+        return (len(text) + _CHARS_PER_TOKEN - 1) // _CHARS_PER_TOKEN
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    encoding = get_encoding()
+    if encoding is None:
+        return text[: max(0, max_tokens) * _CHARS_PER_TOKEN]
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[: max(0, max_tokens)])
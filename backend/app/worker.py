@@ -0,0 +1,57 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import logging
+import signal
+import threading
+from typing import List, Optional, Sequence
+
+from app.services.processing import new_worker_id, processing_manager
+from app.services.startup import run_startup_checks
+from app.utils.document_loader import shutdown_pool
+
+
+def main(argv: Optional[Sequence[str]] = None) -> None:
+    parser = argparse.ArgumentParser(
+        description="Claim queued blobs and run the ingestion pipeline on them."
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=1,
+        help="Independent worker loops in this process, each with its own pipeline.",
+    )
+    parser.add_argument(
+        "--drain",
+        action="store_true",
+        help="Exit once the queue is empty instead of polling for new work.",
+    )
+    args = parser.parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s %(message)s")
+
+    asyncio.run(run_startup_checks())
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_: stop.set())
+
+    threads: List[threading.Thread] = []
+    for index in range(max(1, args.threads)):
+        worker_id = new_worker_id()
+        logging.getLogger(__name__).info("Starting ingestion worker %s", worker_id)
+        thread = threading.Thread(
+            target=processing_manager.run_worker,
+            args=(worker_id, stop),
+            kwargs={"drain": args.drain},
+            name=f"ingest-worker-{index}",
+        )
+        thread.start()
+        threads.append(thread)
+    while any(thread.is_alive() for thread in threads):
+        for thread in threads:
+            thread.join(timeout=0.5)
+    shutdown_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+from __future__ import annotations
+
+import argparse
+import io
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from benchmarks.run import _parser as run_parser
+from benchmarks.run import prepare_environment
+
+Pages = List[Tuple[int, str]]
+
+
+def load_corpus(args: argparse.Namespace) -> List[Tuple[str, Pages]]:
+    from benchmarks.corpus import generate_corpus
+
+    from app.utils.document_loader import iter_pages
+
+    corpus = []
+    for doc in generate_corpus(
+        args.documents,
+        seed=args.seed,
+        pages_per_document=args.pages,
+        paragraphs_per_page=args.paragraphs,
+    ):
+        corpus.append((doc.name, list(iter_pages(io.BytesIO(doc.content), doc.name))))
+    return corpus
+
+
+def chunkers() -> Dict[str, Callable[[str, Pages], list]]:
+    from app.services.processing import processing_manager
+
+    manager = processing_manager
+
+    def recursive(name: str, pages: Pages) -> list:
+        pieces = list(manager._split_pages(iter(pages)))
+        return manager._build_chunk_payloads(
+            name, [(text, 0, len(text), {"page": page}) for text, page in pieces]
+        )
+
+    def native(name: str, pages: Pages) -> list:
+        return manager._build_chunk_payloads(name, manager._span_chunks(iter(pages)))
+
+    return {"recursive": recursive, "native": native}
+
+
+def measure(
+    chunk: Callable[[str, Pages], list], corpus: Sequence[Tuple[str, Pages]], budget: int
+) -> Dict[str, float]:
+    from app.utils.tokens import count_tokens
+
+    start = time.perf_counter()
+    chunk_count = 0
+    for name, pages in corpus:
+        chunk_count += len(chunk(name, pages))
+    elapsed = time.perf_counter() - start
+
+    # A second pass under tracemalloc: it slows allocation down too much to
+    # share with the timed pass.
+    peak = 0
+    tokens: List[int] = []
+    for name, pages in corpus:
+        tracemalloc.start()
+        records = chunk(name, pages)
+        peak = max(peak, tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+        tokens.extend(count_tokens(record.content) for record in records)
+    return {
+        "chunks": chunk_count,
+        "seconds": round(elapsed, 3),
+        "chunks_per_second": round(chunk_count / elapsed, 1),
+        "mb_per_second": round(
+            sum(len(text) for _, pages in corpus for _, text in pages) / 1e6 / elapsed, 2
+        ),
+        "peak_kib_per_document": round(peak / 1024, 1),
+        "mean_tokens": round(statistics.fmean(tokens), 1),
+        "fill": round(statistics.fmean(tokens) / budget, 3),
+        "under_half_full": sum(1 for count in tokens if count < budget / 2),
+    }
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        description="Compare the native span chunker with the recursive character splitter."
+    )
+    parser.add_argument("--documents", type=int, default=120)
+    parser.add_argument("--pages", type=int, default=24)
+    parser.add_argument("--paragraphs", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args(argv)
+    prepare_environment(run_parser().parse_args([]))
+
+    from app.core.config import get_settings
+
+    settings = get_settings()
+    corpus = load_corpus(args)
+    budgets = {
+        "recursive": settings.processing_chunk_size // 4,
+        "native": settings.processing_chunk_tokens,
+    }
+    results = {
+        name: measure(chunk, corpus, budgets[name]) for name, chunk in chunkers().items()
+    }
+    print(json.dumps({"config": vars(args), "budget_tokens": budgets, "results": results}, indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
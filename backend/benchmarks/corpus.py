@@ -0,0 +1,109 @@
+from __future__ import annotations
+
+import random
+from dataclasses import dataclass
+from typing import Iterator, List, Sequence
+
+_WORDS = (
+    "azure blob storage container index vector search embedding chunk token latency "
+    "throughput pipeline ingestion citation retrieval document page section heading "
+    "paragraph summary policy contract invoice report quarterly revenue margin forecast "
+    "customer support incident outage region replica partition shard cache eviction "
+    "retention backup restore encryption identity access role permission audit compliance "
+    "deployment container app scale replica memory cpu network bandwidth request response"
+).split()
+
+
+@dataclass
+class SyntheticDocument:
+    name: str
+    content: bytes
+    content_type: str
+
+
+def _sentence(rng: random.Random) -> str:
+    words = [rng.choice(_WORDS) for _ in range(rng.randint(8, 20))]
+    return " ".join(words).capitalize() + "."
+
+
+def _paragraph(rng: random.Random) -> str:
+    return " ".join(_sentence(rng) for _ in range(rng.randint(3, 7)))
+
+
+def _pages(rng: random.Random, count: int, paragraphs_per_page: int) -> List[str]:
+    return [
+        "\n\n".join(_paragraph(rng) for _ in range(paragraphs_per_page)) for _ in range(count)
+    ]
+
+
+def make_pdf(pages: Sequence[str]) -> bytes:
+    objects = [
+        "<< /Type /Catalog /Pages 2 0 R >>",
+        "<< /Type /Pages /Kids [{}] /Count {} >>".format(
+            " ".join(f"{4 + 2 * i} 0 R" for i in range(len(pages))), len(pages)
+        ),
+        "<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>",
+    ]
+    for index, text in enumerate(pages):
+        lines = []
+        for paragraph in text.split("\n\n"):
+            words = paragraph.split()
+            for start in range(0, len(words), 12):
+                lines.append(" ".join(words[start : start + 12]))
+            lines.append("")
+        escaped = (
+            line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)") for line in lines
+        )
+        stream = "BT /F1 9 Tf 40 800 Td 11 TL " + " ".join(f"({line}) '" for line in escaped) + " ET"
+        objects.append(
+            "<< /Type /Page /Parent 2 0 R /MediaBox [0 0 612 842] "
+            f"/Resources << /Font << /F1 3 0 R >> >> /Contents {5 + 2 * index} 0 R >>"
+        )
+        objects.append(f"<< /Length {len(stream)} >>\nstream\n{stream}\nendstream")
+
+    output = bytearray(b"%PDF-1.4\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += f"{number} 0 obj\n{body}\nendobj\n".encode("latin-1")
+    xref = len(output)
+    output += f"xref\n0 {len(objects) + 1}\n0000000000 65535 f \n".encode()
+    output += b"".join(f"{offset:010d} 00000 n \n".encode() for offset in offsets)
+    output += (
+        f"trailer\n<< /Size {len(objects) + 1} /Root 1 0 R >>\nstartxref\n{xref}\n%%EOF\n"
+    ).encode()
+    return bytes(output)
+
+
+def generate_corpus(
+    documents: int,
+    *,
+    seed: int = 7,
+    pages_per_document: int = 4,
+    paragraphs_per_page: int = 4,
+    kinds: Sequence[str] = ("pdf", "md", "txt"),
+) -> Iterator[SyntheticDocument]:
+    rng = random.Random(seed)
+    for index in range(documents):
+        kind = kinds[index % len(kinds)]
+        pages = _pages(rng, pages_per_document, paragraphs_per_page)
+        name = f"synthetic-{index:05d}.{kind}"
+        if kind == "pdf":
+            yield SyntheticDocument(name, make_pdf(pages), "application/pdf")
+        elif kind == "md":
+            sections = [
+                f"## Section {number}\n\n{page}" for number, page in enumerate(pages, start=1)
+            ]
+            body = f"# Synthetic document {index}\n\n" + "\n\n".join(sections)
+            yield SyntheticDocument(name, body.encode("utf-8"), "text/markdown")
+        else:
+            yield SyntheticDocument(name, "\n\n".join(pages).encode("utf-8"), "text/plain")
+
+
+def generate_questions(count: int, *, seed: int = 11) -> List[str]:
+    rng = random.Random(seed)
+    return [
+        f"What does the {rng.choice(_WORDS)} {rng.choice(_WORDS)} say about "
+        f"{rng.choice(_WORDS)} {rng.choice(_WORDS)}?"
+        for _ in range(count)
+    ]
@@ -0,0 +1,459 @@
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import random
+import threading
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import TYPE_CHECKING, AsyncIterator, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import httpx
+import numpy as np
+import openai
+
+if TYPE_CHECKING:
+    from app.services.storage import StoredFile
+
+from app.utils.tokens import count_tokens
+
+
+@dataclass
+class LatencyProfile:
+    blob_request_ms: float = 8.0
+    blob_mb_per_second: float = 120.0
+    search_query_ms: float = 25.0
+    search_index_ms: float = 40.0
+    embedding_request_ms: float = 60.0
+    embedding_ms_per_1k_tokens: float = 4.0
+    chat_first_token_ms: float = 350.0
+    chat_ms_per_token: float = 8.0
+    chat_answer_tokens: int = 120
+    embedding_tokens_per_minute: int = 0
+    embedding_requests_per_minute: int = 0
+    jitter: float = 0.1
+    seed: int = 3
+    _rng: random.Random = field(default_factory=random.Random, repr=False)
+
+    def __post_init__(self) -> None:
+        self._rng.seed(self.seed)
+
+    def delay(self, milliseconds: float) -> float:
+        spread = milliseconds * self.jitter
+        return max(0.0, milliseconds + self._rng.uniform(-spread, spread)) / 1000
+
+    def sleep(self, milliseconds: float) -> None:
+        time.sleep(self.delay(milliseconds))
+
+    async def asleep(self, milliseconds: float) -> None:
+        await asyncio.sleep(self.delay(milliseconds))
+
+
+def fake_embedding(text: str, dimensions: int) -> List[float]:
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for token in text.lower().split():
+        digest = zlib.crc32(token.strip(".,;:?!").encode("utf-8"))
+        vector[digest % dimensions] += 1.0 if digest & 0x80000000 else -1.0
+    norm = float(np.linalg.norm(vector))
+    if norm:
+        vector /= norm
+    return vector.tolist()
+
+
+class _Throttle:
+    def __init__(self, tokens_per_minute: int, requests_per_minute: int) -> None:
+        self._tpm = tokens_per_minute
+        self._rpm = requests_per_minute
+        self._window: List[Tuple[float, int]] = []
+        self._lock = threading.Lock()
+
+    def admit(self, tokens: int) -> None:
+        if self._tpm <= 0 and self._rpm <= 0:
+            return
+        now = time.monotonic()
+        with self._lock:
+            self._window = [(at, used) for at, used in self._window if now - at < 60]
+            used_tokens = sum(used for _, used in self._window)
+            if (self._tpm > 0 and used_tokens + tokens > self._tpm) or (
+                self._rpm > 0 and len(self._window) + 1 > self._rpm
+            ):
+                retry_after = 60 - (now - self._window[0][0]) if self._window else 1.0
+                raise openai.RateLimitError(
+                    "Fake throttling",
+                    response=httpx.Response(
+                        429,
+                        headers={"retry-after-ms": str(int(retry_after * 1000))},
+                        request=httpx.Request("POST", "https://fake.openai/embeddings"),
+                    ),
+                    body=None,
+                )
+            self._window.append((now, tokens))
+
+
+class FakeEmbeddings:
+    def __init__(self, profile: LatencyProfile, dimensions: int) -> None:
+        self._profile = profile
+        self._dimensions = dimensions
+        self._throttle = _Throttle(
+            profile.embedding_tokens_per_minute, profile.embedding_requests_per_minute
+        )
+        self.requests = 0
+        self.throttled = 0
+
+    def _cost(self, texts: Sequence[str]) -> Tuple[int, float]:
+        tokens = sum(count_tokens(text) for text in texts)
+        return tokens, (
+            self._profile.embedding_request_ms
+            + self._profile.embedding_ms_per_1k_tokens * tokens / 1000
+        )
+
+    def _admit(self, tokens: int) -> None:
+        self.requests += 1
+        try:
+            self._throttle.admit(tokens)
+        except openai.RateLimitError:
+            self.throttled += 1
+            raise
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        tokens, milliseconds = self._cost(texts)
+        self._admit(tokens)
+        self._profile.sleep(milliseconds)
+        return [fake_embedding(text, self._dimensions) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        tokens, milliseconds = self._cost(texts)
+        self._admit(tokens)
+        await self._profile.asleep(milliseconds)
+        return [fake_embedding(text, self._dimensions) for text in texts]
+
+    async def aembed_query(self, text: str) -> List[float]:
+        return (await self.aembed_documents([text]))[0]
+
+
+@dataclass
+class _Message:
+    content: str
+    usage_metadata: Optional[Dict[str, int]] = None
+
+
+class FakeChat:
+    def __init__(self, profile: LatencyProfile) -> None:
+        self._profile = profile
+        # Prompt tokens of each answer call (ones carrying retrieved context),
+        # as opposed to condensation and summary calls.
+        self.answer_prompt_tokens: List[int] = []
+
+    def _answer(self, messages: List[dict]) -> Tuple[List[str], Dict[str, int]]:
+        prompt = messages[-1]["content"]
+        context_words = prompt.split("Context:\n", 1)[-1].split()
+        words = (context_words or ["No", "context"])[: self._profile.chat_answer_tokens]
+        usage = {
+            "input_tokens": sum(count_tokens(m["content"]) for m in messages),
+            "output_tokens": len(words),
+        }
+        if "Context:\n" in prompt:
+            self.answer_prompt_tokens.append(usage["input_tokens"])
+        return [f"{word} " for word in words], usage
+
+    def _duration(self, tokens: int) -> float:
+        return self._profile.chat_first_token_ms + self._profile.chat_ms_per_token * tokens
+
+    def invoke(self, messages: List[dict]) -> _Message:
+        parts, usage = self._answer(messages)
+        self._profile.sleep(self._duration(len(parts)))
+        return _Message("".join(parts), usage)
+
+    async def ainvoke(self, messages: List[dict]) -> _Message:
+        parts, usage = self._answer(messages)
+        await self._profile.asleep(self._duration(len(parts)))
+        return _Message("".join(parts), usage)
+
+    async def astream(self, messages: List[dict]) -> AsyncIterator[_Message]:
+        parts, _ = self._answer(messages)
+        await self._profile.asleep(self._profile.chat_first_token_ms)
+        for part in parts:
+            await self._profile.asleep(self._profile.chat_ms_per_token)
+            yield _Message(part)
+
+
+class _Downloader:
+    def __init__(self, data: bytes, profile: LatencyProfile) -> None:
+        self._data = data
+        self._profile = profile
+
+    def _transfer(self) -> None:
+        megabytes = len(self._data) / (1024 * 1024)
+        self._profile.sleep(
+            self._profile.blob_request_ms + megabytes / self._profile.blob_mb_per_second * 1000
+        )
+
+    def readall(self) -> bytes:
+        self._transfer()
+        return self._data
+
+    def readinto(self, stream) -> int:
+        self._transfer()
+        stream.write(self._data)
+        return len(self._data)
+
+
+class _FakeBlobClient:
+    def __init__(self, data: bytes, profile: LatencyProfile) -> None:
+        self._data = data
+        self._profile = profile
+
+    def download_blob(self) -> _Downloader:
+        return _Downloader(self._data, self._profile)
+
+
+@dataclass
+class _StoredBlob:
+    data: bytes
+    content_type: str
+    uploaded_at: datetime
+    content_hash: str = ""
+    state: str = "pending"
+
+
+class FakeBlobStorage:
+    raw_container = "raw-documents"
+    processed_container = "processed-documents"
+
+    def __init__(self, profile: LatencyProfile) -> None:
+        self._profile = profile
+        self._blobs: Dict[str, _StoredBlob] = {}
+        self._lock = threading.Lock()
+
+    def ensure_containers(self) -> None:
+        return None
+
+    def put(self, name: str, data: bytes, content_type: str) -> StoredFile:
+        from app.services.blob_catalog import ListedBlob, blob_catalog
+
+        # Mirrors StorageService: a same-name, same-bytes upload is skipped and
+        # a copy under another name is stored but reported as a duplicate.
+        content_hash = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            existing = self._blobs.get(name)
+            if existing is not None and existing.content_hash == content_hash:
+                return self._stored(name, duplicate_of=name)
+            duplicate_of = next(
+                (n for n, b in self._blobs.items() if b.content_hash == content_hash), None
+            )
+            blob = _StoredBlob(data, content_type, datetime.now(timezone.utc), content_hash)
+            self._blobs[name] = blob
+        blob_catalog.record_upload(
+            ListedBlob(
+                name=name,
+                container=self.raw_container,
+                size_bytes=len(data),
+                uploaded_at=blob.uploaded_at.timestamp(),
+                content_hash=content_hash,
+            )
+        )
+        return self._stored(name, duplicate_of=duplicate_of)
+
+    def upload_file(self, file_bytes: bytes, blob_name: str, content_type: str) -> StoredFile:
+        self._profile.sleep(self._profile.blob_request_ms)
+        return self.put(blob_name, file_bytes, content_type)
+
+    async def upload_stream(
+        self,
+        chunks: AsyncIterator[bytes],
+        blob_name: str,
+        content_type: str,
+        content_hash: Optional[str] = None,
+    ) -> StoredFile:
+        with self._lock:
+            existing = self._blobs.get(blob_name)
+        if existing is not None and existing.content_hash == content_hash:
+            await self._profile.asleep(self._profile.blob_request_ms)
+            return self._stored(blob_name, duplicate_of=blob_name)
+        data = bytearray()
+        async for chunk in chunks:
+            data.extend(chunk)
+        await self._profile.asleep(self._profile.blob_request_ms)
+        return self.put(blob_name, bytes(data), content_type)
+
+    def list_recent(
+        self, limit: int = 20, *, cursor: Optional[str] = None, state: Optional[str] = None
+    ) -> Tuple[List[StoredFile], Optional[str]]:
+        with self._lock:
+            names = sorted(
+                (n for n, b in self._blobs.items() if state is None or b.state == state),
+                key=lambda n: self._blobs[n].uploaded_at,
+                reverse=True,
+            )
+        return [self._stored(name) for name in names[:limit]], None
+
+    def list_unprocessed_blob_names(self, limit: Optional[int] = None) -> List[str]:
+        with self._lock:
+            names = [name for name, blob in self._blobs.items() if blob.state == "pending"]
+        return names[:limit] if limit else names
+
+    def download_blob(self, container: str, blob_name: str) -> _FakeBlobClient:
+        return _FakeBlobClient(self._blobs[blob_name].data, self._profile)
+
+    def mark_processed(self, blob_names: List[str]) -> None:
+        self._profile.sleep(self._profile.blob_request_ms)
+        with self._lock:
+            for name in blob_names:
+                self._blobs[name].state = "processed"
+
+    def move_blob(self, source_container: str, target_container: str, blob_name: str) -> None:
+        self.mark_processed([blob_name])
+
+    def _stored(self, name: str, duplicate_of: Optional[str] = None) -> StoredFile:
+        from app.services.storage import StoredFile
+
+        blob = self._blobs[name]
+        return StoredFile(
+            name=name,
+            size_bytes=len(blob.data),
+            uploaded_at=blob.uploaded_at.isoformat(),
+            container=self.raw_container,
+            content_hash=blob.content_hash,
+            state=blob.state,
+            duplicate_of=duplicate_of,
+        )
+
+
+@dataclass
+class _IndexingResult:
+    key: str
+    succeeded: bool
+    status_code: int
+    error_message: Optional[str] = None
+
+
+class FakeSearchService:
+    # Indexing goes through the same BulkIndexer as the Azure backend, with
+    # search_index_ms per request and Azure's per-request limits enforced.
+    def __init__(self, profile: LatencyProfile) -> None:
+        self._profile = profile
+        self._docs: Dict[str, dict] = {}
+        self._lock = threading.Lock()
+        self._matrix: Optional[np.ndarray] = None
+        self._ids: List[str] = []
+        self._executor = ThreadPoolExecutor(max_workers=8, thread_name_prefix="fake-index")
+        self.index_requests = 0
+
+    def ensure_index(self, vector_dimensions: Optional[int] = None) -> None:
+        return None
+
+    def upload_documents(self, documents: Iterable[dict]) -> None:
+        self._bulk(documents, self._upload)
+
+    def merge_documents(self, documents: Iterable[dict]) -> None:
+        self._bulk(documents, self._merge)
+
+    def delete_documents(self, ids: Iterable[str]) -> None:
+        self._bulk(({"id": chunk_id} for chunk_id in ids), self._delete)
+
+    def _bulk(self, documents: Iterable[dict], apply) -> None:
+        from app.core.config import get_settings
+        from app.services.search import BulkIndexer
+
+        settings = get_settings()
+
+        def send(batch: List[dict]) -> List[_IndexingResult]:
+            if len(batch) > 1000:
+                raise ValueError(f"{len(batch)} documents in one indexing request")
+            self._profile.sleep(self._profile.search_index_ms)
+            with self._lock:
+                self.index_requests += 1
+                apply(batch)
+                self._matrix = None
+            return [
+                _IndexingResult(document["id"], True, 200) for document in batch
+            ]
+
+        with BulkIndexer(
+            send,
+            self._executor,
+            max_documents=settings.search_batch_max_documents,
+            max_bytes=settings.search_batch_max_bytes,
+            concurrency=settings.search_index_concurrency,
+            max_attempts=settings.search_index_max_attempts,
+        ) as bulk:
+            for document in documents:
+                bulk.add(document)
+
+    def _upload(self, batch: List[dict]) -> None:
+        for document in batch:
+            self._docs[document["id"]] = dict(document)
+
+    def _merge(self, batch: List[dict]) -> None:
+        for document in batch:
+            if document["id"] in self._docs:
+                self._docs[document["id"]].update(document)
+
+    def _delete(self, batch: List[dict]) -> None:
+        for document in batch:
+            self._docs.pop(document["id"], None)
+
+    def list_chunk_ids(self, source_path: str) -> List[str]:
+        with self._lock:
+            return [k for k, doc in self._docs.items() if doc.get("source_path") == source_path]
+
+    def semantic_hybrid_search(self, query: str, top_k: int, embedding: List[float]) -> List[dict]:
+        from app.services.fusion import reciprocal_rank_fusion
+
+        self._profile.sleep(self._profile.search_query_ms)
+        return reciprocal_rank_fusion(
+            [self._keyword(query, top_k), self._vector(embedding, top_k)], top_k
+        )
+
+    async def akeyword_search(self, query: str, top_k: int) -> List[dict]:
+        await self._profile.asleep(self._profile.search_query_ms)
+        return self._keyword(query, top_k)
+
+    async def avector_search(self, embedding: List[float], top_k: int) -> List[dict]:
+        await self._profile.asleep(self._profile.search_query_ms)
+        return self._vector(embedding, top_k)
+
+    @property
+    def document_count(self) -> int:
+        return len(self._docs)
+
+    def _keyword(self, query: str, top_k: int) -> List[dict]:
+        terms = {term.strip("?.,").lower() for term in query.split()}
+        with self._lock:
+            scored = [
+                (sum(doc["content"].lower().count(term) for term in terms), doc)
+                for doc in self._docs.values()
+            ]
+        scored.sort(key=lambda item: item[0], reverse=True)
+        return [_selected(doc, float(score)) for score, doc in scored[:top_k]]
+
+    def _vector(self, embedding: List[float], top_k: int) -> List[dict]:
+        with self._lock:
+            if self._matrix is None:
+                self._ids = list(self._docs)
+                self._matrix = (
+                    np.asarray([self._docs[i]["embedding"] for i in self._ids], dtype=np.float32)
+                    if self._ids
+                    else np.zeros((0, len(embedding)), dtype=np.float32)
+                )
+            matrix, ids = self._matrix, self._ids
+            if not ids:
+                return []
+            scores = matrix @ np.asarray(embedding, dtype=np.float32)
+            best = np.argsort(-scores)[:top_k]
+            return [_selected(self._docs[ids[i]], float(scores[i])) for i in best]
+
+
+def _selected(doc: dict, score: float) -> dict:
+    # What a query with select=SELECT_FIELDS returns.
+    from app.services.search import SELECT_FIELDS
+
+    selected = {name: doc[name] for name in SELECT_FIELDS if name in doc}
+    selected["@search.score"] = score
+    return selected
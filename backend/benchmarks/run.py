@@ -0,0 +1,518 @@
+from __future__ import annotations
+
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import fields
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+BASELINE_PATH = Path(__file__).with_name("baseline.json")
+
+# metric name -> True when larger values are better
+METRICS = {
+    "startup.import_seconds": False,
+    "startup.ready_seconds": False,
+    "ingest.docs_per_second": True,
+    "ingest.chunks_per_second": True,
+    "reupload.docs_per_second": True,
+    "reupload.embedding_requests": False,
+    "search_payload.result_bytes_per_query": False,
+    "rag.p50_ms": False,
+    "rag.p95_ms": False,
+    "rag.p99_ms": False,
+    "api_chat.p50_ms": False,
+    "api_chat.p95_ms": False,
+    "api_chat.p99_ms": False,
+    "api_chat.requests_per_second": True,
+    "chat_batch.requests_per_second": True,
+    "conversation.p50_ms": False,
+    "conversation.late_prompt_tokens": False,
+    "peak_rss_mb": False,
+}
+# Allowed growth of conversation prompts from the second quarter of turns to
+# the last.
+CONVERSATION_PROMPT_GROWTH = 0.05
+
+
+def _percentile(values: Sequence[float], percentile: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * percentile / 100
+    low = int(rank)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def _latency_summary(latencies_ms: List[float], elapsed: float) -> Dict[str, float]:
+    return {
+        "requests": len(latencies_ms),
+        "p50_ms": round(_percentile(latencies_ms, 50), 2),
+        "p95_ms": round(_percentile(latencies_ms, 95), 2),
+        "p99_ms": round(_percentile(latencies_ms, 99), 2),
+        "requests_per_second": round(len(latencies_ms) / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+def _peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is kilobytes on Linux and bytes on macOS.
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def prepare_environment(args: argparse.Namespace) -> str:
+    state_dir = args.state_dir or tempfile.mkdtemp(prefix="docupilot-bench-")
+    defaults = {
+        "AZURE_STORAGE_ACCOUNT_URL": "https://bench.invalid",
+        "AZURE_SEARCH_ENDPOINT": "https://bench.invalid",
+        "AZURE_SEARCH_INDEX": "bench-index",
+        "AZURE_SEARCH_API_KEY": "bench",
+        "AZURE_OPENAI_ENDPOINT": "https://bench.invalid",
+        "AZURE_OPENAI_API_KEY": "bench",
+        "AZURE_OPENAI_GPT4O_DEPLOYMENT": "bench-chat",
+        "AZURE_OPENAI_EMBEDDING_DEPLOYMENT": "bench-embedding",
+    }
+    for key, value in defaults.items():
+        os.environ.setdefault(key, value)
+    os.environ["LOCAL_STATE_DIR"] = state_dir
+    os.environ["EMBEDDING_DIMENSIONS"] = str(args.dimensions)
+    os.environ["ANSWER_CACHE_ENABLED"] = "true" if args.answer_cache else "false"
+    os.environ["EMBEDDING_CACHE_ENABLED"] = "true" if args.embedding_cache else "false"
+    os.environ["PROCESSING_INLINE_WORKERS"] = str(args.ingest_workers)
+    return state_dir
+
+
+def install_fakes(profile, dimensions: int):
+    from benchmarks.fakes import FakeBlobStorage, FakeChat, FakeEmbeddings, FakeSearchService
+
+    import app.services.openai_client as openai_module
+    import app.services.search as search_module
+    import app.services.storage as storage_module
+
+    storage = FakeBlobStorage(profile)
+    search = FakeSearchService(profile)
+    embeddings = FakeEmbeddings(profile, dimensions)
+    storage_module.storage_service = storage
+    search_module.search_service = search
+
+    client = openai_module.openai_client
+    client.embedding = embeddings
+    client.bulk_embedding = embeddings
+    chat = FakeChat(profile)
+    client.chat = chat
+    return storage, search, embeddings, chat
+
+
+def bench_import(repeats: int = 3) -> float:
+    # A fresh interpreter per sample, so nothing is already in sys.modules.
+    code = "import time; t = time.perf_counter(); import app.main; print(time.perf_counter() - t)"
+    samples = [
+        float(
+            subprocess.run(
+                [sys.executable, "-c", code],
+                cwd=Path(__file__).resolve().parent.parent,
+                capture_output=True,
+                check=True,
+                text=True,
+            ).stdout
+        )
+        for _ in range(repeats)
+    ]
+    return sorted(samples)[len(samples) // 2]
+
+
+async def bench_ingest(http, documents, upload_batch: int) -> Dict[str, float]:
+    upload_start = time.perf_counter()
+    for start in range(0, len(documents), upload_batch):
+        files = [
+            ("files", (doc.name, doc.content, doc.content_type))
+            for doc in documents[start : start + upload_batch]
+        ]
+        response = await http.post("/api/files/upload", files=files)
+        response.raise_for_status()
+    upload_elapsed = time.perf_counter() - upload_start
+
+    start = time.perf_counter()
+    files, chunks = await _process(http, len(documents))
+    elapsed = time.perf_counter() - start
+    total_bytes = sum(len(doc.content) for doc in documents)
+    return {
+        "documents": files,
+        "chunks": chunks,
+        "seconds": round(elapsed, 3),
+        "docs_per_second": round(files / elapsed, 2),
+        "chunks_per_second": round(chunks / elapsed, 2),
+        "upload_mb_per_second": round(total_bytes / (1024 * 1024) / upload_elapsed, 2),
+    }
+
+
+async def bench_reupload(http, embeddings, documents, upload_batch: int) -> Dict[str, float]:
+    # The corpus again under its own names with client-side hashes, then as
+    # copies under new names: the first should be skipped before staging, the
+    # second aliased at ingestion.
+    async def upload(prefix: str, send_hashes: bool) -> int:
+        duplicates = 0
+        for start in range(0, len(documents), upload_batch):
+            batch = documents[start : start + upload_batch]
+            files = [
+                ("files", (f"{prefix}{doc.name}", doc.content, doc.content_type))
+                for doc in batch
+            ]
+            hashes = [hashlib.sha256(doc.content).hexdigest() for doc in batch]
+            data = {"content_sha256": hashes} if send_hashes else None
+            response = await http.post("/api/files/upload", files=files, data=data)
+            response.raise_for_status()
+            duplicates += sum(1 for item in response.json() if item["duplicate_of"])
+        return duplicates
+
+    same_name = await upload("", send_hashes=True)
+    copies = await upload("copy-", send_hashes=False)
+    requests = embeddings.requests
+    start = time.perf_counter()
+    files, chunks = await _process(http, len(documents))
+    elapsed = time.perf_counter() - start
+    return {
+        "same_name_skipped": same_name,
+        "copies_detected": copies,
+        "copies_processed": files,
+        "chunks_indexed": chunks,
+        "embedding_requests": embeddings.requests - requests,
+        "seconds": round(elapsed, 3),
+        "docs_per_second": round(files / elapsed, 2),
+    }
+
+
+async def _process(http, limit: int) -> Tuple[int, int]:
+    response = await http.post("/api/processing/start", json={"limit": limit})
+    response.raise_for_status()
+    job_id = response.json()["job_id"]
+    while True:
+        status = (await http.get(f"/api/processing/{job_id}")).json()
+        if status["state"] in ("completed", "failed"):
+            break
+        await asyncio.sleep(0.02)
+    if status["state"] != "completed":
+        raise RuntimeError(f"Ingestion failed: {status['errors']}")
+    steps = {step["step"]: step for step in status["steps"]}
+    return steps["filesProcessed"]["current"], steps["chunksIndexed"]["current"]
+
+
+def bench_search_payload(questions: List[str], top_k: int) -> Dict[str, float]:
+    # Bytes of search results per query as serialized JSON, a proxy for what
+    # Azure AI Search sends back.
+    from app.services.openai_client import openai_client
+    from app.services.search import search_service
+
+    sizes: List[int] = []
+    hits = 0
+    for question in questions:
+        embedding = openai_client.create_embedding(question)
+        results = search_service.semantic_hybrid_search(question, top_k, embedding)
+        sizes.append(len(json.dumps(results)))
+        hits += len(results)
+    return {
+        "queries": len(sizes),
+        "result_bytes_per_query": round(statistics.fmean(sizes)) if sizes else 0,
+        "result_bytes_per_hit": round(sum(sizes) / hits) if hits else 0,
+    }
+
+
+def bench_rag(questions: List[str], concurrency: int, top_k: int) -> Dict[str, float]:
+    from app.services.rag import run_rag
+
+    def ask(question: str) -> float:
+        start = time.perf_counter()
+        run_rag(question, [], top_k)
+        return (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        latencies = list(pool.map(ask, questions))
+    return _latency_summary(latencies, time.perf_counter() - start)
+
+
+async def bench_api_chat(http, questions: List[str], concurrency: int, top_k: int):
+    gate = asyncio.Semaphore(concurrency)
+
+    async def ask(question: str) -> float:
+        async with gate:
+            start = time.perf_counter()
+            response = await http.post(
+                "/api/chat/completions", json={"question": question, "top_k": top_k}
+            )
+            response.raise_for_status()
+            return (time.perf_counter() - start) * 1000
+
+    start = time.perf_counter()
+    latencies = await asyncio.gather(*(ask(question) for question in questions))
+    return _latency_summary(list(latencies), time.perf_counter() - start)
+
+
+async def bench_chat_batch(http, questions: List[str], concurrency: int, top_k: int):
+    body = {
+        "requests": [{"question": question, "top_k": top_k} for question in questions],
+        "concurrency": concurrency,
+    }
+    answered = errors = 0
+    start = time.perf_counter()
+    async with http.stream("POST", "/api/chat/batch", json=body) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if not line:
+                continue
+            answered += 1
+            errors += "error" in json.loads(line)
+    elapsed = time.perf_counter() - start
+    return {
+        "requests": answered,
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(answered / elapsed, 2) if elapsed else 0.0,
+    }
+
+
+FOLLOW_UPS = (
+    "Can you expand on that?",
+    "What are its limitations?",
+    "How does that compare with the previous answer?",
+    "Which document says so?",
+)
+
+
+async def bench_conversation(http, chat, questions: List[str], turns: int, top_k: int):
+    # One conversation continued by ID, alternating fresh questions with
+    # follow-ups. Prompt tokens per answer should not grow with the turn count
+    # once the history budget has filled (the first quarter of turns).
+    conversation_id: Optional[str] = None
+    latencies: List[float] = []
+    prompt_tokens: List[int] = []
+    start = time.perf_counter()
+    for turn in range(turns):
+        if turn % 2 == 0:
+            question = questions[turn // 2 % len(questions)]
+        else:
+            question = FOLLOW_UPS[turn // 2 % len(FOLLOW_UPS)]
+        recorded = len(chat.answer_prompt_tokens)
+        sent = time.perf_counter()
+        response = await http.post(
+            "/api/chat/completions",
+            json={"question": question, "top_k": top_k, "conversation_id": conversation_id},
+        )
+        response.raise_for_status()
+        latencies.append((time.perf_counter() - sent) * 1000)
+        conversation_id = response.json()["conversation_id"]
+        prompt_tokens.extend(chat.answer_prompt_tokens[recorded:])
+    summary = _latency_summary(latencies, time.perf_counter() - start)
+    quarter = max(1, len(prompt_tokens) // 4)
+    early = sum(prompt_tokens[quarter : 2 * quarter]) / quarter
+    late = sum(prompt_tokens[-quarter:]) / quarter
+    if turns >= 16:
+        assert late <= early * (1 + CONVERSATION_PROMPT_GROWTH), (
+            f"conversation prompts grew from {early:.0f} to {late:.0f} tokens"
+        )
+    return {
+        "turns": turns,
+        "p50_ms": summary["p50_ms"],
+        "p95_ms": summary["p95_ms"],
+        "first_prompt_tokens": prompt_tokens[0] if prompt_tokens else 0,
+        "early_prompt_tokens": round(early, 1),
+        "late_prompt_tokens": round(late, 1),
+        "max_prompt_tokens": max(prompt_tokens, default=0),
+    }
+
+
+def _flatten(results: dict, prefix: str = "") -> Dict[str, float]:
+    flat: Dict[str, float] = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{name}."))
+        elif isinstance(value, (int, float)):
+            flat[name] = value
+    return flat
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> Dict[str, dict]:
+    current = _flatten(results)
+    previous = _flatten(baseline.get("results", {}))
+    comparison: Dict[str, dict] = {}
+    for metric, higher_is_better in METRICS.items():
+        if metric not in current or metric not in previous or not previous[metric]:
+            continue
+        change = (current[metric] - previous[metric]) / previous[metric]
+        regressed = change < -tolerance if higher_is_better else change > tolerance
+        comparison[metric] = {
+            "baseline": previous[metric],
+            "current": current[metric],
+            "change": round(change, 4),
+            "regressed": regressed,
+        }
+    return comparison
+
+
+async def run(args: argparse.Namespace, profile) -> dict:
+    from benchmarks.corpus import generate_corpus, generate_questions
+
+    import_seconds = bench_import()
+    _, search, embeddings, chat = install_fakes(profile, args.dimensions)
+
+    import httpx
+
+    from app.main import app
+    from app.services.startup import startup_checks
+
+    documents = list(
+        generate_corpus(
+            args.documents,
+            seed=args.seed,
+            pages_per_document=args.pages,
+            paragraphs_per_page=args.paragraphs,
+        )
+    )
+    questions = generate_questions(args.questions, seed=args.seed)
+    results: dict = {}
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app), httpx.AsyncClient(
+        transport=transport, base_url="http://bench", timeout=600
+    ) as http:
+        start = time.perf_counter()
+        while (await http.get("/ready")).status_code != 200:
+            await asyncio.sleep(0.01)
+        results["startup"] = {
+            "import_seconds": round(import_seconds, 3),
+            "ready_seconds": round(time.perf_counter() - start, 3),
+        }
+        results["ingest"] = await bench_ingest(http, documents, args.upload_batch)
+        results["reupload"] = await bench_reupload(
+            http, embeddings, documents, args.upload_batch
+        )
+        results["search_payload"] = await asyncio.to_thread(
+            bench_search_payload, questions, args.top_k
+        )
+        results["rag"] = await asyncio.to_thread(
+            bench_rag, questions, args.concurrency, args.top_k
+        )
+        results["api_chat"] = await bench_api_chat(http, questions, args.concurrency, args.top_k)
+        results["chat_batch"] = await bench_chat_batch(
+            http, questions, args.concurrency, args.top_k
+        )
+        results["conversation"] = await bench_conversation(
+            http, chat, questions, args.conversation_turns, args.top_k
+        )
+    results["indexed_documents"] = search.document_count
+    results["embedding_requests"] = embeddings.requests
+    results["search_index_requests"] = search.index_requests
+    results["embedding_throttled"] = embeddings.throttled
+    results["peak_rss_mb"] = _peak_rss_mb()
+    return results
+
+
+def _parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(
+        description="Offline DocuPilot benchmark against local fakes of Blob, Search and OpenAI."
+    )
+    parser.add_argument("--documents", type=int, default=60)
+    parser.add_argument("--pages", type=int, default=4)
+    parser.add_argument("--paragraphs", type=int, default=4)
+    parser.add_argument("--questions", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--top-k", type=int, default=5)
+    parser.add_argument(
+        "--conversation-turns",
+        type=int,
+        default=24,
+        help="Turns in the multi-turn conversation run after the chat benchmarks.",
+    )
+    parser.add_argument("--upload-batch", type=int, default=10)
+    parser.add_argument(
+        "--ingest-workers",
+        type=int,
+        default=1,
+        help="Queue workers claiming blobs, each running its own ingestion pipeline.",
+    )
+    parser.add_argument("--dimensions", type=int, default=256)
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--state-dir", default=None)
+    parser.add_argument("--answer-cache", action="store_true")
+    parser.add_argument("--embedding-cache", action="store_true")
+    latency = parser.add_argument_group("fake service latency and throttling")
+    latency.add_argument("--blob-request-ms", dest="blob_request_ms", type=float)
+    latency.add_argument("--blob-mb-per-second", dest="blob_mb_per_second", type=float)
+    latency.add_argument("--search-query-ms", dest="search_query_ms", type=float)
+    latency.add_argument("--search-index-ms", dest="search_index_ms", type=float)
+    latency.add_argument("--embedding-request-ms", dest="embedding_request_ms", type=float)
+    latency.add_argument(
+        "--embedding-ms-per-1k-tokens", dest="embedding_ms_per_1k_tokens", type=float
+    )
+    latency.add_argument("--chat-first-token-ms", dest="chat_first_token_ms", type=float)
+    latency.add_argument("--chat-ms-per-token", dest="chat_ms_per_token", type=float)
+    latency.add_argument("--chat-answer-tokens", dest="chat_answer_tokens", type=int)
+    latency.add_argument(
+        "--embedding-tokens-per-minute", dest="embedding_tokens_per_minute", type=int
+    )
+    latency.add_argument(
+        "--embedding-requests-per-minute", dest="embedding_requests_per_minute", type=int
+    )
+    latency.add_argument("--jitter", type=float)
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--tolerance", type=float, default=0.15)
+    parser.add_argument("--write-baseline", action="store_true")
+    parser.add_argument("--fail-on-regression", action="store_true")
+    parser.add_argument("--output", type=Path, default=None)
+    return parser
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    args = _parser().parse_args(argv)
+    prepare_environment(args)
+    from benchmarks.fakes import LatencyProfile
+
+    profile_fields = [f.name for f in fields(LatencyProfile) if not f.name.startswith("_")]
+    profile = LatencyProfile(
+        **{
+            name: getattr(args, name)
+            for name in profile_fields
+            if getattr(args, name, None) is not None
+        }
+    )
+    config = {
+        key: value
+        for key, value in vars(args).items()
+        if key not in profile_fields
+        and key not in ("baseline", "output", "write_baseline", "fail_on_regression", "state_dir")
+    }
+    config["latency"] = {name: getattr(profile, name) for name in profile_fields}
+    results = asyncio.run(run(args, profile))
+    report: dict = {"config": config, "results": results}
+
+    if args.write_baseline:
+        args.baseline.write_text(json.dumps(report, indent=2) + "\n")
+    elif args.baseline.exists():
+        baseline = json.loads(args.baseline.read_text())
+        if baseline.get("config") != config:
+            report["baseline_note"] = "baseline was recorded with a different configuration"
+        report["comparison"] = compare(results, baseline, args.tolerance)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        args.output.write_text(text + "\n")
+    print(text)
+    regressions = [m for m, c in report.get("comparison", {}).items() if c["regressed"]]
+    if regressions and args.fail_on_regression:
+        print(f"Regressed: {', '.join(regressions)}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
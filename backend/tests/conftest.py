@@ -0,0 +1,18 @@
+from __future__ import annotations
+
+import os
+import tempfile
+
+# Settings are read and cached when app modules are imported, so the
+# environment has to be in place before anything under app is imported.
+os.environ["LOCAL_STATE_DIR"] = tempfile.mkdtemp(prefix="docupilot-tests-")
+os.environ["SEARCH_BACKEND"] = "local"
+os.environ["PROCESSING_INLINE_WORKERS"] = "0"
+for name, value in {
+    "AZURE_STORAGE_ACCOUNT_URL": "https://tests.blob.core.windows.net",
+    "AZURE_OPENAI_ENDPOINT": "https://tests.openai.azure.com",
+    "AZURE_OPENAI_API_KEY": "tests",
+    "AZURE_OPENAI_GPT4O_DEPLOYMENT": "gpt-4o",
+    "AZURE_OPENAI_EMBEDDING_DEPLOYMENT": "text-embedding-3-large",
+}.items():
+    os.environ.setdefault(name, value)
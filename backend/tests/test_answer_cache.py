@@ -0,0 +1,85 @@
+from app.models.schemas import ChatResponse, Citation
+from app.services import answer_cache as answer_cache_module
+from app.services.answer_cache import AnswerCache
+from app.services.job_store import JobStore
+
+
+def _response(answer, *sources):
+    return ChatResponse(
+        answer=answer,
+        citations=[
+            Citation(chunk_id=f"{source}-0", source_document=source, score=1.0, snippet="")
+            for source in sources
+        ],
+        latency_ms=1.0,
+        confidence=1.0,
+    )
+
+
+def test_questions_match_after_normalization():
+    cache = AnswerCache(4, 60, 0.95)
+    cache.put("Who owns legal holds?", 5, [1.0, 0.0], _response("Records", "a.pdf"))
+
+    assert cache.get("  who OWNS legal   holds ", 5).answer == "Records"
+    assert cache.get("Who owns legal holds?", 3) is None
+
+
+def test_similar_question_needs_the_threshold_and_top_k():
+    cache = AnswerCache(4, 60, 0.95)
+    cache.put("Who owns legal holds?", 5, [1.0, 0.0], _response("Records", "a.pdf"))
+
+    assert cache.find_similar([0.99, 0.05], 5).answer == "Records"
+    assert cache.find_similar([0.99, 0.05], 3) is None
+    assert cache.find_similar([0.5, 0.5], 5) is None
+
+
+def test_expired_entries_are_not_served(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(answer_cache_module.time, "monotonic", lambda: now[0])
+    cache = AnswerCache(4, 60, 0.95)
+    cache.put("retention tier", 5, [1.0, 0.0], _response("Cool", "a.pdf"))
+
+    now[0] += 61
+
+    assert cache.find_similar([1.0, 0.0], 5) is None
+    assert cache.get("retention tier", 5) is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = AnswerCache(2, 60, 0.95)
+    cache.put("first", 5, [1.0, 0.0, 0.0], _response("1", "a.pdf"))
+    cache.put("second", 5, [0.0, 1.0, 0.0], _response("2", "b.pdf"))
+    assert cache.get("first", 5) is not None
+
+    cache.put("third", 5, [0.0, 0.0, 1.0], _response("3", "c.pdf"))
+
+    assert cache.get("second", 5) is None
+    assert [cache.get(q, 5).answer for q in ("first", "third")] == ["1", "3"]
+    # Rows moved by the eviction still match their own vectors.
+    assert cache.find_similar([0.0, 0.0, 1.0], 5).answer == "3"
+    assert cache.find_similar([0.0, 1.0, 0.0], 5) is None
+
+
+def test_invalidating_a_source_drops_every_answer_citing_it():
+    cache = AnswerCache(4, 60, 0.95)
+    cache.put("first", 5, [1.0, 0.0], _response("1", "a.pdf", "b.pdf"))
+    cache.put("second", 5, [0.0, 1.0], _response("2", "c.pdf"))
+
+    assert cache.invalidate_sources(["b.pdf"]) == 1
+
+    assert cache.get("first", 5) is None
+    assert cache.find_similar([1.0, 0.0], 5) is None
+    assert cache.get("second", 5).answer == "2"
+
+
+def test_changes_recorded_by_another_process_invalidate(tmp_path):
+    jobs = JobStore(str(tmp_path / "jobs.sqlite3"))
+    cache = AnswerCache(4, 60, 0.95, changes=jobs)
+    cache.put("first", 5, [1.0, 0.0], _response("1", "a.pdf"))
+    cache.put("second", 5, [0.0, 1.0], _response("2", "c.pdf"))
+
+    # A worker process re-indexes a.pdf through its own connection.
+    JobStore(str(tmp_path / "jobs.sqlite3")).record_index_changes(["a.pdf"], 3600)
+
+    assert cache.get("first", 5) is None
+    assert cache.get("second", 5).answer == "2"
@@ -0,0 +1,99 @@
+import random
+import re
+
+import pytest
+
+from app.services.processing import _span_metadata, processing_manager
+from app.utils.chunking import Chunker
+
+
+def _document(seed: int) -> tuple[str, list[tuple[int, int]]]:
+    rng = random.Random(seed)
+    words = ["retention", "tier", "blob", "archive", "quota", "Zürich", "naïve", "€5,000"]
+    pages = []
+    for _ in range(rng.randint(1, 5)):
+        blocks = []
+        for _ in range(rng.randint(1, 8)):
+            kind = rng.random()
+            if kind < 0.2:
+                blocks.append("#" * rng.randint(1, 3) + " " + " ".join(rng.choices(words, k=3)))
+            elif kind < 0.3:
+                # One run-on line with no sentence or paragraph breaks.
+                blocks.append("x" * rng.randint(200, 900))
+            else:
+                sentences = (
+                    " ".join(rng.choices(words, k=rng.randint(3, 15))) + rng.choice(".!?")
+                    for _ in range(rng.randint(1, 12))
+                )
+                blocks.append(rng.choice([" ", "\n"]).join(sentences))
+        pages.append(rng.choice(["\n\n", "\n \n", "\n\n\n"]).join(blocks))
+    page_starts, length = [], 0
+    for number, page in enumerate(pages, start=1):
+        if page_starts:
+            length += 1
+        page_starts.append((length, number))
+        length += len(page)
+    return "\n".join(pages), page_starts
+
+
+@pytest.mark.parametrize("seed", range(40))
+@pytest.mark.parametrize("max_tokens, overlap", [(40, 10), (120, 20), (400, 0)])
+def test_spans_index_the_document_text(seed, max_tokens, overlap):
+    text, page_starts = _document(seed)
+    spans = Chunker(max_tokens, overlap).split(text, page_starts)
+
+    assert spans
+    previous_start = -1
+    for span in spans:
+        assert 0 <= span.start < span.end <= len(text)
+        chunk = text[span.start : span.end]
+        assert chunk == chunk.strip()
+        assert span.start > previous_start
+        previous_start = span.start
+        pages = [page for start, page in page_starts if start <= span.start]
+        assert span.page == pages[-1]
+        assert span.page <= span.page_end
+
+    covered = [False] * len(text)
+    for span in spans:
+        covered[span.start : span.end] = [True] * (span.end - span.start)
+    assert all(covered[i] for i, char in enumerate(text) if not char.isspace())
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_chunk_records_carry_their_offsets(seed):
+    text, page_starts = _document(seed)
+    spans = Chunker(80, 15).split(text, page_starts)
+    records = processing_manager._build_chunk_payloads(
+        "doc.pdf", [(text, s.start, s.end, _span_metadata(s)) for s in spans], content_ids=True
+    )
+
+    for record in records:
+        start, end = record.metadata["char_start"], record.metadata["char_end"]
+        assert text[start:end] == record.content
+        assert re.fullmatch(r"\S(.*\S)?", record.content, re.DOTALL)
+
+
+@pytest.mark.parametrize("seed", range(20))
+@pytest.mark.parametrize("window_chars", [1, 300, 2000])
+def test_streamed_pages_index_the_joined_text(seed, window_chars):
+    text, page_starts = _document(seed)
+    bounds = [start for start, _ in page_starts] + [len(text) + 1]
+    pages = [
+        (number, text[start : bounds[index + 1] - 1])
+        for index, (start, number) in enumerate(page_starts)
+    ]
+    streamed = list(Chunker(80, 15).split_pages(iter(pages), window_chars))
+
+    previous_start = -1
+    covered = [False] * len(text)
+    for window, base, span in streamed:
+        start, end = base + span.start, base + span.end
+        assert window[span.start : span.end] == text[start:end] == text[start:end].strip()
+        assert start > previous_start
+        previous_start = start
+        assert span.page == [page for offset, page in page_starts if offset <= start][-1]
+        covered[start:end] = [True] * (end - start)
+    assert all(covered[i] for i, char in enumerate(text) if not char.isspace())
+    if window_chars >= len(text):
+        assert [s for _, _, s in streamed] == Chunker(80, 15).split(text, page_starts)
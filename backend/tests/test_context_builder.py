@@ -0,0 +1,29 @@
+from app.services.context_builder import merge_adjacent
+from app.utils.chunking import Chunker
+
+TEXT = " ".join(f"Interoperability{n} considerations apply." for n in range(120))
+
+
+def _hits(spans, offsets):
+    hits = []
+    for order, span in enumerate(spans):
+        metadata = {"source_path": "guide.md", "chunk_order": order}
+        if offsets:
+            metadata.update(char_start=span.start, char_end=span.end)
+        hits.append((1.0, {"content": TEXT[span.start : span.end]}, metadata))
+    return hits
+
+
+def test_native_overlap_longer_than_recursive_setting_is_stripped():
+    spans = Chunker(400, 100).split(TEXT)
+    assert max(a.end - b.start for a, b in zip(spans, spans[1:])) > 200
+    expected = [TEXT[spans[0].start : spans[-1].end]]
+
+    # Offsets line up, and (as for chunks indexed without them) they don't.
+    for offsets in (True, False):
+        blocks = merge_adjacent(_hits(spans, offsets), max_overlap=None)
+        assert [block.text for block in blocks] == expected
+
+    # A 200-character bound, the recursive splitter's, leaves text repeated.
+    blocks = merge_adjacent(_hits(spans, offsets=False), max_overlap=200)
+    assert len(blocks[0].text) > len(expected[0])
@@ -0,0 +1,88 @@
+import httpx
+import openai
+import pytest
+
+from app.services import embedding_scheduler
+from app.services.embedding_scheduler import EmbeddingScheduler
+
+
+@pytest.fixture(autouse=True)
+def word_tokens(monkeypatch):
+    monkeypatch.setattr(embedding_scheduler, "count_tokens", lambda text: len(text.split()))
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    delays = []
+    monkeypatch.setattr(embedding_scheduler.time, "sleep", delays.append)
+    return delays
+
+
+def _scheduler(embed, **overrides):
+    options = dict(
+        max_batch_tokens=5,
+        max_batch_inputs=3,
+        tokens_per_minute=0,
+        requests_per_minute=0,
+        max_concurrency=2,
+        max_retries=2,
+    )
+    options.update(overrides)
+    return EmbeddingScheduler(embed, **options)
+
+
+def _rate_limited(headers):
+    request = httpx.Request("POST", "https://example.openai.azure.com/embeddings")
+    response = httpx.Response(429, headers=headers, request=request)
+    return openai.RateLimitError("Too Many Requests", response=response, body=None)
+
+
+def test_batches_are_packed_by_tokens_and_inputs():
+    scheduler = _scheduler(lambda texts: [])
+    texts = ["a b", "c d", "e", "f", "g", "h i j k l m n", "o"]
+
+    assert scheduler.pack(texts) == [
+        ([0, 1, 2], 5),
+        ([3, 4], 2),
+        # An oversized text goes alone and is counted at the batch limit.
+        ([5], 5),
+        ([6], 1),
+    ]
+
+
+def test_vectors_come_back_in_input_order():
+    def embed(texts):
+        return [[float(len(text))] for text in texts]
+
+    scheduler = _scheduler(embed, max_batch_inputs=2)
+
+    assert scheduler.embed(["a", "bb", "ccc", "dddd", "eeeee"]) == [
+        [1.0], [2.0], [3.0], [4.0], [5.0]
+    ]
+
+
+def test_rate_limited_batch_waits_for_retry_after(sleeps):
+    calls = []
+
+    def embed(texts):
+        calls.append(list(texts))
+        if len(calls) == 1:
+            raise _rate_limited({"retry-after-ms": "1500"})
+        return [[1.0] for _ in texts]
+
+    assert _scheduler(embed).embed(["a", "b"]) == [[1.0], [1.0]]
+
+    assert calls == [["a", "b"], ["a", "b"]]
+    assert len(sleeps) == 1
+    assert 1.5 <= sleeps[0] <= 1.5 * 1.25 + 0.1
+
+
+def test_rate_limit_is_raised_once_retries_run_out(sleeps):
+    def embed(texts):
+        raise _rate_limited({"retry-after": "2"})
+
+    with pytest.raises(openai.RateLimitError):
+        _scheduler(embed, max_retries=2).embed(["a"])
+
+    assert len(sleeps) == 2
+    assert all(2 <= delay <= 2 * 1.25 + 0.1 for delay in sleeps)
@@ -0,0 +1,134 @@
+from __future__ import annotations
+
+from typing import List
+from uuid import uuid4
+
+from app.services.context_builder import merge_adjacent
+from app.services.index_manifest import ManifestEntry, index_manifest
+from app.services.processing import (
+    BlobWork,
+    ChunkRecord,
+    _layout,
+    _span_metadata,
+    processing_manager,
+)
+from app.utils.chunking import Chunker
+
+CHUNKER = Chunker(60, 15)
+INTRO = "This handbook covers storage accounts, retention and the archive tier for auditors."
+BODY = " ".join(
+    f"Sentence {n} sets the retention rule for archive container number {n}." for n in range(40)
+)
+DOCUMENT = f"{INTRO}\n\n# Retention\n\n{BODY}"
+EDITED = f"A new opening sentence was added. {DOCUMENT}"
+# Sections long enough that a heading always starts a new chunk.
+LEGAL_HOLDS = (
+    "# Legal holds\n\nA legal hold keeps every version of a blob until the hold is "
+    "lifted, whatever the retention rule says."
+)
+QUOTAS = (
+    "# Quotas\n\nEach storage account allows five hundred terabytes by default, and "
+    "support can raise the quota on request."
+)
+
+
+def chunk(name: str, text: str) -> List[ChunkRecord]:
+    spans = CHUNKER.split(text)
+    return processing_manager._build_chunk_payloads(
+        name,
+        [(text, span.start, span.end, _span_metadata(span)) for span in spans],
+        content_ids=True,
+    )
+
+
+def record_manifest(name: str, records: List[ChunkRecord]) -> None:
+    index_manifest.replace(
+        name,
+        (
+            ManifestEntry(
+                chunk_id=record.id,
+                content_hash=record.metadata["content_hash"],
+                chunk_order=record.metadata["chunk_order"],
+                fields=_layout(record.metadata),
+            )
+            for record in records
+        ),
+    )
+
+
+def diff(name: str, records: List[ChunkRecord]) -> BlobWork:
+    work = BlobWork(job_id=uuid4(), blob_name=name, chunks=records)
+    processing_manager._diff_against_manifest(work)
+    return work
+
+
+def hit(record: ChunkRecord, metadata: dict) -> tuple:
+    return (1.0, {"id": record.id, "content": record.content}, metadata)
+
+
+def test_unchanged_document_sends_nothing():
+    name = f"{uuid4().hex}.md"
+    record_manifest(name, chunk(name, DOCUMENT))
+    work = diff(name, chunk(name, DOCUMENT))
+    assert (work.changed, work.reordered, work.orphan_ids) == ([], [], [])
+
+
+def test_added_and_removed_chunks():
+    name = f"{uuid4().hex}.md"
+    before = chunk(name, DOCUMENT)
+    record_manifest(name, before)
+    after = chunk(name, f"{DOCUMENT}\n\n{LEGAL_HOLDS}")
+    work = diff(name, after)
+    assert [r.id for r in work.changed] == [after[-1].id]
+    assert work.orphan_ids == []
+
+    record_manifest(name, after)
+    work = diff(name, before)
+    assert work.changed == []
+    assert work.orphan_ids == [after[-1].id]
+
+
+def test_reordered_chunks_are_merged_not_reembedded():
+    name = f"{uuid4().hex}.md"
+    before = chunk(name, f"{QUOTAS}\n\n{LEGAL_HOLDS}")
+    after = chunk(name, f"{LEGAL_HOLDS}\n\n{QUOTAS}")
+    record_manifest(name, before)
+    work = diff(name, after)
+    assert work.changed == [] and work.orphan_ids == []
+    assert {r.id for r in work.reordered} == {r.id for r in after}
+
+
+def test_edit_near_top_updates_moved_offsets():
+    name = f"{uuid4().hex}.md"
+    before = chunk(name, DOCUMENT)
+    after = chunk(name, EDITED)
+    record_manifest(name, before)
+    work = diff(name, after)
+
+    same_text = {r.metadata["content_hash"] for r in before}
+    moved = [r for r in after if r.metadata["content_hash"] in same_text]
+    assert moved, "the edit should leave later chunks' text unchanged"
+    # Their text is unchanged but their offsets shifted, so the index must
+    # be told the new ones.
+    assert {r.id for r in work.reordered} == {r.id for r in moved}
+    assert all(r.metadata["content_hash"] not in same_text for r in work.changed)
+
+
+def test_merging_neighbours_after_edit_near_top_keeps_all_text():
+    name = f"{uuid4().hex}.md"
+    before = {r.id: r for r in chunk(name, DOCUMENT)}
+    after = chunk(name, EDITED)
+    pairs = [
+        (a, b)
+        for a, b in zip(after, after[1:])
+        if b.metadata["char_start"] < a.metadata["char_end"] and b.id in before
+    ]
+    assert pairs, "expected overlapping neighbours whose text did not change"
+    for previous, following in pairs:
+        expected = EDITED[previous.metadata["char_start"] : following.metadata["char_end"]]
+        for metadata in (following.metadata, before[following.id].metadata):
+            # Current offsets, and offsets left over from before the edit.
+            blocks = merge_adjacent(
+                [hit(previous, previous.metadata), hit(following, metadata)], max_overlap=400
+            )
+            assert [block.text for block in blocks] == [expected]
@@ -0,0 +1,113 @@
+from uuid import uuid4
+
+from app.core.config import get_settings
+from app.models.schemas import ChatResponse, Citation
+from app.services.answer_cache import AnswerCache
+from app.services.job_store import FAILED, LEASED, QUEUED, JobStore
+
+
+def _store(tmp_path):
+    return JobStore(str(tmp_path / "jobs.sqlite3"))
+
+
+def _status(store, job_id, blob_name):
+    return store._reader().execute(
+        "SELECT status, attempts FROM job_blobs WHERE job_id = ? AND blob_name = ?",
+        (str(job_id), blob_name),
+    ).fetchone()
+
+
+def _job(store, *blob_names):
+    job_id = uuid4()
+    store.create(job_id, None)
+    store.enqueue(job_id, blob_names)
+    return job_id
+
+
+def test_live_lease_is_not_claimed_twice(tmp_path):
+    store = _store(tmp_path)
+    _job(store, "a.pdf", "b.pdf")
+
+    first = store.claim("worker-1", 1, lease_seconds=60)
+    second = store.claim("worker-2", 5, lease_seconds=60)
+
+    assert [blob.blob_name for blob in first] == ["a.pdf"]
+    assert [blob.blob_name for blob in second] == ["b.pdf"]
+    assert store.claim("worker-3", 5, lease_seconds=60) == []
+
+
+def test_expired_lease_is_reclaimed_by_another_worker(tmp_path):
+    store = _store(tmp_path)
+    job_id = _job(store, "a.pdf")
+
+    store.claim("crashed", 1, lease_seconds=-1)
+    reclaimed = store.claim("worker-2", 1, lease_seconds=60)
+
+    assert [blob.blob_name for blob in reclaimed] == ["a.pdf"]
+    assert _status(store, job_id, "a.pdf") == (LEASED, 2)
+    assert store.heartbeat("crashed", 60) == 0
+    assert store.heartbeat("worker-2", 60) == 1
+
+
+def test_lease_expiring_past_max_attempts_fails_the_blob(tmp_path):
+    store = _store(tmp_path)
+    job_id = _job(store, "a.pdf")
+    for _ in range(get_settings().processing_worker_max_attempts):
+        assert store.claim("crashed", 1, lease_seconds=-1)
+
+    assert store.claim("worker-2", 1, lease_seconds=60) == []
+    assert store.expire_exhausted() == [(job_id, "a.pdf", "failed")]
+    assert store.expire_exhausted() == []
+    assert _status(store, job_id, "a.pdf")[0] == FAILED
+    status = store.get(job_id)
+    assert status.state == "failed"
+    assert "lease expired" in status.errors[0]
+
+
+def test_release_and_retryable_failure_requeue(tmp_path):
+    store = _store(tmp_path)
+    job_id = _job(store, "a.pdf")
+
+    store.claim("worker-1", 1, lease_seconds=60)
+    assert store.release("worker-1") == 1
+    assert _status(store, job_id, "a.pdf") == (QUEUED, 0)
+
+    store.claim("worker-1", 1, lease_seconds=60)
+    assert store.fail(job_id, "a.pdf", "boom", max_attempts=3) == (True, None)
+    assert _status(store, job_id, "a.pdf") == (QUEUED, 1)
+    assert store.claim("worker-2", 1, lease_seconds=60)
+    store.complete(job_id, "a.pdf")
+    assert store.get(job_id).state == "completed"
+
+
+def _response(source):
+    return ChatResponse(
+        answer="answer",
+        citations=[Citation(chunk_id="c1", source_document=source, score=0.9, snippet="")],
+        latency_ms=1.0,
+        confidence=0.9,
+    )
+
+
+def test_answer_cache_drops_answers_for_sources_indexed_elsewhere(tmp_path):
+    api_cache = AnswerCache(16, 3600, 0.95, changes=_store(tmp_path))
+    api_cache.put("What is the quota?", 5, [1.0, 0.0], _response("quotas.pdf"))
+    api_cache.put("Who owns holds?", 5, [0.0, 1.0], _response("holds.pdf"))
+
+    indexer = _store(tmp_path)
+    indexer.record_index_changes(["quotas.pdf"], retention_seconds=3600)
+
+    assert api_cache.get("What is the quota?", 5) is None
+    assert api_cache.find_similar([1.0, 0.0], 5) is None
+    assert api_cache.get("Who owns holds?", 5) is not None
+
+
+def test_answer_cache_clears_when_changes_were_pruned(tmp_path):
+    api_cache = AnswerCache(16, 3600, 0.95, changes=_store(tmp_path))
+    api_cache.put("Who owns holds?", 5, [0.0, 1.0], _response("holds.pdf"))
+
+    indexer = _store(tmp_path)
+    indexer.record_index_changes(["a.pdf"], retention_seconds=3600)
+    indexer.record_index_changes(["b.pdf"], retention_seconds=-1)
+
+    assert api_cache.get("Who owns holds?", 5) is None
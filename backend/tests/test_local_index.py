@@ -0,0 +1,73 @@
+import multiprocessing
+
+import numpy as np
+
+from app.services.local_index import LocalVectorIndex, _Segment
+
+DIM = 8
+
+
+def _doc(key, source, seed):
+    vector = np.random.default_rng(seed).standard_normal(DIM).astype(np.float32)
+    return {"id": key, "source_path": source, "content": f"chunk {key}", "embedding": vector}
+
+
+def _populate(path):
+    index = LocalVectorIndex(path)
+    index.upsert(_doc(f"a{i}", "a.pdf", i) for i in range(20))
+    index.upsert(_doc(f"b{i}", "b.pdf", 100 + i) for i in range(5))
+    index.compact()
+    return index
+
+
+def test_reload_with_tail_does_not_parse_base_documents(tmp_path, monkeypatch):
+    index = _populate(tmp_path)
+    index.delete(["a3"])
+    index.upsert([_doc("a1", "a.pdf", 999)])
+
+    parsed = []
+    original = _Segment.doc
+    monkeypatch.setattr(_Segment, "doc", lambda self, row: parsed.append(row) or original(self, row))
+    reloaded = LocalVectorIndex(tmp_path)
+
+    assert len(reloaded) == 24
+    assert len(parsed) <= 2
+    assert sorted(reloaded.ids_for_source("b.pdf")) == [f"b{i}" for i in range(5)]
+    assert "a3" not in reloaded.ids_for_source("a.pdf")
+    assert "a1" in reloaded.ids_for_source("a.pdf")
+
+
+def test_ids_for_source_after_compaction(tmp_path):
+    index = _populate(tmp_path)
+    index.delete(["b0"])
+    index.upsert([_doc("c0", "c.pdf", 7)])
+    index.compact()
+
+    assert sorted(index.ids_for_source("b.pdf")) == [f"b{i}" for i in range(1, 5)]
+    assert index.ids_for_source("c.pdf") == ["c0"]
+    assert index.ids_for_source("missing.pdf") == []
+
+
+def _write_from_other_process(path):
+    writer = LocalVectorIndex(path)
+    writer.upsert([_doc("z0", "z.pdf", 42)])
+    writer.delete(["a0"])
+
+
+def test_readers_see_writes_from_other_processes(tmp_path):
+    reader = _populate(tmp_path)
+    assert len(reader) == 25
+
+    process = multiprocessing.get_context("fork").Process(
+        target=_write_from_other_process, args=(str(tmp_path),)
+    )
+    process.start()
+    process.join()
+
+    assert reader.ids_for_source("z.pdf") == ["z0"]
+    assert "a0" not in reader.ids_for_source("a.pdf")
+    assert len(reader) == 25
+
+    LocalVectorIndex(tmp_path).compact()
+    assert reader.ids_for_source("z.pdf") == ["z0"]
+    assert len(reader) == 25
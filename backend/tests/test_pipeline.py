@@ -0,0 +1,87 @@
+import threading
+import time
+
+import pytest
+
+from app.services.pipeline import Stage, StagedPipeline
+
+
+def _counted(items, pulled):
+    for item in items:
+        pulled.append(item)
+        yield item
+
+
+def test_slow_stage_holds_back_the_source():
+    release = threading.Event()
+    pulled = []
+    done = []
+
+    def slow(item):
+        release.wait(5)
+        done.append(item)
+
+    pipeline = StagedPipeline([Stage("slow", slow)], queue_size=2)
+    runner = threading.Thread(target=pipeline.run, args=(_counted(range(100), pulled),))
+    runner.start()
+    time.sleep(0.2)
+
+    # One item in the handler, two queued, one waiting on the full queue.
+    assert len(pulled) <= 4
+    release.set()
+    runner.join(5)
+    assert sorted(done) == list(range(100))
+
+
+def test_stages_pass_batches_downstream():
+    batches = []
+
+    def double(item):
+        return item * 2
+
+    def collect(batch):
+        batches.append(list(batch))
+
+    StagedPipeline(
+        [Stage("double", double), Stage("collect", collect, batch_size=3)]
+    ).run(range(7))
+
+    assert sorted(sum(batches, [])) == [0, 2, 4, 6, 8, 10, 12]
+    assert sorted(len(batch) for batch in batches) == [1, 3, 3]
+
+
+def test_stage_error_stops_the_run_and_is_raised():
+    pulled = []
+    handled = []
+
+    def parse(item):
+        if item == 3:
+            raise ValueError("corrupt page")
+        return item
+
+    def index(item):
+        handled.append(item)
+
+    pipeline = StagedPipeline([Stage("parse", parse), Stage("index", index)], queue_size=1)
+
+    with pytest.raises(ValueError, match="corrupt page"):
+        pipeline.run(_counted(range(1000), pulled))
+
+    assert 3 not in handled
+    assert len(pulled) < 1000
+
+
+def test_source_error_is_raised_after_workers_finish():
+    workers = []
+
+    def source():
+        yield 1
+        raise RuntimeError("listing failed")
+
+    def index(item):
+        workers.append(threading.current_thread())
+
+    with pytest.raises(RuntimeError, match="listing failed"):
+        StagedPipeline([Stage("index", index)]).run(source())
+
+    assert not any(thread.is_alive() for thread in workers)
@@ -0,0 +1,135 @@
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from app.core.config import get_settings
+from app.services import processing
+from app.services.blob_catalog import PENDING, PROCESSING, BlobCatalog
+from app.services.embedding_cache import EmbeddingCache
+from app.services.index_manifest import IndexManifest
+from app.services.job_store import EMBEDDED, FAILED, JobStore
+from app.services.processing import ProcessingManager
+from app.services.search import IndexingError
+
+
+@pytest.fixture
+def stores(tmp_path, monkeypatch):
+    catalog = BlobCatalog(str(tmp_path / "blob_catalog.sqlite3"))
+    jobs = JobStore(str(tmp_path / "jobs.sqlite3"))
+    monkeypatch.setattr(processing, "blob_catalog", catalog)
+    monkeypatch.setattr(processing, "job_store", jobs)
+    return catalog, jobs
+
+
+def test_blob_whose_lease_ran_out_goes_back_to_pending(stores, monkeypatch):
+    catalog, jobs = stores
+    monkeypatch.setattr(get_settings(), "processing_worker_max_attempts", 1)
+    manager = ProcessingManager()
+    monkeypatch.setattr(
+        processing.storage_service, "list_unprocessed_blob_names", lambda limit: ["a.pdf"]
+    )
+    job_id = manager.start_job(None)
+    assert catalog.get("a.pdf").state == PROCESSING
+    assert jobs.claim("crashed", 1, lease_seconds=-1)
+
+    assert list(manager._claimed("worker-2", threading.Event(), drain=True)) == []
+
+    assert catalog.pending_names() == ["a.pdf"]
+    assert jobs.get(job_id).state == FAILED
+
+
+def test_failed_enqueue_releases_claimed_blobs(stores, monkeypatch):
+    catalog, jobs = stores
+    manager = ProcessingManager()
+    monkeypatch.setattr(
+        processing.storage_service,
+        "list_unprocessed_blob_names",
+        lambda limit: ["a.pdf", "b.pdf"],
+    )
+
+    def enqueue(job_id, names):
+        raise RuntimeError("database is locked")
+
+    monkeypatch.setattr(jobs, "enqueue", enqueue)
+
+    job_id = manager.start_job(None)
+
+    assert jobs.get(job_id).state == FAILED
+    assert [catalog.get(name).state for name in ("a.pdf", "b.pdf")] == [PENDING, PENDING]
+
+
+HANDBOOK = "# Retention\n\n" + " ".join(
+    f"Rule {n} moves container {n} to the archive tier after {n} days." for n in range(30)
+)
+
+
+class _Downloads:
+    def __init__(self, data):
+        self.count = 0
+        self._data = data
+
+    def __call__(self, container, name):
+        self.count += 1
+        data = self._data
+        return SimpleNamespace(
+            download_blob=lambda: SimpleNamespace(readinto=lambda handle: handle.write(data))
+        )
+
+
+def test_blob_that_failed_after_embedding_resumes_without_new_embeddings(
+    stores, tmp_path, monkeypatch
+):
+    catalog, jobs = stores
+    monkeypatch.setattr(get_settings(), "processing_worker_max_attempts", 3)
+    monkeypatch.setattr(processing, "index_manifest", IndexManifest(str(tmp_path / "m.sqlite3")))
+    cache = EmbeddingCache(1000, str(tmp_path / "embeddings.sqlite3"))
+    monkeypatch.setattr(processing.openai_client, "embedding_cache", cache)
+    embedded = []
+
+    def embed(texts):
+        embedded.extend(texts)
+        return [[1.0, float(len(text))] for text in texts]
+
+    monkeypatch.setattr(processing.openai_client.embedding_scheduler, "embed", embed)
+    downloads = _Downloads(HANDBOOK.encode())
+    storage = processing.storage_service
+    monkeypatch.setattr(storage, "list_unprocessed_blob_names", lambda limit: ["handbook.md"])
+    monkeypatch.setattr(storage, "download_blob", downloads)
+    moved = []
+    monkeypatch.setattr(storage, "mark_processed", moved.extend)
+    search = processing.search_service
+    uploaded = []
+
+    def index_down(documents):
+        documents = list(documents)
+        raise IndexingError({documents[0]["id"]: "service unavailable"})
+
+    monkeypatch.setattr(search, "upload_documents", index_down)
+    monkeypatch.setattr(search, "merge_documents", lambda documents: list(documents))
+    monkeypatch.setattr(search, "delete_documents", lambda ids: list(ids))
+
+    manager = ProcessingManager()
+    job_id = manager.start_job(None)
+    manager.run_worker("worker-1", threading.Event(), drain=True)
+
+    peek = jobs.claim("peek", 1, lease_seconds=60)
+    assert [blob.checkpoint for blob in peek] == [EMBEDDED]
+    jobs.release("peek")
+    first_embedded = list(embedded)
+    assert first_embedded and not moved
+
+    monkeypatch.setattr(search, "upload_documents", lambda documents: uploaded.extend(documents))
+    manager.run_worker("worker-2", threading.Event(), drain=True)
+
+    # The scratch copy went with the parse stage, so the blob is downloaded
+    # again, but its vectors come from the embedding cache.
+    assert downloads.count == 2
+    assert embedded == first_embedded
+    assert [d["content"] for d in uploaded] == first_embedded
+    assert moved == ["handbook.md"]
+    status = jobs.get(job_id)
+    assert status.state == "completed"
+    steps = {step.step: (step.current, step.total) for step in status.steps}
+    assert steps["filesProcessed"] == (1, 1)
+    assert steps["embeddingsCreated"] == (len(first_embedded), len(first_embedded))
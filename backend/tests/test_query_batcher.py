@@ -0,0 +1,87 @@
+import asyncio
+
+import pytest
+
+from app.services.query_batcher import QueryEmbeddingBatcher
+
+
+class _Embedder:
+    def __init__(self, failing=()):
+        self.batches = []
+        self.singles = []
+        self._failing = set(failing)
+
+    async def many(self, texts):
+        self.batches.append(list(texts))
+        if self._failing & set(texts):
+            raise ValueError("input rejected")
+        return [[float(len(text))] for text in texts]
+
+    async def one(self, text):
+        self.singles.append(text)
+        if text in self._failing:
+            raise ValueError(f"{text} rejected")
+        return [float(len(text))]
+
+
+def _batcher(embedder, max_batch=8):
+    return QueryEmbeddingBatcher(
+        embedder.many, embedder.one, max_wait_ms=20, max_batch=max_batch
+    )
+
+
+def test_concurrent_questions_share_one_request():
+    embedder = _Embedder()
+    batcher = _batcher(embedder)
+
+    async def scenario():
+        return await asyncio.gather(*(batcher.embed(q) for q in ("a", "bb", "a")))
+
+    assert asyncio.run(scenario()) == [[1.0], [2.0], [1.0]]
+    assert embedder.batches == [["a", "bb"]]
+
+
+def test_full_batch_is_sent_without_waiting():
+    embedder = _Embedder()
+    batcher = QueryEmbeddingBatcher(embedder.many, embedder.one, max_wait_ms=60000, max_batch=2)
+
+    async def scenario():
+        return await asyncio.wait_for(
+            asyncio.gather(batcher.embed("a"), batcher.embed("bb")), timeout=1
+        )
+
+    assert asyncio.run(scenario()) == [[1.0], [2.0]]
+
+
+def test_one_failing_question_does_not_fail_the_batch():
+    embedder = _Embedder(failing={"bad"})
+    batcher = _batcher(embedder)
+
+    async def scenario():
+        return await asyncio.gather(
+            batcher.embed("a"), batcher.embed("bad"), batcher.embed("ccc"), return_exceptions=True
+        )
+
+    good, bad, other = asyncio.run(scenario())
+
+    assert (good, other) == ([1.0], [3.0])
+    assert isinstance(bad, ValueError) and str(bad) == "bad rejected"
+    assert embedder.batches == [["a", "bad", "ccc"]]
+    assert sorted(embedder.singles) == ["a", "bad", "ccc"]
+
+
+def test_cancelled_caller_is_left_out_of_the_batch():
+    embedder = _Embedder()
+    batcher = _batcher(embedder)
+
+    async def scenario():
+        gone = asyncio.ensure_future(batcher.embed("gone"))
+        kept = asyncio.ensure_future(batcher.embed("kept"))
+        await asyncio.sleep(0)
+        gone.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await gone
+        return await kept
+
+    assert asyncio.run(scenario()) == [4.0]
+    assert embedder.batches == [["kept"]]
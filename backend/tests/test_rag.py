@@ -0,0 +1,126 @@
+import asyncio
+import threading
+
+from app.core.config import get_settings
+from app.models.schemas import ChatHistoryItem, ChatRequest, ChatResponse
+from app.services import conversation, rag
+from app.services.conversation import aprepare_turn, aremember_turn
+from app.services.openai_client import openai_client
+
+
+class _Recorder:
+    # Records the thread each store call runs on.
+    def __init__(self, **results):
+        self.threads = {}
+        self._results = results
+
+    def __getattr__(self, name):
+        def call(*args, **kwargs):
+            self.threads.setdefault(name, set()).add(threading.get_ident())
+            return self._results.get(name)
+
+        return call
+
+
+def test_async_embedding_keeps_the_cache_off_the_loop(monkeypatch):
+    cache = _Recorder(get_many={})
+    monkeypatch.setattr(openai_client, "embedding_cache", cache)
+
+    async def embed(text):
+        return [0.5, 0.5]
+
+    monkeypatch.setattr(openai_client, "_aembed_query", embed)
+
+    async def scenario():
+        vector = await openai_client.acreate_embedding("what is the retention tier?")
+        await asyncio.gather(*openai_client._cache_writes)
+        return vector, threading.get_ident()
+
+    vector, loop_thread = asyncio.run(scenario())
+
+    assert vector == [0.5, 0.5]
+    assert set(cache.threads) == {"get_many", "put_many"}
+    assert all(loop_thread not in threads for threads in cache.threads.values())
+
+
+def test_async_conversation_turns_keep_the_store_off_the_loop(monkeypatch):
+    store = _Recorder(load=None, append=[])
+    monkeypatch.setattr(conversation, "conversation_store", store)
+
+    async def scenario():
+        turn = await aprepare_turn("Who owns legal holds?", [], "conversation-1")
+        await aremember_turn(turn, "The records team.")
+        return threading.get_ident()
+
+    loop_thread = asyncio.run(scenario())
+
+    assert set(store.threads) == {"load", "append"}
+    assert all(loop_thread not in threads for threads in store.threads.values())
+
+
+def _run_batch(requests):
+    async def scenario():
+        return dict([result async for result in rag.arun_rag_batch(requests, concurrency=4)])
+
+    return asyncio.run(scenario())
+
+
+def test_batch_shares_embeddings_searches_and_answers(monkeypatch):
+    monkeypatch.setattr(get_settings(), "chat_condense_questions", False)
+    monkeypatch.setattr(conversation, "conversation_store", _Recorder(load=None, append=[]))
+    monkeypatch.setattr(rag, "answer_cache", None)
+    embedded, searched, completed = [], [], []
+
+    def batch_embeddings(texts):
+        embedded.append(list(texts))
+        return [[1.0, 0.0] for _ in texts]
+
+    async def search(query, embedding, top_k):
+        searched.append((query, top_k))
+        await asyncio.sleep(0)
+        return [{"id": f"{query}-{top_k}"}]
+
+    async def complete(turn, top_k, embedding, results):
+        completed.append((turn.query, top_k, bool(turn.history)))
+        await asyncio.sleep(0)
+        if turn.query == "Who approves deletions?":
+            raise RuntimeError("completion failed")
+        return ChatResponse(
+            answer=results[0]["id"], citations=[], latency_ms=1.0, confidence=1.0
+        )
+
+    monkeypatch.setattr(openai_client, "batch_embeddings", batch_embeddings)
+    monkeypatch.setattr(rag, "_asearch", search)
+    monkeypatch.setattr(rag, "_acomplete", complete)
+    retention = "What is the retention tier?"
+    followup = [ChatHistoryItem(role="user", content="Tell me about storage.")]
+    requests = [
+        ChatRequest(question=retention),
+        ChatRequest(question=retention),
+        ChatRequest(question=retention, top_k=3),
+        ChatRequest(question=retention, history=followup),
+        ChatRequest(question="Who approves deletions?"),
+        ChatRequest(question="Who approves deletions?"),
+    ]
+
+    results = _run_batch(requests)
+
+    assert embedded == [[retention, "Who approves deletions?"]]
+    assert sorted(searched) == [
+        (retention, 3),
+        (retention, 5),
+        ("Who approves deletions?", 5),
+    ]
+    # The follow-up shares the search but gets its own answer.
+    assert sorted(completed) == [
+        (retention, 3, False),
+        (retention, 5, False),
+        (retention, 5, True),
+        ("Who approves deletions?", 5, False),
+    ]
+    assert [results[i].answer for i in range(4)] == [
+        f"{retention}-5", f"{retention}-5", f"{retention}-3", f"{retention}-5"
+    ]
+    assert results[0].conversation_id is None
+    assert results[3].conversation_id is not None
+    assert all(isinstance(results[i], RuntimeError) for i in (4, 5))
@@ -0,0 +1,181 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Optional
+
+import pytest
+from azure.core.exceptions import HttpResponseError
+from azure.search.documents.indexes.models import (
+    BinaryQuantizationCompression,
+    HnswAlgorithmConfiguration,
+    SearchField,
+    SearchFieldDataType,
+    SearchIndex,
+    VectorSearch,
+    VectorSearchProfile,
+)
+
+from app.core.config import get_settings
+from app.services import openai_client, search
+from app.services.search import AzureAISearchService, BulkIndexer, IndexingError
+
+
+def _index(dimensions, compression=None):
+    return SearchIndex(
+        name="rag-index",
+        fields=[
+            SearchField(
+                name="embedding",
+                type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
+                searchable=True,
+                vector_search_dimensions=dimensions,
+                vector_search_profile_name="defaultProfile",
+            )
+        ],
+        vector_search=VectorSearch(
+            algorithms=[HnswAlgorithmConfiguration(name="default")],
+            profiles=[
+                VectorSearchProfile(
+                    name="defaultProfile",
+                    algorithm_configuration_name="default",
+                    compression_name=compression.compression_name if compression else None,
+                )
+            ],
+            compressions=[compression] if compression else None,
+        ),
+    )
+
+
+def test_existing_index_matching_config_passes():
+    service = AzureAISearchService()
+    service._check_vector_config(_index(3072), 3072, "none")
+    binary = BinaryQuantizationCompression(compression_name="quantized")
+    service._check_vector_config(_index(1024, binary), 1024, "binary")
+
+
+@pytest.mark.parametrize(
+    "dimensions, quantization, expected",
+    [(1536, "none", "3072-dim"), (3072, "int8", "'binary' quantization")],
+)
+def test_existing_index_with_other_vector_config_fails(dimensions, quantization, expected):
+    binary = BinaryQuantizationCompression(compression_name="quantized")
+    existing = _index(3072, binary if quantization == "int8" else None)
+    with pytest.raises(ValueError, match=expected):
+        AzureAISearchService()._check_vector_config(existing, dimensions, quantization)
+
+
+@pytest.mark.parametrize(
+    "model, dimensions, sent",
+    [
+        ("text-embedding-ada-002", None, None),
+        ("text-embedding-3-large", None, None),
+        ("text-embedding-3-large", 3072, None),
+        ("text-embedding-3-large", 1024, 1024),
+    ],
+)
+def test_embedding_dimensions_sent_only_when_truncating(monkeypatch, model, dimensions, sent):
+    monkeypatch.setattr(get_settings(), "embedding_model", model)
+    monkeypatch.setattr(get_settings(), "embedding_dimensions", dimensions)
+    assert openai_client._embeddings().dimensions == sent
+
+
+@dataclass
+class _Result:
+    # azure's IndexingResult is read-only once constructed.
+    key: str
+    succeeded: bool
+    status_code: int
+    error_message: Optional[str] = None
+
+
+class _Index:
+    def __init__(self, reject=lambda key, attempt: None, max_batch=None):
+        self._reject = reject
+        self._max_batch = max_batch
+        self._lock = threading.Lock()
+        self.attempts = {}
+        self.batches = []
+        self.stored = set()
+
+    def send(self, documents):
+        with self._lock:
+            self.batches.append([d["id"] for d in documents])
+        if self._max_batch and len(documents) > self._max_batch:
+            error = HttpResponseError(message="request too large")
+            error.status_code = 413
+            raise error
+        results = []
+        for document in documents:
+            key = document["id"]
+            with self._lock:
+                attempt = self.attempts[key] = self.attempts.get(key, 0) + 1
+            status = self._reject(key, attempt)
+            if status is None:
+                with self._lock:
+                    self.stored.add(key)
+                results.append(_Result(key, True, 200))
+            else:
+                results.append(_Result(key, False, status, f"status {status}"))
+        return results
+
+
+def _index_all(index, keys, max_documents=10, max_attempts=3):
+    with ThreadPoolExecutor(4) as executor:
+        with BulkIndexer(
+            index.send,
+            executor,
+            max_documents=max_documents,
+            max_bytes=10**9,
+            concurrency=2,
+            max_attempts=max_attempts,
+        ) as bulk:
+            for key in keys:
+                bulk.add({"id": key, "content": "text", "embedding": [0.1] * 8})
+
+
+@pytest.fixture(autouse=True)
+def _no_backoff(monkeypatch):
+    monkeypatch.setattr(search, "_backoff", lambda attempt: None)
+
+
+def test_bulk_indexer_retries_only_throttled_documents():
+    keys = [f"d-{i}" for i in range(45)]
+    index = _Index(reject=lambda key, attempt: 503 if key.endswith("7") and attempt == 1 else None)
+
+    _index_all(index, keys)
+
+    assert index.stored == set(keys)
+    retried = {key for key, attempts in index.attempts.items() if attempts > 1}
+    assert retried == {"d-7", "d-17", "d-27", "d-37"}
+    assert all(index.attempts[key] == 1 for key in set(keys) - retried)
+    assert max(len(batch) for batch in index.batches) == 10
+
+
+def test_bulk_indexer_reports_permanent_and_exhausted_failures():
+    def reject(key, attempt):
+        if key == "d-3":
+            return 400
+        if key == "d-5":
+            return 429
+        return None
+
+    keys = [f"d-{i}" for i in range(12)]
+    index = _Index(reject=reject)
+
+    with pytest.raises(IndexingError) as raised:
+        _index_all(index, keys, max_attempts=3)
+
+    assert set(raised.value.failed) == {"d-3", "d-5"}
+    assert index.attempts["d-3"] == 1
+    assert index.attempts["d-5"] == 3
+    assert index.stored == set(keys) - {"d-3", "d-5"}
+
+
+def test_bulk_indexer_halves_requests_that_are_too_large():
+    keys = [f"d-{i}" for i in range(10)]
+    index = _Index(max_batch=3)
+
+    _index_all(index, keys)
+
+    assert index.stored == set(keys)
+    assert [len(batch) for batch in index.batches] == [10, 5, 2, 3, 5, 2, 3]
@@ -0,0 +1,112 @@
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import pytest
+
+import app.main as main
+import app.services.startup as startup
+from app.services.startup import StartupChecks
+from app.utils import document_loader
+
+# Generous for CI; the offline benchmark reaches ready in a few tens of ms.
+READY_WITHIN_SECONDS = 2.0
+
+
+def _checks(monkeypatch, **overrides):
+    # The real checks, except blob containers: creating them needs a storage
+    # account.
+    checks = StartupChecks(
+        {**startup.startup_checks._checks, "storage_containers": lambda: None, **overrides}
+    )
+    monkeypatch.setattr(startup, "startup_checks", checks)
+    monkeypatch.setattr(main, "startup_checks", checks)
+    return checks
+
+
+async def _poll_ready(http: httpx.AsyncClient, timeout: float) -> httpx.Response:
+    deadline = time.monotonic() + timeout
+    while True:
+        response = await http.get("/ready")
+        if response.status_code == 200 or time.monotonic() > deadline:
+            return response
+        await asyncio.sleep(0.01)
+
+
+def _client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://test")
+
+
+def test_lifespan_reaches_ready_within_bound(monkeypatch):
+    _checks(monkeypatch)
+
+    async def scenario():
+        async with main.app.router.lifespan_context(main.app), _client() as http:
+            start = time.monotonic()
+            response = await _poll_ready(http, READY_WITHIN_SECONDS)
+            return response, time.monotonic() - start
+
+    response, elapsed = asyncio.run(scenario())
+
+    assert response.status_code == 200, response.json()
+    assert elapsed < READY_WITHIN_SECONDS
+    report = response.json()
+    assert report["ready"] and report["seconds_to_ready"] < READY_WITHIN_SECONDS
+    assert all(check["ok"] for check in report["checks"].values())
+
+
+def test_app_serves_while_checks_are_pending(monkeypatch):
+    _checks(monkeypatch, search_index=lambda: time.sleep(0.5))
+
+    async def scenario():
+        async with main.app.router.lifespan_context(main.app), _client() as http:
+            start = time.monotonic()
+            health = await http.get("/health")
+            health_seconds = time.monotonic() - start
+            pending = await http.get("/ready")
+            ready = await _poll_ready(http, READY_WITHIN_SECONDS)
+            return health, health_seconds, pending, ready
+
+    health, health_seconds, pending, ready = asyncio.run(scenario())
+
+    assert health.status_code == 200 and health_seconds < 0.25
+    assert pending.status_code == 503
+    assert ready.status_code == 200
+
+
+def test_importing_app_defers_heavy_clients(tmp_path):
+    code = (
+        "import sys, app.main; "
+        "print(sorted(m for m in ('langchain_openai', 'openai', 'pypdf') if m in sys.modules))"
+    )
+    state_dir = tmp_path / "state"
+    result = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=Path(__file__).resolve().parent.parent,
+        env={**os.environ, "LOCAL_STATE_DIR": str(state_dir)},
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+    assert result.stdout.strip() == "[]"
+    # No SQLite store is opened, or its schema created, until first use.
+    assert not state_dir.exists() or not any(state_dir.iterdir())
+
+
+def test_lifespan_shutdown_stops_extraction_pool(monkeypatch):
+    _checks(monkeypatch)
+    pool = document_loader._process_pool(1)
+
+    async def scenario():
+        async with main.app.router.lifespan_context(main.app):
+            pass
+
+    asyncio.run(scenario())
+
+    assert document_loader._pool is None
+    with pytest.raises(RuntimeError):
+        pool.submit(len, "")
@@ -0,0 +1,200 @@
+import asyncio
+import hashlib
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import pytest
+from azure.core import MatchConditions
+from azure.core.exceptions import ResourceNotFoundError
+
+from app.core.config import get_settings
+from app.services import storage as storage_module
+from app.services.blob_catalog import PENDING, PROCESSED, BlobCatalog, ListedBlob, blob_catalog
+from app.services.storage import CONTENT_HASH_METADATA, PROCESSED_MARKER, StorageService
+
+
+class _Blob:
+    def __init__(self) -> None:
+        self.metadata = None
+        self.size = 0
+        self.staged = []
+        self.committed = 0
+
+    async def get_blob_properties(self):
+        if self.metadata is None:
+            raise ResourceNotFoundError("missing")
+        return SimpleNamespace(
+            size=self.size, metadata=self.metadata, last_modified=datetime.now(timezone.utc)
+        )
+
+    async def stage_block(self, block_id, data):
+        self.staged.append(data)
+
+    async def commit_block_list(self, blocks, content_settings=None, metadata=None):
+        self.committed += 1
+        self.size = sum(len(block) for block in self.staged)
+        self.metadata = metadata
+
+
+class _Client:
+    def __init__(self) -> None:
+        self.blobs = {}
+
+    def get_blob_client(self, container, name):
+        return self.blobs.setdefault((container, name), _Blob())
+
+
+@pytest.fixture
+def storage(monkeypatch):
+    service = StorageService()
+    client = _Client()
+    monkeypatch.setattr(service, "_async_client", lambda: client)
+    return service, client
+
+
+DATA = b"%PDF-1.7 quarterly retention report"
+HASH = hashlib.sha256(DATA).hexdigest()
+
+
+def _upload(service, name, content_hash=None, data=DATA):
+    read = []
+
+    async def chunks():
+        read.append(True)
+        yield data
+
+    stored = asyncio.run(service.upload_stream(chunks(), name, "application/pdf", content_hash))
+    return stored, bool(read)
+
+
+def _catalog(name, content_hash=HASH):
+    blob_catalog.record_upload(
+        ListedBlob(
+            name=name,
+            container="raw-documents",
+            size_bytes=len(DATA),
+            uploaded_at=time.time(),
+            content_hash=content_hash,
+        )
+    )
+
+
+def test_declared_hash_of_stored_blob_skips_staging(storage):
+    service, client = storage
+    _upload(service, "skip.pdf")
+
+    stored, read = _upload(service, "skip.pdf", HASH)
+
+    assert stored.duplicate_of == "skip.pdf"
+    assert not read
+    assert client.blobs[("raw-documents", "skip.pdf")].committed == 1
+
+
+def test_catalog_entry_without_blob_is_uploaded_again(storage):
+    service, client = storage
+    _catalog("deleted.pdf")
+
+    stored, read = _upload(service, "deleted.pdf", HASH)
+
+    assert read and stored.duplicate_of is None
+    assert client.blobs[("raw-documents", "deleted.pdf")].committed == 1
+
+
+def test_blob_overwritten_elsewhere_is_uploaded_again(storage):
+    service, client = storage
+    _catalog("changed.pdf")
+    client.get_blob_client("raw-documents", "changed.pdf").metadata = {
+        CONTENT_HASH_METADATA: "0" * 64
+    }
+
+    stored, _ = _upload(service, "changed.pdf")
+
+    assert stored.duplicate_of is None
+    assert client.blobs[("raw-documents", "changed.pdf")].metadata == {
+        CONTENT_HASH_METADATA: HASH
+    }
+
+
+def test_declared_hash_must_match_the_bytes(storage):
+    service, client = storage
+
+    with pytest.raises(ValueError, match="content_sha256"):
+        _upload(service, "mismatch.pdf", "f" * 64)
+
+    assert client.blobs[("raw-documents", "mismatch.pdf")].committed == 0
+
+
+class _SyncBlob:
+    def __init__(self, metadata) -> None:
+        self.metadata = metadata
+        self.tags = None
+        self.conditions = None
+
+    def get_blob_properties(self):
+        return SimpleNamespace(metadata=dict(self.metadata), etag="etag-1")
+
+    def set_blob_tags(self, tags):
+        self.tags = tags
+
+    def set_blob_metadata(self, metadata, etag=None, match_condition=None):
+        self.metadata = metadata
+        self.conditions = (etag, match_condition)
+
+
+@pytest.fixture
+def marked(tmp_path, monkeypatch):
+    service = StorageService()
+    blobs = {
+        name: _SyncBlob({CONTENT_HASH_METADATA: HASH, "owner": "records"})
+        for name in ("a.pdf", "b.pdf")
+    }
+    service._blob_client = SimpleNamespace(
+        get_blob_client=lambda container, name: blobs[name]
+    )
+    catalog = BlobCatalog(str(tmp_path / "blob_catalog.sqlite3"))
+    monkeypatch.setattr(storage_module, "blob_catalog", catalog)
+    for name in blobs:
+        catalog.record_upload(
+            ListedBlob(name=name, container="raw-documents", size_bytes=1, uploaded_at=1.0)
+        )
+    return service, blobs, catalog
+
+
+def test_tag_mode_tags_blobs_in_place(marked, monkeypatch):
+    service, blobs, catalog = marked
+    monkeypatch.setattr(get_settings(), "blob_processed_mode", "tag")
+
+    service.mark_processed(["a.pdf", "b.pdf"])
+
+    assert [blobs[name].tags for name in ("a.pdf", "b.pdf")] == [{PROCESSED_MARKER: "true"}] * 2
+    assert blobs["a.pdf"].metadata == {CONTENT_HASH_METADATA: HASH, "owner": "records"}
+    entry = catalog.get("a.pdf")
+    assert (entry.state, entry.container) == (PROCESSED, "raw-documents")
+
+
+def test_metadata_mode_keeps_existing_metadata(marked, monkeypatch):
+    service, blobs, catalog = marked
+    monkeypatch.setattr(get_settings(), "blob_processed_mode", "metadata")
+
+    service.mark_processed(["a.pdf"])
+
+    assert blobs["a.pdf"].metadata == {
+        CONTENT_HASH_METADATA: HASH,
+        "owner": "records",
+        PROCESSED_MARKER: "true",
+    }
+    # A concurrent metadata change must not be overwritten.
+    assert blobs["a.pdf"].conditions == ("etag-1", MatchConditions.IfNotModified)
+    assert blobs["b.pdf"].conditions is None
+    assert [catalog.get(name).state for name in ("a.pdf", "b.pdf")] == [PROCESSED, PENDING]
+
+
+def test_unknown_mode_is_rejected(marked, monkeypatch):
+    service, _, catalog = marked
+    monkeypatch.setattr(get_settings(), "blob_processed_mode", "rename")
+
+    with pytest.raises(ValueError, match="BLOB_PROCESSED_MODE"):
+        service.mark_processed(["a.pdf"])
+
+    assert catalog.get("a.pdf").state == PENDING
@@ -5,14 +5,33 @@ import type {
   ProcessStatus,
   UploadedFile
 } from "../types/api";
+import { Sha256 } from "./sha256";
 
 const jsonHeaders = {
   "Content-Type": "application/json"
 };
 
+// SHA-256 hex digest of a file, so the server can skip one it already holds
+// before staging any blocks. crypto.subtle only exists in secure contexts, so
+// plain-HTTP deployments hash the file stream incrementally instead.
+async function sha256(file: File): Promise<string> {
+  if (globalThis.crypto?.subtle) {
+    const digest = await crypto.subtle.digest("SHA-256", await file.arrayBuffer());
+    return Array.from(new Uint8Array(digest), (b) => b.toString(16).padStart(2, "0")).join("");
+  }
+  const hash = new Sha256();
+  const reader = file.stream().getReader();
+  for (let chunk = await reader.read(); !chunk.done; chunk = await reader.read()) {
+    hash.update(chunk.value);
+  }
+  return hash.hex();
+}
+
 export async function uploadDocuments(files: File[]): Promise<UploadedFile[]> {
   const formData = new FormData();
   files.forEach((file) => formData.append("files", file));
+  const hashes = await Promise.all(files.map(sha256));
+  hashes.forEach((hash) => formData.append("content_sha256", hash));
   const res = await fetch("/api/files/upload", {
     method: "POST",
     body: formData
@@ -6,6 +6,7 @@ export function ChatPanel() {
   const [question, setQuestion] = useState("");
   const [conversation, setConversation] = useState<{ role: "user" | "assistant"; content: string }[]>([]);
   const [response, setResponse] = useState<ChatResponse | null>(null);
+  const [conversationId, setConversationId] = useState<string | null>(null);
   const [isLoading, setLoading] = useState(false);
   const [error, setError] = useState<string | null>(null);
 
@@ -14,12 +15,16 @@ export function ChatPanel() {
     setLoading(true);
     setError(null);
     try {
+      // The server keeps the transcript under the conversation id, so only the
+      // first request needs to carry history.
       const payload = {
         question,
-        history: conversation,
-        top_k: 5
+        history: conversationId ? [] : conversation,
+        top_k: 5,
+        conversation_id: conversationId
       };
       const answer = await askQuestion(payload);
+      setConversationId(answer.conversation_id ?? null);
       setConversation((prev) => [...prev, { role: "user", content: question }, { role: "assistant", content: answer.answer }]);
       setResponse(answer);
       setQuestion("");
@@ -24,12 +24,16 @@ export type ProcessStatus = {
   state: "queued" | "running" | "completed" | "failed";
   steps: ProcessStep[];
   errors: string[];
+  docs_per_second?: number | null;
+  chunks_per_second?: number | null;
+  eta_seconds?: number | null;
 };
 
 export type ChatRequest = {
   question: string;
   history: { role: string; content: string }[];
   top_k: number;
+  conversation_id?: string | null;
 };
 
 export type Citation = {
@@ -44,4 +48,7 @@ export type ChatResponse = {
   citations: Citation[];
   latency_ms: number;
   confidence: number;
+  cached: boolean;
+  prompt_tokens_saved: number;
+  conversation_id?: string | null;
 };